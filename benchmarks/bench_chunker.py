@@ -0,0 +1,92 @@
+"""
+Нарезка длинного ответа на сообщения: старый split_message против chunker.
+
+"до"    — прежний split_message: длина в символах Python, граница только по переносу
+          строки, остаток текста копируется после каждого куска;
+"после" — chunker.split_message (один проход, длина в UTF-16) и Chunker, который
+          получает тот же текст кусочками, как при потоковой генерации.
+
+Кроме времени показывает, сколько кусков не влезло бы в лимит Telegram
+(4096 единиц UTF-16) и сколько разрезано посреди слова.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_chunker --size 200000 --repeat 20
+"""
+import argparse
+import random
+import time
+
+from chunker import Chunker, TELEGRAM_MESSAGE_LIMIT, split_message, utf16_len
+
+
+WORDS = ["помощь", "волонтёры", "сбор", "приют", "акция", "спасибо", "друзья", "город", "дети", "фонд"]
+EMOJI = ["🙏", "❤️", "🐾", "👨‍👩‍👧", "🎉", "👍🏽"]
+
+
+def old_split_message(text: str, limit: int = 4000):
+    parts = []
+    while len(text) > limit:
+        split_pos = text.rfind("\n", 0, limit)
+        if split_pos == -1:
+            split_pos = limit
+        parts.append(text[:split_pos])
+        text = text[split_pos:]
+    parts.append(text)
+    return parts
+
+
+def make_text(size: int, emoji_rate: float, seed: int = 1):
+    rnd = random.Random(seed)
+    out = []
+    length = 0
+    while length < size:
+        sentence = " ".join(rnd.choice(EMOJI) if rnd.random() < emoji_rate else rnd.choice(WORDS)
+                            for _ in range(rnd.randint(5, 20)))
+        # длинные абзацы без переносов — худший случай для старой нарезки
+        sentence = sentence.capitalize() + rnd.choice([". ", "! ", ". ", ". ", "\n\n"])
+        out.append(sentence)
+        length += len(sentence)
+    return "".join(out)
+
+
+def streamed(text: str, delta: int = 20):
+    chunker = Chunker()
+    parts = []
+    for i in range(0, len(text), delta):
+        parts.extend(chunker.feed(text[i:i + delta]))
+    parts.extend(chunker.flush())
+    return parts
+
+
+def measure(func, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parts = func(text)
+        best = min(best, time.perf_counter() - started)
+    return best, parts
+
+
+def report(name, seconds, parts):
+    too_long = sum(utf16_len(part) > TELEGRAM_MESSAGE_LIMIT for part in parts)
+    mid_word = sum(part[-1:].isalnum() and nxt[:1].isalnum() for part, nxt in zip(parts, parts[1:]))
+    print(f"    {name:<14}{seconds * 1000:>9.2f} мс  кусков: {len(parts):>4}  "
+          f"длиннее лимита: {too_long:>3}  посреди слова: {mid_word:>3}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200_000, help="длина текста, символов")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for title, emoji_rate in (("обычный текст", 0.0), ("много эмодзи", 0.3)):
+        text = make_text(args.size, emoji_rate)
+        print(f"{title}: {len(text)} символов, {utf16_len(text)} единиц UTF-16")
+        report("до", *measure(old_split_message, text, args.repeat))
+        report("после", *measure(split_message, text, args.repeat))
+        report("после, поток", *measure(streamed, text, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
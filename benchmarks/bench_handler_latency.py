@@ -0,0 +1,106 @@
+"""
+Задержка обработчиков при N одновременных пользователях.
+
+N пользователей одновременно запускают генерацию поста, а ещё один пользователь
+в это время нажимает кнопки меню. Меряем, сколько ждёт ответа "лёгкий" обработчик
+меню и сколько длится вся пачка генераций.
+
+"до"    — синхронный вызов модели прямо в обработчике (как было раньше);
+"после" — await result_gen.api_get_result с подменённым асинхронным клиентом.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_handler_latency --users 20 --latency 0.5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from types import SimpleNamespace
+
+import result_gen
+from llm_scheduler import TokenBucket
+
+
+def _completion(text):
+    message = SimpleNamespace(content=f"ответ на: {text[:20]}")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeAsyncOpenAI:
+    """Заглушка AsyncOpenAI: отвечает через `latency` секунд, не блокируя цикл событий."""
+    latency = 0.5
+
+    def __init__(self, *args, **kwargs):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _completion(messages[-1]["content"])
+
+    async def close(self):
+        pass
+
+
+def blocking_api_get_result(text, latency):
+    # так выглядел старый вызов: обработчик держит цикл событий, пока ждёт ответ
+    time.sleep(latency)
+    return _completion(text).choices[0].message.content
+
+
+async def menu_presses(stop: asyncio.Event, samples: list):
+    # нажатие меню каждые 10 мс; всё, что сверх 10 мс, — ожидание занятого цикла событий
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append(max(0.0, time.perf_counter() - started - 0.01))
+
+
+async def run(mode: str, users: int, latency: float):
+    FakeAsyncOpenAI.latency = latency
+    result_gen.AsyncOpenAI = FakeAsyncOpenAI
+    await result_gen.close_llm_client()
+    result_gen.get_client()  # как при старте бота: клиент создан до первых запросов
+    # планировщик не должен ограничивать замер: меряем только отзывчивость цикла событий
+    result_gen.scheduler.max_concurrency = users
+    result_gen.scheduler.bucket = TokenBucket(users * 100, users)
+
+    async def generate_content(user_id):
+        started = time.perf_counter()
+        if mode == "before":
+            blocking_api_get_result(f"пост {user_id}", latency)
+        else:
+            await result_gen.api_get_result(f"пост {user_id}", use_cache=False)
+        return time.perf_counter() - started
+
+    samples = []
+    stop = asyncio.Event()
+    menu = asyncio.create_task(menu_presses(stop, samples))
+    await asyncio.sleep(0.02)
+
+    started = time.perf_counter()
+    handler_latencies = await asyncio.gather(*(generate_content(i) for i in range(users)))
+    total = time.perf_counter() - started
+
+    stop.set()
+    await menu
+
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1] if samples else 0.0
+    print(f"{mode:>6}: пользователей={users} всего={total:.2f}с "
+          f"генерация p50={statistics.median(handler_latencies):.2f}с "
+          f"меню max={max(samples, default=0) * 1000:.0f}мс p95={p95 * 1000:.0f}мс "
+          f"(нажатий меню обработано: {len(samples)})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="время ответа модели, с")
+    args = parser.parse_args()
+
+    asyncio.run(run("before", args.users, args.latency))
+    asyncio.run(run("after", args.users, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Сколько памяти занимает одна картинка на пути от ответа Kandinsky до загрузки в Telegram.
+
+"до"    — response.json() → base64.b64decode → файл kandinsky_*.png → чтение файла
+          обратно → BufferedInputFile (так было до image_io);
+"после" — image_io.parse_status: base64 декодируется прямо из тела ответа,
+          те же bytes уходят в MemoryInputFile.
+
+Тело ответа в обоих случаях уже в памяти (его держит httpx) и в замер не входит:
+считается пик tracemalloc сверх него, пока картинка «загружается» (читается
+кусками, как это делает aiogram), — то есть память на одну картинку в работе.
+Для N одновременных картинок пик умножается на N.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_image_memory --size 1024 --repeat 5
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from aiogram.types import BufferedInputFile
+
+from benchmarks.fake_servers import make_png
+from image_io import MemoryInputFile, parse_status
+
+
+def status_body(png: bytes):
+    return json.dumps({
+        "uuid": "00000000-0000-0000-0000-000000000000",
+        "status": "DONE",
+        "result": {"files": [base64.b64encode(png).decode()], "censored": False},
+    }).encode()
+
+
+async def upload(input_file):
+    # aiogram отдаёт файл в aiohttp по кускам; здесь куски просто считаются
+    sent = 0
+    async for chunk in input_file.read(None):
+        sent += len(chunk)
+    return sent
+
+
+async def old_path(raw: bytes, workdir: str):
+    status_data = json.loads(raw)
+    image_data = base64.b64decode(status_data['result']['files'][0])
+    filename = os.path.join(workdir, "kandinsky_bench.png")
+    with open(filename, 'wb') as f:
+        f.write(image_data)
+    with open(filename, 'rb') as photo:
+        input_file = BufferedInputFile(photo.read(), filename="generated_image.png")
+    sent = await upload(input_file)
+    os.remove(filename)
+    return sent
+
+
+async def new_path(raw: bytes, workdir: str):
+    status_data, images = parse_status(raw)
+    return await upload(MemoryInputFile(images[0], filename="generated_image.png"))
+
+
+async def measure(path, raw, workdir, repeat):
+    peaks, times = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        sent = await path(raw, workdir)
+        times.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(peaks), min(times), sent
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024, help="сторона картинки, пикселей")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    png = make_png(args.size, seed=1)
+    raw = status_body(png)
+    print(f"картинка {len(png) / 2 ** 20:.1f} МБ, ответ status {len(raw) / 2 ** 20:.1f} МБ")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, path in (("до", old_path), ("после", new_path)):
+            peak, seconds, sent = await measure(path, raw, workdir, args.repeat)
+            assert sent == len(png)
+            print(f"    {name:<7}пик памяти на картинку {peak / 2 ** 20:>6.1f} МБ "
+                  f"({peak / len(png):.1f}× картинки), время {seconds * 1000:>6.1f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Опрос статуса Kandinsky: фиксированный интервал против image_poller.CompletionModel.
+
+Без сети: время готовности задания берётся из логнормального распределения
+(как в benchmarks/fake_servers.py), а опрос моделируется по часам.
+Для каждого способа — задержка доставки (когда узнали о готовности минус когда
+задание на самом деле закончилось) и число запросов статуса на картинку.
+
+"до"    — опрос раз в --interval секунд (прежний generate_image);
+"после" — CompletionModel, обученная на предыдущих заданиях того же прогона.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_image_polling --median 15 --sigma 0.3 --jobs 2000
+"""
+import argparse
+import random
+import statistics
+
+from image_poller import CompletionModel
+
+
+def fixed_poll(duration: float, interval: float):
+    polls = int(duration // interval) + 1
+    return polls * interval, polls
+
+
+def adaptive_poll(duration: float, model: CompletionModel):
+    elapsed = 0.0
+    delay = 0.0
+    pending_at = None
+    polls = 0
+    while True:
+        delay = model.next_delay(elapsed, delay)
+        elapsed += delay
+        polls += 1
+        if elapsed >= duration:
+            if pending_at is not None:
+                model.record((pending_at + elapsed) / 2)
+            else:
+                model.record_before(elapsed)
+            return elapsed, polls
+        pending_at = elapsed
+
+
+def report(name, delivered, durations, polls):
+    lag = sorted(d - t for d, t in zip(delivered, durations))
+    p95 = lag[int(0.95 * (len(lag) - 1))]
+    print(f"    {name:<8}задержка p50 {statistics.median(lag):>6.2f} с, p95 {p95:>6.2f} с, "
+          f"доставка p50 {statistics.median(delivered):>6.2f} с, опросов на картинку {statistics.mean(polls):>5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--median", type=float, default=15.0, help="медиана времени генерации, с")
+    parser.add_argument("--sigma", type=float, default=0.3, help="разброс (логнормальное sigma)")
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=10.0, help="прежний фиксированный интервал, с")
+    parser.add_argument("--min-gap", type=float, default=1.0)
+    parser.add_argument("--max-gap", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    durations = [rnd.lognormvariate(0, args.sigma) * args.median for _ in range(args.jobs)]
+    print(f"{args.jobs} заданий, медиана {args.median} с, sigma {args.sigma}")
+
+    fixed = [fixed_poll(d, args.interval) for d in durations]
+    report("до", [f[0] for f in fixed], durations, [f[1] for f in fixed])
+
+    model = CompletionModel(min_gap=args.min_gap, max_gap=args.max_gap)
+    adaptive = [adaptive_poll(d, model) for d in durations]
+    report("после", [a[0] for a in adaptive], durations, [a[1] for a in adaptive])
+
+
+if __name__ == "__main__":
+    main()
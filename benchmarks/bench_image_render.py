@@ -0,0 +1,78 @@
+"""
+Версии картинки под площадки (image_render): сколько весит загрузка в Telegram
+и насколько обработка задерживает цикл событий.
+
+Для каждой площадки — размер исходного PNG и готовой версии и время обработки.
+Затем --count картинок обрабатываются одновременно двумя способами:
+прямо в цикле событий и в пуле процессов; пока они идут, каждые 10 мс
+замеряется, насколько опаздывает asyncio.sleep (задержка цикла событий —
+на столько же опоздали бы ответы всем пользователям).
+
+Шумовая картинка из заглушки почти не сжимается; настоящие картинки Kandinsky
+в JPEG уменьшаются в разы сильнее.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_image_render --size 1024 --count 8
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fake_servers import make_png
+from image_render import RENDITIONS, close_render_pool, get_render_pool, render, start_render_pool
+
+
+async def loop_lag(stop: asyncio.Event):
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        worst = max(worst, time.perf_counter() - started - 0.01)
+    return worst
+
+
+async def run_inline(images, rendition):
+    for data in images:
+        render(data, rendition.width, rendition.height, rendition.fmt, rendition.quality)
+        await asyncio.sleep(0)
+
+
+async def run_pool(images, rendition):
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(
+        loop.run_in_executor(get_render_pool(), render, data, rendition.width, rendition.height,
+                             rendition.fmt, rendition.quality)
+        for data in images
+    ))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024, help="сторона картинки, пикселей")
+    parser.add_argument("--count", type=int, default=8, help="сколько картинок обрабатывать одновременно")
+    args = parser.parse_args()
+
+    images = [make_png(args.size, seed=i) for i in range(args.count)]
+    print(f"исходный PNG {len(images[0]) / 2 ** 20:.2f} МБ")
+    for platform, rendition in RENDITIONS.items():
+        started = time.perf_counter()
+        out = render(images[0], rendition.width, rendition.height, rendition.fmt, rendition.quality)
+        print(f"    {platform:<10}{rendition.spec:<22}{len(out) / 2 ** 20:>6.2f} МБ, "
+              f"{(time.perf_counter() - started) * 1000:>6.1f} мс")
+
+    start_render_pool()
+    rendition = RENDITIONS["Телеграм"]
+    for name, way in (("в цикле событий", run_inline), ("в пуле процессов", run_pool)):
+        stop = asyncio.Event()
+        lag = asyncio.create_task(loop_lag(stop))
+        started = time.perf_counter()
+        await way(images, rendition)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        print(f"    {name:<18}{args.count} картинок за {elapsed:.2f} с, "
+              f"худшая задержка цикла событий {await lag * 1000:.0f} мс")
+    close_render_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
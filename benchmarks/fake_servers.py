@@ -0,0 +1,370 @@
+"""
+Локальные заглушки внешних API для нагрузочных тестов без сети.
+
+- OpenAI-совместимый /chat/completions (как у OpenRouter), в том числе stream=true;
+- Kandinsky-совместимые key/api/v1/pipelines, pipeline/run и pipeline/status (как у fusionbrain.ai).
+
+Задержки берутся из логнормального распределения (медиана и разброс sigma),
+доли ошибок задаются отдельно: 429 с Retry-After, 5xx, зависание ответа.
+
+Запуск из корня репозитория:
+    python -m benchmarks.fake_servers --llm-latency 3 --llm-error-rate 0.05 --image-latency 20
+
+и в другом терминале направить бота на заглушки:
+    LLM_BASE_URL=http://127.0.0.1:8081/api/v1 KANDINSKY_URL=http://127.0.0.1:8082/ \\
+    KANDINSKY_POLL_MIN=0.3 KANDINSKY_POLL_MAX=2 python main1.py
+
+(опрос статуса подстраивается под время генерации сам; POLL_MIN/MAX лишь разрешают
+опрашивать чаще, чем это имеет смысл для настоящего Kandinsky)
+
+Из кода (например, в нагрузочном тесте) — start_fake_servers() / runner.cleanup().
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import struct
+import time
+import uuid
+import zlib
+
+from aiohttp import web
+
+
+class Latency:
+    """Логнормальная задержка: половина ответов быстрее median, sigma задаёт длину хвоста."""
+
+    def __init__(self, median: float, sigma: float = 0.5):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(random.gauss(0, self.sigma))
+
+
+class Faults:
+    """Доли ответов с ошибкой; остальные отвечают нормально."""
+
+    def __init__(self, rate_limit: float = 0.0, server_error: float = 0.0, hang: float = 0.0,
+                 retry_after: float = 1.0, hang_for: float = 300.0):
+        self.rate_limit = rate_limit
+        self.server_error = server_error
+        self.hang = hang
+        self.retry_after = retry_after
+        self.hang_for = hang_for
+
+    async def maybe_fail(self, stats):
+        roll = random.random()
+        if roll < self.rate_limit:
+            stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit exceeded (stand-in)", "code": 429}},
+                status=429, headers={"Retry-After": str(self.retry_after)},
+            )
+        roll -= self.rate_limit
+        if roll < self.server_error:
+            stats["server_errors"] += 1
+            return web.json_response({"error": {"message": "Upstream error (stand-in)", "code": 503}}, status=503)
+        roll -= self.server_error
+        if roll < self.hang:
+            stats["hung"] += 1
+            await asyncio.sleep(self.hang_for)
+        return None
+
+
+def _new_stats():
+    return {"requests": 0, "in_flight": 0, "max_in_flight": 0, "rate_limited": 0, "server_errors": 0, "hung": 0}
+
+
+class _InFlight:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def __exit__(self, *exc):
+        self.stats["in_flight"] -= 1
+
+
+FILLER = (
+    "Друзья, в эту субботу мы снова собираемся вместе, чтобы помочь тем, кому это нужно. "
+    "Приходите сами и зовите знакомых: каждая пара рук важна. "
+)
+
+
+class FakeLLM:
+    """
+    Заглушка OpenAI-совместимого API.
+
+    latency — время до полного ответа (без stream) или до первого токена (stream);
+    tokens_per_sec — скорость выдачи кусков при stream=true;
+    reply_chars — длина ответа.
+    """
+
+    def __init__(self, latency: Latency = None, faults: Faults = None,
+                 tokens_per_sec: float = 50.0, reply_chars: int = 1200, chunk_chars: int = 16):
+        self.latency = latency or Latency(1.0)
+        self.faults = faults or Faults()
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_chars = reply_chars
+        self.chunk_chars = chunk_chars
+        self.stats = _new_stats()
+
+    def reply(self, prompt: str):
+        head = f"Тестовый ответ на промпт из {len(prompt)} символов.\n\n"
+        body = (FILLER * (self.reply_chars // len(FILLER) + 1))[:max(0, self.reply_chars - len(head))]
+        return head + body + "\n\n#тест #заглушка"
+
+    async def chat_completions(self, request: web.Request):
+        with _InFlight(self.stats):
+            payload = await request.json()
+            failure = await self.faults.maybe_fail(self.stats)
+            if failure is not None:
+                return failure
+
+            model = payload.get("model", "stand-in")
+            prompt = payload["messages"][-1]["content"]
+            text = self.reply(prompt)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+            created = int(time.time())
+
+            await asyncio.sleep(self.latency.sample())
+
+            if not payload.get("stream"):
+                return web.json_response({
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": len(prompt) // 4,
+                        "completion_tokens": len(text) // 4,
+                        "total_tokens": (len(prompt) + len(text)) // 4,
+                    },
+                })
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await response.prepare(request)
+
+            def event(delta, finish_reason=None):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+
+            # примерно 4 символа на токен
+            pause = self.chunk_chars / 4 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0
+            await response.write(event({"role": "assistant", "content": ""}))
+            for start in range(0, len(text), self.chunk_chars):
+                await response.write(event({"content": text[start:start + self.chunk_chars]}))
+                await asyncio.sleep(pause)
+            await response.write(event({}, "stop"))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+
+    def app(self):
+        app = web.Application()
+        # подходит для любого base_url: /chat/completions, /v1/chat/completions, /api/v1/chat/completions
+        app.router.add_post("/{prefix:.*}chat/completions", self.chat_completions)
+        return app
+
+
+def make_png(size: int, seed: int = 0):
+    """PNG без Pillow: шум, чтобы файл весил как настоящая картинка, а не пару килобайт."""
+    rng = random.Random(seed)
+    raw = zlib.compress(b"".join(b"\x00" + rng.randbytes(size * 3) for _ in range(size)), 1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+
+class FakeKandinsky:
+    """
+    Заглушка fusionbrain.ai: задание создаётся сразу, а статус DONE появляется
+    через latency секунд. fail_rate — доля заданий, которые закончатся статусом FAIL.
+    """
+
+    PIPELINE_ID = "00000000-0000-0000-0000-000000000001"
+
+    def __init__(self, latency: Latency = None, faults: Faults = None, fail_rate: float = 0.0, image_size: int = 1024):
+        self.latency = latency or Latency(15.0, 0.3)
+        self.faults = faults or Faults()
+        self.fail_rate = fail_rate
+        self.image_size = image_size
+        self.jobs = {}  # uuid -> (готово в, статус, промпт, номера вариантов)
+        self.stats = _new_stats()
+        self.stats["jobs"] = 0
+        self.stats["pipelines"] = 0
+        # можно подменить на ходу, чтобы проверить реакцию бота на снятую модель
+        self.pipeline_id = self.PIPELINE_ID
+        self._images = {}
+        self._runs = {}  # prompt -> сколько заданий с ним было
+
+    def _image(self, prompt, variant=0):
+        # как у настоящего Kandinsky, новый запуск с тем же промптом — другая картинка
+        # (но вариантов немного, чтобы не раздувать память заглушки)
+        seed = zlib.crc32(prompt.encode()) + variant % 4
+        if seed not in self._images:
+            self._images[seed] = base64.b64encode(make_png(self.image_size, seed)).decode()
+        return self._images[seed]
+
+    @staticmethod
+    def _authorized(request):
+        return request.headers.get("X-Key", "").startswith("Key ") and request.headers.get("X-Secret", "").startswith("Secret ")
+
+    async def pipelines(self, request: web.Request):
+        if not self._authorized(request):
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        self.stats["pipelines"] += 1
+        return web.json_response([{
+            "id": self.pipeline_id,
+            "name": "Kandinsky (stand-in)",
+            "version": 3.1,
+            "type": "TEXT2IMAGE",
+            "status": "ACTIVE",
+        }])
+
+    async def run(self, request: web.Request):
+        with _InFlight(self.stats):
+            if not self._authorized(request):
+                return web.json_response({"error": "Unauthorized"}, status=401)
+            failure = await self.faults.maybe_fail(self.stats)
+            if failure is not None:
+                return failure
+
+            form = await request.post()
+            if form.get("pipeline_id") != self.pipeline_id:
+                return web.json_response({"error": "Pipeline not found"}, status=404)
+            params = json.loads(form["params"])
+            prompt = params.get("generateParams", {}).get("query", "")
+            first = self._runs.get(prompt, 0)
+            count = max(1, int(params.get("numImages", 1)))
+            self._runs[prompt] = first + count
+
+            job_id = str(uuid.uuid4())
+            status = "FAIL" if random.random() < self.fail_rate else "DONE"
+            self.jobs[job_id] = (time.monotonic() + self.latency.sample(), status, prompt, range(first, first + count))
+            self.stats["jobs"] += 1
+            return web.json_response({"uuid": job_id, "status": "INITIAL", "status_time": 0}, status=201)
+
+    async def status(self, request: web.Request):
+        with _InFlight(self.stats):
+            if not self._authorized(request):
+                return web.json_response({"error": "Unauthorized"}, status=401)
+
+            job_id = request.match_info["uuid"]
+            if job_id not in self.jobs:
+                return web.json_response({"error": "Not found"}, status=404)
+
+            ready_at, status, prompt, variants = self.jobs[job_id]
+            if time.monotonic() < ready_at:
+                return web.json_response({"uuid": job_id, "status": "PROCESSING"})
+
+            if status == "FAIL":
+                return web.json_response({"uuid": job_id, "status": "FAIL", "errorDescription": "Stand-in failure"})
+            return web.json_response({
+                "uuid": job_id,
+                "status": "DONE",
+                "result": {"files": [self._image(prompt, v) for v in variants], "censored": False},
+            })
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/key/api/v1/pipelines", self.pipelines)
+        app.router.add_post("/key/api/v1/pipeline/run", self.run)
+        app.router.add_get("/key/api/v1/pipeline/status/{uuid}", self.status)
+        return app
+
+
+async def _serve(app, host, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def start_fake_servers(llm: FakeLLM = None, kandinsky: FakeKandinsky = None,
+                             host: str = "127.0.0.1", llm_port: int = 8081, kandinsky_port: int = 8082):
+    """Поднимает обе заглушки в текущем цикле событий; вернёт список runner'ов для cleanup()."""
+    runners = []
+    if llm is not None:
+        runners.append(await _serve(llm.app(), host, llm_port))
+    if kandinsky is not None:
+        runners.append(await _serve(kandinsky.app(), host, kandinsky_port))
+    return runners
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=8081)
+    parser.add_argument("--kandinsky-port", type=int, default=8082)
+
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="медиана задержки до ответа/первого токена, с")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="разброс логнормального распределения")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--llm-reply-chars", type=int, default=1200)
+    parser.add_argument("--llm-rate-limit", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--llm-hang-rate", type=float, default=0.0, help="доля зависших запросов")
+
+    parser.add_argument("--image-latency", type=float, default=15.0, help="медиана времени генерации картинки, с")
+    parser.add_argument("--image-sigma", type=float, default=0.3)
+    parser.add_argument("--image-error-rate", type=float, default=0.0, help="доля ответов 503 на pipeline/run")
+    parser.add_argument("--image-fail-rate", type=float, default=0.0, help="доля заданий со статусом FAIL")
+    parser.add_argument("--image-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    llm = FakeLLM(
+        Latency(args.llm_latency, args.llm_sigma),
+        Faults(rate_limit=args.llm_rate_limit, server_error=args.llm_error_rate, hang=args.llm_hang_rate),
+        tokens_per_sec=args.llm_tokens_per_sec,
+        reply_chars=args.llm_reply_chars,
+    )
+    kandinsky = FakeKandinsky(
+        Latency(args.image_latency, args.image_sigma),
+        Faults(server_error=args.image_error_rate),
+        fail_rate=args.image_fail_rate,
+        image_size=args.image_size,
+    )
+    runners = await start_fake_servers(llm, kandinsky, args.host, args.llm_port, args.kandinsky_port)
+
+    print("Заглушки запущены. Для бота:")
+    print(f"  LLM_BASE_URL=http://{args.host}:{args.llm_port}/api/v1")
+    print(f"  KANDINSKY_URL=http://{args.host}:{args.kandinsky_port}/")
+    print("  KANDINSKY_POLL_MIN=0.3 KANDINSKY_POLL_MAX=2")
+
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"llm: {llm.stats}  kandinsky: {kandinsky.stats}")
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
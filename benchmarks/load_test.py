@@ -0,0 +1,436 @@
+"""
+Сквозной нагрузочный тест бота (main1.py) без Telegram и без внешних API.
+
+Симулированные пользователи проходят сценарии ContentGen целиком: апдейты
+подаются в dp.feed_update, ответы бота принимает поддельная сессия Bot,
+а модель и Kandinsky заменены локальными заглушками из benchmarks/fake_servers.py.
+
+- текст: /start → task_type → social → goal → audience → tone → details → cta → nuances → готовый пост;
+- картинка: /start → task_type → image_for_post → описание → style → color → generate_image → фото,
+  часть пользователей затем жмёт «Создать еще» → альбом вариантов → pick_image.
+
+В конце печатаются пропускная способность, p50/p95/p99 задержки обработчиков
+(по шагам и в целом), время до результата и память процесса.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --users 2000 --ramp 30 --image-share 0.2
+
+Лимиты бесплатного тарифа OpenRouter по умолчанию сняты (у заглушки их нет);
+чтобы проверить бота с настоящими лимитами, задайте LLM_RATE_PER_MIN и т.д. явно.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from benchmarks.fake_servers import FakeLLM, FakeKandinsky, Faults, Latency, start_fake_servers
+
+
+def percentiles(samples):
+    """p50, p95, p99 и максимум."""
+    if not samples:
+        return 0.0, 0.0, 0.0, 0.0
+    if len(samples) == 1:
+        return samples[0], samples[0], samples[0], samples[0]
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return q[49], q[94], q[98], max(samples)
+
+
+def rss_mb():
+    """Текущий RSS процесса (Linux), иначе пиковый."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class FakeSession:
+    """
+    Сессия Bot вместо api.telegram.org: отвечает на любой метод без сети,
+    с задержкой tg_latency, и будит пользователей, ждущих определённого ответа бота.
+    """
+
+    def __init__(self, tg_latency: float = 0.0):
+        from aiogram.client.session.base import BaseSession
+
+        class _Session(BaseSession):
+            async def make_request(inner, bot, method, timeout=None):
+                return await self.make_request(bot, method)
+
+            async def stream_content(inner, *args, **kwargs):
+                yield b""
+
+            async def close(inner):
+                pass
+
+        self.session = _Session()
+        self.tg_latency = tg_latency
+        self.calls = Counter()
+        self.photo_bytes = 0
+        self._message_ids = itertools.count(1_000_000)
+        self._waiters = defaultdict(list)  # chat_id -> [(predicate, future)]
+
+    def expect(self, chat_id, predicate):
+        """Future, которое завершится, когда бот отправит в чат подходящее сообщение."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return future
+
+    def _notify(self, chat_id, method):
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        for item in list(waiters):
+            predicate, future = item
+            if not future.done() and predicate(method):
+                future.set_result(time.perf_counter())
+                waiters.remove(item)
+        if not waiters:
+            del self._waiters[chat_id]
+
+    async def make_request(self, bot, method):
+        from aiogram import types
+
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.tg_latency:
+            await asyncio.sleep(self.tg_latency)
+
+        chat_id = getattr(method, "chat_id", None)
+        photo = getattr(method, "photo", None)
+        if isinstance(photo, types.InputFile):
+            self.photo_bytes += len(getattr(photo, "data", b""))
+        media = getattr(method, "media", None) or []
+        for item in media:
+            if isinstance(item.media, types.InputFile):
+                self.photo_bytes += len(getattr(item.media, "data", b""))
+        if chat_id is not None:
+            self._notify(chat_id, method)
+
+        if chat_id is not None and name == "SendMediaGroup":
+            return [self._message(chat_id, item.media) for item in media]
+
+        returning = getattr(method, "__returning__", None)
+        if chat_id is not None and returning is types.Message:
+            return self._message(chat_id, photo, getattr(method, "text", None))
+        return True
+
+    def _message(self, chat_id, photo=None, text=None):
+        from aiogram import types
+
+        message_id = next(self._message_ids)
+        # как настоящий Telegram: у загруженного фото есть file_id, по нему его можно отправить снова
+        sizes = None
+        if photo is not None:
+            file_id = photo if isinstance(photo, str) else f"photo-{message_id}"
+            sizes = [types.PhotoSize(file_id=file_id, file_unique_id=file_id, width=1024, height=1024)]
+        return types.Message(
+            message_id=message_id,
+            date=datetime.now(),
+            chat=types.Chat(id=chat_id, type="private"),
+            text=text,
+            photo=sizes,
+        )
+
+
+def _callbacks(method):
+    markup = getattr(method, "reply_markup", None)
+    rows = getattr(markup, "inline_keyboard", None) or []
+    return {button.callback_data for row in rows for button in row}
+
+
+def text_ready(method):
+    return "regenerate_text" in _callbacks(method)
+
+
+def image_ready(method):
+    callbacks = _callbacks(method)
+    # успех — кнопки "Создать еще", неудача — "Попробовать снова"
+    return "generate_another_image" in callbacks or (
+        "generate_image" in callbacks and "edit_image_prompt" in callbacks and "Выберите действие" in (method.text or "")
+    )
+
+
+def variants_ready(method):
+    return any(data.startswith("pick_image:") for data in _callbacks(method))
+
+
+def saved(method):
+    return "сохранен" in (getattr(method, "text", None) or "")
+
+
+def failed(method):
+    text = getattr(method, "text", None) or ""
+    return text.startswith("❌") or text.startswith("Произошла") or text.startswith("Ошибка") or text.startswith("Превышено")
+
+
+class Simulator:
+    def __init__(self, dp, bot, session: FakeSession, think: float, variants_share: float = 0.0):
+        self.dp = dp
+        self.bot = bot
+        self.session = session
+        self.think = think
+        self.variants_share = variants_share
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+        self.handler_latency = defaultdict(list)  # шаг -> [с]
+        self.time_to_result = defaultdict(list)  # сценарий -> [с]
+        self.flows = Counter()
+        self.updates = 0
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _chat(self, user_id):
+        return {"id": user_id, "type": "private"}
+
+    def _message(self, user_id, text, from_bot=False):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(user_id),
+            "from": {"id": self.bot.id, "is_bot": True, "first_name": "bot"} if from_bot else self._user(user_id),
+            "text": text,
+        }
+
+    async def _feed(self, step, update):
+        from aiogram import types
+
+        if self.think:
+            await asyncio.sleep(random.expovariate(1 / self.think))
+
+        update = types.Update.model_validate(update, context={"bot": self.bot})
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.handler_latency[step].append(time.perf_counter() - started)
+        self.updates += 1
+
+    async def message(self, user_id, text, step=None):
+        await self._feed(step or "message", {
+            "update_id": next(self._update_ids),
+            "message": self._message(user_id, text),
+        })
+
+    async def callback(self, user_id, data):
+        await self._feed(data.split(":", 1)[0], {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": self._message(user_id, "...", from_bot=True),
+            },
+        })
+
+    async def _wait_result(self, flow, user_id, ready, timeout, last_step):
+        done = self.session.expect(user_id, ready)
+        error = self.session.expect(user_id, failed)
+        started = time.perf_counter()
+        try:
+            await last_step()
+            finished, _ = await asyncio.wait({done, error}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            done.cancel()
+            error.cancel()
+
+        if done in finished:
+            self.flows[f"{flow}_ok"] += 1
+            self.time_to_result[flow].append(done.result() - started)
+        elif error in finished:
+            self.flows[f"{flow}_error"] += 1
+        else:
+            self.flows[f"{flow}_timeout"] += 1
+
+    async def text_flow(self, user_id, timeout):
+        goal = random.choice(["Сбор средств", "Повысить осведомлённость", "Анонс события", "Подвести итоги и статистику"])
+
+        await self.message(user_id, "/start", step="/start")
+        await self.callback(user_id, "task_type:Создание текста")
+        await self.callback(user_id, f"social:{random.choice(['ВК', 'Телеграм'])}")
+        await self.callback(user_id, f"goal:{goal}")
+        if goal == "Анонс события":
+            await self.message(user_id, "15 декабря, 14:00, ул. Пушкина д.3", step="event_date")
+        await self.callback(user_id, f"aud:{random.choice(['Жители города', 'Молодёжь', 'Семьи'])}")
+        await self.callback(user_id, f"tone:{random.choice(['Дружелюбный', 'Деловой'])}")
+        # у каждого пользователя свой бриф, иначе ответы придут из кэша
+        await self.message(user_id, f"Собираем тёплые вещи для приюта, участник {user_id}", step="details")
+        await self.message(user_id, "Приносите вещи в наш пункт сбора", step="cta")
+        await self._wait_result("text", user_id, text_ready, timeout,
+                                lambda: self.message(user_id, "нет", step="nuances"))
+
+    async def image_flow(self, user_id, timeout):
+        await self.message(user_id, "/start", step="/start")
+        await self.callback(user_id, "task_type:Создание картинки")
+        await self.callback(user_id, "image_for_post:Нет, просто картинка")
+        await self.message(user_id, f"Волонтёры сажают деревья в парке, кадр {user_id}", step="image_description")
+        await self.callback(user_id, f"image_style:{random.choice(['Реализм', 'Акварель', 'Минимализм'])}")
+        await self.callback(user_id, f"color_scheme:{random.choice(['Теплые тона', 'Пастельные цвета', 'Пропустить'])}")
+        await self._wait_result("image", user_id, image_ready, timeout,
+                                lambda: self.callback(user_id, "generate_image"))
+        if random.random() < self.variants_share:
+            # «Создать еще» — альбом вариантов, из которого выбирается один
+            await self._wait_result("variants", user_id, variants_ready, timeout,
+                                    lambda: self.callback(user_id, "generate_another_image"))
+            await self._wait_result("pick", user_id, saved, timeout,
+                                    lambda: self.callback(user_id, "pick_image:0"))
+
+
+def _print_latency_table(title, samples_by_key, scale=1000, unit="мс"):
+    print(title)
+    print(f"  {'':<22}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for key, samples in samples_by_key.items():
+        p50, p95, p99, top = percentiles(samples)
+        print(f"  {key:<22}{len(samples):>7}{p50 * scale:>10.1f}{p95 * scale:>10.1f}{p99 * scale:>10.1f}{top * scale:>10.1f}")
+    print(f"  (в {unit})")
+
+
+async def run(args):
+    llm = FakeLLM(
+        Latency(args.llm_latency, args.llm_sigma),
+        Faults(rate_limit=args.llm_rate_limit, server_error=args.llm_error_rate),
+        tokens_per_sec=args.llm_tokens_per_sec,
+    )
+    kandinsky = FakeKandinsky(Latency(args.image_latency, 0.3), image_size=args.image_size)
+    runners = await start_fake_servers(llm, kandinsky, "127.0.0.1", args.llm_port, args.kandinsky_port)
+
+    # бот импортируется после настройки окружения: адреса и лимиты читаются при импорте
+    import jobs
+    import main1
+    import image_store
+    import send_scheduler
+    import tracing
+    from aiogram import Bot
+    from result_gen import open_llm_client, close_llm_client
+    from root import close_image_client, prefetch_pipelines
+    from image_render import start_render_pool, close_render_pool
+
+    session = FakeSession(args.tg_latency)
+    # те же лимиты Telegram, что и у настоящего бота: время до результата включает очередь отправки
+    bot = send_scheduler.throttle_bot(tracing.trace_bot(Bot(token="123456:LOAD-TEST", session=session.session)))
+    sim = Simulator(main1.dp, bot, session, args.think, args.variants_share)
+
+    await open_llm_client()
+    await prefetch_pipelines(main1.KANDINSKY_API_KEY, main1.KANDINSKY_SECRET_KEY)
+    start_render_pool()
+    await jobs.start_workers(bot)
+
+    rss_start = rss_mb()
+    rss_samples = [rss_start]
+
+    async def sample_memory():
+        while True:
+            await asyncio.sleep(0.5)
+            rss_samples.append(rss_mb())
+
+    async def user(i):
+        await asyncio.sleep(args.ramp * i / max(1, args.users))
+        user_id = 10_000 + i
+        if random.random() < args.image_share:
+            await sim.image_flow(user_id, args.timeout)
+        else:
+            await sim.text_flow(user_id, args.timeout)
+
+    sampler = asyncio.create_task(sample_memory())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        await jobs.stop_workers()
+        await close_llm_client()
+        await close_image_client()
+        close_render_pool()
+        await bot.session.close()
+        for runner in runners:
+            await runner.cleanup()
+
+    all_handlers = [s for samples in sim.handler_latency.values() for s in samples]
+    completed = sum(v for k, v in sim.flows.items() if k.endswith("_ok"))
+
+    print(f"\nпользователей: {args.users} за {elapsed:.1f} с (разгон {args.ramp} с, пауза между шагами ~{args.think} с)")
+    print(f"апдейтов: {sim.updates} ({sim.updates / elapsed:.1f}/с), "
+          f"сценариев завершено: {completed} ({completed / elapsed:.2f}/с)")
+    print("исходы: " + ", ".join(f"{k}={v}" for k, v in sorted(sim.flows.items())))
+    print()
+    _print_latency_table("задержка обработчиков (dp.feed_update):", {**sim.handler_latency, "ВСЕ": all_handlers})
+    print()
+    _print_latency_table("время до результата:", sim.time_to_result, scale=1, unit="с")
+    print()
+    print(f"память: RSS в начале {rss_start:.0f} МБ, максимум {max(rss_samples):.0f} МБ "
+          f"(пиковый за процесс {peak_rss_mb():.0f} МБ), в конце {rss_mb():.0f} МБ; "
+          f"записей FSM: {len(main1.dp.storage.storage)}")
+    print("вызовы Telegram API: " + ", ".join(f"{k}={v}" for k, v in session.calls.most_common())
+          + f"; отправлено фото: {session.photo_bytes / 2 ** 20:.0f} МБ")
+    print(f"очередь отправки: {send_scheduler.scheduler.stats()}; картинки: {image_store.stats}")
+    print(f"заглушка модели: {llm.stats}")
+    print(f"заглушка Kandinsky: {kandinsky.stats}")
+
+    if args.trace:
+        print("\nгде уходит время (трассы, среднее на вызов):")
+        tracing.print_summary(tracing.traces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--ramp", type=float, default=10.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think", type=float, default=0.2, help="средняя пауза пользователя между шагами, с")
+    parser.add_argument("--image-share", type=float, default=0.2, help="доля пользователей, создающих картинку")
+    parser.add_argument("--variants-share", type=float, default=0.5,
+                        help="доля создавших картинку, кто жмёт «Создать еще» и выбирает вариант")
+    parser.add_argument("--timeout", type=float, default=600.0, help="сколько ждать результата, с")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="задержка ответа Telegram API, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace", action="store_true", help="напечатать разбивку времени по трассам")
+
+    parser.add_argument("--llm-port", type=int, default=18081)
+    parser.add_argument("--kandinsky-port", type=int, default=18082)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-sigma", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--llm-rate-limit", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--image-latency", type=float, default=3.0)
+    parser.add_argument("--image-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    os.environ.setdefault("LLM_BASE_URL", f"http://127.0.0.1:{args.llm_port}/api/v1")
+    os.environ.setdefault("KANDINSKY_URL", f"http://127.0.0.1:{args.kandinsky_port}/")
+    # задержки заглушки — секунды, а не десятки секунд, поэтому и опрос мельче
+    os.environ.setdefault("KANDINSKY_POLL_MIN", "0.3")
+    os.environ.setdefault("KANDINSKY_POLL_MAX", "2")
+    os.environ.setdefault("KANDINSKY_TIMEOUT", str(args.timeout))
+    os.environ.setdefault("LLM_RATE_PER_MIN", "1000000")
+    os.environ.setdefault("LLM_RATE_BURST", "1000")
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", "64")
+    if args.trace:
+        # сводка нужна по всем трассам прогона, а не по последней тысяче
+        os.environ.setdefault("TRACE_BUFFER_SIZE", str(args.users * 20))
+
+    # nko.db теста — во временной папке, рабочая база не трогается
+    os.chdir(tempfile.mkdtemp(prefix="nko-load-"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Нарезка текста на сообщения Telegram.
+
+- длина считается в единицах UTF-16, как у Telegram (эмодзи — две единицы);
+- режем по абзацу, иначе по строке, предложению, слову и только потом посреди слова;
+- при parse_mode Markdown/HTML разметка не рвётся: открытые на границе сущности
+  закрываются в конце сообщения и открываются заново в начале следующего,
+  ссылки и теги целиком переносятся в следующее сообщение;
+- текст не копируется заново на каждом куске: один проход по индексам,
+  и тот же Chunker умеет принимать текст по кусочкам (потоковая генерация).
+"""
+import re
+import unicodedata
+
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# место под закрывающие/открывающие метки разметки на границе сообщений
+MARKUP_RESERVE = 64
+
+_SENTENCE_ENDS = (". ", "! ", "? ", "… ", ".\t", "!\t", "?\t")
+_GLUE = "\u200d\ufe0f\ufe0e"  # ZWJ и селекторы вариантов: не отрываем от соседнего символа эмодзи
+
+_HTML_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+_HTML_VOID_TAGS = {"br"}
+
+
+def utf16_len(text: str):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _fit(text: str, start: int, budget: int):
+    """Наибольший конец куска text[start:end], который влезает в budget единиц UTF-16."""
+    end = min(len(text), start + budget)
+    units = utf16_len(text[start:end])
+    while units > budget:
+        # каждый символ — одна или две единицы, поэтому отрезаем не меньше половины лишнего
+        end -= (units - budget + 1) // 2
+        units = utf16_len(text[start:end])
+    return end
+
+
+def _split_point(text: str, start: int, end: int):
+    if end >= len(text):
+        return end
+
+    # границу ищем во второй половине окна, чтобы не плодить короткие сообщения
+    floor = start + (end - start) // 2
+
+    for sep in ("\n\n", "\n"):
+        pos = text.rfind(sep, floor, end)
+        if pos != -1:
+            return pos + len(sep)
+
+    best = max(text.rfind(sep, floor, end - len(sep) + 1) for sep in _SENTENCE_ENDS)
+    if best != -1:
+        return best + 2
+
+    pos = max(text.rfind(" ", floor, end), text.rfind("\t", floor, end))
+    if pos != -1:
+        return pos + 1
+
+    # режем посреди слова, но не внутри составного эмодзи и не перед диакритикой
+    cut = end
+    while cut > start + 1 and (text[cut] in _GLUE or text[cut - 1] == "\u200d" or unicodedata.combining(text[cut])):
+        cut -= 1
+    return cut
+
+
+def _scan_markdown(text: str, lo: int, hi: int, stack: tuple):
+    """
+    Разбор Telegram Markdown (legacy) от lo до hi при открытых сущностях stack.
+    Возвращает (открытые сущности, начало недописанной ссылки или экранирования — или None).
+    """
+    stack = list(stack)
+    unsafe = None
+    in_url = False
+    i = lo
+    while i < hi:
+        c = text[i]
+        top = stack[-1] if stack else None
+        if top == "```":
+            if text.startswith("```", i):
+                stack.pop()
+                i += 3
+                continue
+        elif top == "`":
+            if c == "`":
+                stack.pop()
+        elif in_url:
+            if c == ")":
+                in_url = False
+                unsafe = None
+        elif c == "\\":
+            if i + 1 >= hi:
+                unsafe = i
+            i += 2
+            continue
+        elif text.startswith("```", i):
+            stack.append("```")
+            i += 3
+            continue
+        elif c == "`":
+            stack.append("`")
+        elif c in "*_":
+            if top == c:
+                stack.pop()
+            else:
+                stack.append(c)
+        elif c == "[":
+            unsafe = i
+        elif c == "]" and unsafe is not None:
+            if text.startswith("(", i + 1):
+                in_url = True
+                i += 2
+                continue
+            unsafe = None
+        i += 1
+    return tuple(stack), unsafe
+
+
+def _scan_html(text: str, lo: int, hi: int, stack: tuple):
+    stack = list(stack)
+    for match in _HTML_TAG_RE.finditer(text, lo, hi):
+        closing, name = match.group(1), match.group(2).lower()
+        if closing:
+            for j in range(len(stack) - 1, -1, -1):
+                if stack[j][0] == name:
+                    del stack[j:]
+                    break
+        elif name not in _HTML_VOID_TAGS:
+            stack.append((name, match.group(0)))
+
+    # недописанный тег или &entity; на границе уходит в следующее сообщение целиком
+    unsafe = None
+    lt = text.rfind("<", lo, hi)
+    if lt != -1 and text.find(">", lt, hi) == -1:
+        unsafe = lt
+    amp = text.rfind("&", max(lo, hi - 10), hi)
+    if amp != -1 and text.find(";", amp, hi) == -1:
+        unsafe = amp if unsafe is None else min(unsafe, amp)
+    return tuple(stack), unsafe
+
+
+class Chunker:
+    """
+    Нарезает текст на сообщения не длиннее limit единиц UTF-16.
+
+        chunker = Chunker(parse_mode="Markdown")
+        for delta in stream:
+            for message in chunker.feed(delta):
+                ...  # готовое сообщение
+        for message in chunker.flush():
+            ...
+
+    pending — текст, который ещё не вошёл в готовые сообщения (для «живого» показа).
+    """
+
+    def __init__(self, limit: int = TELEGRAM_MESSAGE_LIMIT, parse_mode: str = None):
+        # меньше двух единиц не влезает даже один эмодзи
+        if limit < 2:
+            raise ValueError(f"limit must be at least 2 UTF-16 units, got {limit}")
+        self.limit = limit
+        self.parse_mode = (parse_mode or "").lower() or None
+        # при маленьком limit резерв под разметку не должен съедать всё сообщение
+        self.reserve = min(MARKUP_RESERVE, limit // 4) if self.parse_mode else 0
+
+        self._parts = []
+        self._units = 0
+        self._prefix = ""  # открывающие метки для начала следующего сообщения
+        self._stack = ()  # сущности, открытые на начале буфера
+
+    @property
+    def pending(self):
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._prefix + (self._parts[0] if self._parts else "")
+
+    def feed(self, text: str):
+        if not text:
+            return []
+        self._parts.append(text)
+        self._units += utf16_len(text)
+        # пока всё влезает, не склеиваем и не режем
+        if self._units + utf16_len(self._prefix) + self.reserve <= self.limit:
+            return []
+        return list(self._drain(final=False))
+
+    def flush(self):
+        chunks = list(self._drain(final=True))
+        self._parts = []
+        self._units = 0
+        self._prefix = ""
+        self._stack = ()
+        return chunks
+
+    def _scan(self, text, lo, hi, stack):
+        if self.parse_mode == "markdown":
+            return _scan_markdown(text, lo, hi, stack)
+        if self.parse_mode == "html":
+            return _scan_html(text, lo, hi, stack)
+        return stack, None
+
+    def _markup(self, stack):
+        if self.parse_mode == "markdown":
+            closers = "".join(reversed(stack))
+            openers = "".join(mark + "\n" if mark == "```" else mark for mark in stack)
+        elif self.parse_mode == "html":
+            closers = "".join(f"</{name}>" for name, _ in reversed(stack))
+            openers = "".join(tag for _, tag in stack)
+        else:
+            closers = openers = ""
+        return closers, openers
+
+    def _drain(self, final: bool):
+        text = self.pending[len(self._prefix):]
+        start = 0
+        units = self._units
+
+        while start < len(text):
+            prefix_units = utf16_len(self._prefix)
+            if final and units + prefix_units <= self.limit:
+                break
+            if not final and units + prefix_units + self.reserve <= self.limit:
+                break
+
+            budget = max(2, self.limit - prefix_units - self.reserve)
+            while True:
+                end = _fit(text, start, budget)
+                cut = _split_point(text, start, end)
+
+                stack, unsafe = self._scan(text, start, cut, self._stack)
+                # недописанную ссылку/тег переносим в следующее сообщение целиком, где бы она ни начиналась;
+                # на месте остаётся только ссылка длиннее целого сообщения
+                if unsafe is not None and unsafe > start:
+                    cut = unsafe
+                    stack, _ = self._scan(text, start, cut, self._stack)
+
+                closers, openers = self._markup(stack)
+                body = text[start:cut]
+                # резерва не хватило на закрывающие метки (глубокая вложенность) — режем раньше
+                over = prefix_units + utf16_len(body) + utf16_len(closers) - self.limit
+                if over <= 0 or budget <= 2:
+                    break
+                budget = max(2, min(budget, utf16_len(body)) - over)
+            chunk = self._prefix + body + closers
+            if chunk.strip():
+                yield chunk
+
+            units -= utf16_len(body)
+            self._prefix = openers
+            self._stack = stack
+            start = cut
+
+        rest = text[start:]
+        if final:
+            chunk = self._prefix + rest
+            if rest.strip():
+                yield chunk
+            rest = ""
+
+        self._parts = [rest] if rest else []
+        self._units = units if rest else 0
+
+
+def iter_chunks(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT, parse_mode: str = None):
+    chunker = Chunker(limit, parse_mode)
+    yield from chunker.feed(text)
+    yield from chunker.flush()
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT, parse_mode: str = None):
+    return list(iter_chunks(text, limit, parse_mode))
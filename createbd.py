@@ -1,3 +1,31 @@
+import os
+import sqlite3
+import threading
+
+from metrics import TimedConnection
+
+
+DB_PATH = 'nko.db'
+
+_ready_paths = set()
+_ready_lock = threading.Lock()
+
+
+def connect(path: str = DB_PATH):
+    """Соединение с базой (с замером запросов); таблицы создаются при первом соединении за процесс."""
+    con = sqlite3.connect(path, factory=TimedConnection)
+    ready_key = os.path.abspath(path)
+    if ready_key not in _ready_paths:
+        # первые соединения приходят из разных потоков (asyncio.to_thread) одновременно,
+        # а проверка столбцов и ALTER TABLE в create_tables не атомарны
+        with _ready_lock:
+            if ready_key not in _ready_paths:
+                create_tables(con.cursor())
+                con.commit()
+                _ready_paths.add(ready_key)
+    return con
+
+
 def create_tables(cur):
     cur.execute('''
         CREATE TABLE IF NOT EXISTS nko_info (
@@ -23,4 +51,147 @@ def create_tables(cur):
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (nko_id) REFERENCES nko_info (nko_id)
         )
-    ''')
\ No newline at end of file
+    ''')
+
+    # кэш ответов модели: ключ — хэш нормализованного промпта и имени модели
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS completion_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            completion TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_completion_cache_last_used
+        ON completion_cache (last_used_at)
+    ''')
+
+    # фоновые задания генерации: переживают перезапуск бота
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL, -- 'text', 'image'
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER,
+            payload TEXT NOT NULL, -- JSON: промпт и данные брифа
+            status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'running', 'done', 'failed'
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_status
+        ON jobs (status)
+    ''')
+
+    # предгенерация варианта для "Создать заново" включается отдельно для каждого НКО
+    cur.execute("PRAGMA table_info(nko_info)")
+    if 'speculative' not in [row[1] for row in cur.fetchall()]:
+        cur.execute("ALTER TABLE nko_info ADD COLUMN speculative INTEGER DEFAULT 0")
+
+    # профиль стиля НКО: считается один раз по примерам и дополняется новыми постами
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS nko_style (
+            nko_id INTEGER PRIMARY KEY,
+            post_count INTEGER NOT NULL DEFAULT 0,
+            total_chars INTEGER NOT NULL DEFAULT 0,
+            total_sentences INTEGER NOT NULL DEFAULT 0,
+            total_emoji INTEGER NOT NULL DEFAULT 0,
+            total_hashtags INTEGER NOT NULL DEFAULT 0,
+            total_exclamations INTEGER NOT NULL DEFAULT 0,
+            address_you_formal INTEGER NOT NULL DEFAULT 0,
+            address_you_informal INTEGER NOT NULL DEFAULT 0,
+            top_emoji TEXT, -- JSON: эмодзи -> сколько раз
+            top_hashtags TEXT, -- JSON: хештег -> сколько раз
+            top_words TEXT, -- JSON: слово -> сколько раз
+            digest TEXT,
+            last_post_id INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (nko_id) REFERENCES nko_info (nko_id)
+        )
+    ''')
+
+    # сгенерированные картинки: файл images/<hash[:2]>/<hash>, file_id — после первой загрузки в Telegram
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS image_blobs (
+            image_hash TEXT PRIMARY KEY, -- SHA-256 содержимого
+            size INTEGER NOT NULL,
+            file_id TEXT,
+            prompt TEXT,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_image_blobs_last_used
+        ON image_blobs (last_used_at)
+    ''')
+
+    # версии картинки под площадку (обрезка, размер, формат); сами файлы тоже в image_blobs
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS image_renditions (
+            image_hash TEXT NOT NULL, -- исходная картинка
+            platform TEXT NOT NULL,
+            spec TEXT NOT NULL, -- параметры обработки: при их смене версия делается заново
+            rendition_hash TEXT NOT NULL,
+            PRIMARY KEY (image_hash, platform)
+        )
+    ''')
+
+    # за сколько секунд заканчивались последние задания Kandinsky (image_poller)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS image_durations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            duration REAL NOT NULL
+        )
+    ''')
+
+    # картинка поста: запрос к Kandinsky и ссылка на файл в image_blobs
+    cur.execute("PRAGMA table_info(posts)")
+    post_columns = [row[1] for row in cur.fetchall()]
+    if 'image_prompt' not in post_columns:
+        cur.execute("ALTER TABLE posts ADD COLUMN image_prompt TEXT")
+    if 'image_hash' not in post_columns:
+        cur.execute("ALTER TABLE posts ADD COLUMN image_hash TEXT")
+
+    create_posts_index(cur)
+
+
+def create_posts_index(cur):
+    # полнотекстовый индекс по постам для подбора похожих примеров (если SQLite собран с FTS5)
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'")
+    if cur.fetchone() is None:
+        try:
+            cur.execute('''
+                CREATE VIRTUAL TABLE posts_fts USING fts5(
+                    content,
+                    content='posts',
+                    content_rowid='post_id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return
+        cur.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, content) VALUES (new.post_id, new.content);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, content) VALUES ('delete', old.post_id, old.content);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF content ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, content) VALUES ('delete', old.post_id, old.content);
+            INSERT INTO posts_fts (rowid, content) VALUES (new.post_id, new.content);
+        END
+    ''')
@@ -0,0 +1,60 @@
+"""
+Картинка от Kandinsky до Telegram — без временных файлов и лишних копий.
+
+Ответ pipeline/status с готовой картинкой — это JSON, в котором лежит несколько
+мегабайт base64. json.loads сделал бы из них ещё одну строку такого же размера,
+поэтому base64 декодируется прямо из тела ответа (memoryview, без копии) в один
+объект bytes, а JSON разбирается уже без картинки. Те же bytes уходят в Telegram
+кусками-memoryview, тоже без копирования.
+"""
+import binascii
+import json
+import re
+
+from aiogram.types import InputFile
+
+
+_FILES_RE = re.compile(rb'"files"\s*:\s*\[')
+
+
+def parse_status(raw: bytes):
+    """
+    Разбирает ответ pipeline/status. Возвращает (status_data, images): status_data —
+    словарь ответа, где вместо картинок в result.files пустой список, images — список bytes.
+    """
+    match = _FILES_RE.search(raw)
+    if match is None:
+        return json.loads(raw), []
+
+    view = memoryview(raw)
+    images = []
+    pos = match.end()
+    while True:
+        start = raw.find(b'"', pos)
+        close = raw.find(b']', pos)
+        if start == -1 or close < start:
+            break
+        end = raw.find(b'"', start + 1)
+        # в base64 нет кавычек; экранированный "\/" a2b_base64 читает как "/", пропуская "\"
+        images.append(binascii.a2b_base64(view[start + 1:end]))
+        pos = end + 1
+
+    # остальной JSON маленький: склеиваем его без картинок и разбираем как обычно
+    status_data = json.loads(raw[:match.end()] + raw[close:])
+    return status_data, images
+
+
+class MemoryInputFile(InputFile):
+    """
+    Как aiogram BufferedInputFile, но отдаёт куски как memoryview
+    над исходными bytes, а не копии по chunk_size.
+    """
+
+    def __init__(self, data: bytes, filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.data = data
+
+    async def read(self, bot):
+        view = memoryview(self.data)
+        for offset in range(0, len(view), self.chunk_size):
+            yield view[offset:offset + self.chunk_size]
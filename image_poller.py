@@ -0,0 +1,125 @@
+"""
+Когда спрашивать у Kandinsky статус задания.
+
+Вместо опроса раз в 10 секунд запоминаем, за сколько заканчивались последние
+задания, и каждый следующий опрос назначаем на момент, к которому с вероятностью
+_COMPLETION_ODDS закончится задание, ещё не готовое сейчас. Около медианы такие
+моменты идут часто, до неё опросов нет совсем, а в длинной очереди интервал
+растёт (но не больше _ELAPSED_SHARE от уже прошедшего ожидания).
+Пока истории мало, опрос начинается часто и постепенно редеет; чтобы так не было
+после каждого перезапуска, история хранится в таблице image_durations базы nko.db.
+"""
+import os
+import sqlite3
+from bisect import bisect_right, insort
+from collections import deque
+
+from createbd import connect
+from metrics import Histogram
+
+
+# самый частый и самый редкий опрос, с
+KANDINSKY_POLL_MIN = float(os.getenv("KANDINSKY_POLL_MIN", "1"))
+KANDINSKY_POLL_MAX = float(os.getenv("KANDINSKY_POLL_MAX", "30"))
+# сколько последних заданий помнить и с какого количества доверять истории
+KANDINSKY_POLL_HISTORY = int(os.getenv("KANDINSKY_POLL_HISTORY", "200"))
+KANDINSKY_POLL_MIN_SAMPLES = int(os.getenv("KANDINSKY_POLL_MIN_SAMPLES", "10"))
+
+POLL_HISTORY_DB = 'nko.db'
+
+# доля ещё не готовых заданий, которая должна закончиться к следующему опросу:
+# чуть больше половины — меньше опросов ценой небольшой задержки (см. benchmarks/bench_image_polling.py)
+_COMPLETION_ODDS = 0.6
+# интервал не больше этой доли уже прошедшего ожидания: на 40-й секунде — не дольше 8 с
+_ELAPSED_SHARE = 0.2
+# во сколько раз растёт интервал без истории и за пределами известных времён
+_BACKOFF = 1.5
+
+
+class CompletionModel:
+    def __init__(self, min_gap: float = KANDINSKY_POLL_MIN, max_gap: float = KANDINSKY_POLL_MAX,
+                 history: int = KANDINSKY_POLL_HISTORY, min_samples: int = KANDINSKY_POLL_MIN_SAMPLES):
+        self.max_gap = max_gap
+        self.min_gap = min(min_gap, max_gap)
+        self.min_samples = min_samples
+        self._recent = deque(maxlen=history)
+        self._sorted = []
+
+    def record(self, duration: float):
+        """Задание было готово через duration секунд после запуска. Возвращает записанное время."""
+        if len(self._recent) == self._recent.maxlen:
+            self._sorted.remove(self._recent[0])
+        self._recent.append(duration)
+        insort(self._sorted, duration)
+        return duration
+
+    def record_before(self, upper: float):
+        """
+        Задание оказалось готово уже на первом опросе: известно только, что оно
+        заняло не больше upper секунд. Середина (0 + upper) / 2 занижала бы историю,
+        а пропуск таких заданий завышал бы её (и опрос уходил бы всё позже),
+        поэтому записываем медиану прошлых заданий, уложившихся в upper.
+        """
+        known = bisect_right(self._sorted, upper)
+        return self.record(self._sorted[known // 2] if known else upper)
+
+    def next_delay(self, elapsed: float, last_delay: float = 0.0):
+        """Через сколько секунд снова спросить статус, если с запуска прошло elapsed и задание не готово."""
+        longest = self.max_gap if not elapsed else max(self.min_gap, _ELAPSED_SHARE * elapsed)
+        longest = min(self.max_gap, longest)
+
+        n = len(self._sorted)
+        done_share = bisect_right(self._sorted, elapsed) / n if n else 0.0
+        if n < self.min_samples or done_share >= 0.99:
+            # истории нет или задание идёт дольше почти всех прошлых — частый опрос, который редеет
+            return min(longest, max(self.min_gap, last_delay * _BACKOFF))
+
+        target = done_share + _COMPLETION_ODDS * (1 - done_share)
+        delay = self._sorted[min(n - 1, int(target * n))] - elapsed
+        return min(longest, max(self.min_gap, delay))
+
+
+def load_history(model: "CompletionModel"):
+    """Заполняет модель временами последних заданий из базы (при старте бота)."""
+    con = connect(POLL_HISTORY_DB)
+    try:
+        rows = con.execute(
+            "SELECT duration FROM image_durations ORDER BY id DESC LIMIT ?", (model._recent.maxlen,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Poll history error: {e}")
+        return
+    finally:
+        con.close()
+    for (duration,) in reversed(rows):
+        model.record(duration)
+
+
+def save_duration(duration: float, history: int = KANDINSKY_POLL_HISTORY):
+    con = connect(POLL_HISTORY_DB)
+    try:
+        cur = con.execute("INSERT INTO image_durations (duration) VALUES (?)", (duration,))
+        # храним не больше, чем модель помнит
+        con.execute("DELETE FROM image_durations WHERE id <= ?", (cur.lastrowid - history,))
+        con.commit()
+    except sqlite3.Error as e:
+        print(f"Poll history error: {e}")
+    finally:
+        con.close()
+
+
+def retry_after(response):
+    """Подсказка сервера, раньше которой спрашивать нет смысла (заголовок Retry-After), с."""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+IMAGE_STATUS_POLLS = Histogram(
+    "nko_image_status_polls", "Сколько раз спросили статус одной картинки", (),
+    (1, 2, 3, 4, 5, 7, 10, 15, 20, 30),
+)
+
+completion_model = CompletionModel()
@@ -0,0 +1,136 @@
+"""
+Версии картинки под площадку: Kandinsky отдаёт квадратный PNG 1024×1024 на
+несколько мегабайт, а в ленту нужен свой формат кадра и сжатый JPEG/WebP.
+
+Обрезка, масштаб и кодирование идут в отдельных процессах (ProcessPoolExecutor,
+IMAGE_RENDER_WORKERS) — работа Pillow не держит ни цикл событий, ни GIL.
+Готовая версия кладётся в image_store и запоминается по (картинка, площадка),
+так что повторная отправка не пересчитывает её и не загружает заново (file_id).
+Без Pillow картинка уходит как есть.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from image_store import get_rendition, set_rendition, store_image
+from metrics import Counter, IMAGE_PHASE
+from tracing import span
+
+
+IMAGE_RENDER_WORKERS = int(os.getenv("IMAGE_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# JPEG или WEBP; качество — по шкале Pillow (для WebP 80 примерно равно JPEG 85)
+IMAGE_RENDER_FORMAT = os.getenv("IMAGE_RENDER_FORMAT", "JPEG").upper()
+IMAGE_RENDER_QUALITY = int(os.getenv("IMAGE_RENDER_QUALITY", "85"))
+
+
+class Rendition:
+    def __init__(self, width: int, height: int, fmt: str = IMAGE_RENDER_FORMAT, quality: int = IMAGE_RENDER_QUALITY):
+        self.width = width
+        self.height = height
+        self.fmt = fmt
+        self.quality = quality
+
+    @property
+    def spec(self):
+        # попадает в кэш: поменяли параметры — старые версии не используются
+        return f"{self.width}x{self.height}:{self.fmt}:{self.quality}"
+
+
+RENDITIONS = {
+    # Telegram ужимает фото до 1280 по большей стороне — больше отправлять незачем
+    "Телеграм": Rendition(1280, 1280),
+    # в ленте ВК вертикальный кадр 4:5 занимает больше места, чем квадрат
+    "ВК": Rendition(1080, 1350),
+}
+DEFAULT_PLATFORM = "Телеграм"
+
+IMAGE_RENDITIONS = Counter(
+    "nko_image_renditions_total", "Версии картинок под площадки: hit — из кэша, render — сделаны заново",
+    ("platform", "result"),
+)
+
+_pool = None
+
+
+def get_render_pool():
+    global _pool
+    if _pool is None:
+        # fork: spawn заново импортировал бы main1 с aiogram (секунды на процесс).
+        # Fork безопасен, только пока в процессе один поток, поэтому start_render_pool
+        # вызывается первым делом в main(); если потоки уже есть — медленный, но надёжный spawn
+        method = "fork" if threading.active_count() == 1 else "spawn"
+        _pool = ProcessPoolExecutor(IMAGE_RENDER_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def start_render_pool():
+    """
+    Запускает процессы пула (с fork — все сразу, при первой задаче). Вызывать до
+    всего, что заводит потоки: сервера метрик, HTTP-клиентов, asyncio.to_thread.
+    """
+    if Image is not None:
+        get_render_pool().submit(int)
+
+
+def close_render_pool():
+    global _pool
+    if _pool is not None:
+        # не ждём процессы: вызывается из цикла событий при остановке бота
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def render(data: bytes, width: int, height: int, fmt: str, quality: int):
+    """Обрезает картинку по центру до пропорций width:height, уменьшает (но не увеличивает) и кодирует."""
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert("RGB")
+        scale = min(1.0, image.width / width, image.height / height)
+        size = (round(width * scale), round(height * scale))
+        image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+
+        out = BytesIO()
+        if fmt == "WEBP":
+            image.save(out, "WEBP", quality=quality, method=6)
+        else:
+            image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+async def render_for(image_hash: str, data: bytes, platform: str = None):
+    """
+    Версия картинки для площадки: (хэш, bytes). bytes — None, если версия уже
+    была в хранилище (send_stored_photo возьмёт её по file_id или с диска).
+    Для неизвестной площадки, без Pillow или при ошибке — исходная картинка.
+    """
+    platform = platform if platform in RENDITIONS else DEFAULT_PLATFORM
+    rendition = RENDITIONS[platform]
+    if Image is None:
+        return image_hash, data
+
+    rendition_hash = await asyncio.to_thread(get_rendition, image_hash, platform, rendition.spec)
+    if rendition_hash:
+        IMAGE_RENDITIONS.inc(platform=platform, result='hit')
+        return rendition_hash, None
+
+    loop = asyncio.get_running_loop()
+    try:
+        with IMAGE_PHASE.time(phase='render'), span('image:render', platform=platform):
+            rendered = await loop.run_in_executor(
+                get_render_pool(), render, data, rendition.width, rendition.height, rendition.fmt, rendition.quality
+            )
+    except Exception as e:
+        print(f"❌ Ошибка обработки картинки для {platform}: {e}")
+        return image_hash, data
+
+    IMAGE_RENDITIONS.inc(platform=platform, result='render')
+    rendition_hash = await asyncio.to_thread(store_image, rendered)
+    await asyncio.to_thread(set_rendition, image_hash, platform, rendition.spec, rendition_hash)
+    return rendition_hash, rendered
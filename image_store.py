@@ -0,0 +1,266 @@
+"""
+Хранилище сгенерированных картинок: файл на диске под именем своего SHA-256
+(одинаковые картинки лежат один раз), учёт в таблице image_blobs базы nko.db.
+
+- вытесняются давно не использованные картинки, когда суммарный размер больше
+  IMAGE_STORE_MAX_MB; картинки, сохранённые в посты, не вытесняются никогда;
+- после первой загрузки в Telegram запоминается file_id, и повторная отправка
+  той же картинки — это короткий запрос с file_id, без загрузки файла.
+
+Функции с диском и базой синхронные: из обработчиков — через asyncio.to_thread.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputMediaPhoto
+
+from createbd import connect
+from image_io import MemoryInputFile
+from metrics import Counter, Gauge
+
+
+IMAGE_STORE_DB = 'nko.db'
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "images")
+IMAGE_STORE_MAX_MB = float(os.getenv("IMAGE_STORE_MAX_MB", "500"))
+
+stats = {"uploads": 0, "file_id_sends": 0}
+
+Counter("nko_image_sends_total", "Отправки картинок: upload — загрузка файла, file_id — повторная без загрузки",
+        ("mode",), func=lambda: {("upload",): stats["uploads"], ("file_id",): stats["file_id_sends"]})
+Gauge("nko_image_store_bytes", "Размер хранилища картинок на диске", func=lambda: store_size())
+
+
+def image_path(image_hash: str):
+    # два уровня каталогов, чтобы в одном не копились тысячи файлов
+    return os.path.join(IMAGE_STORE_DIR, image_hash[:2], image_hash)
+
+
+def store_image(data: bytes, prompt: str = None):
+    """Кладёт картинку в хранилище (если её там ещё нет) и возвращает её SHA-256."""
+    image_hash = hashlib.sha256(data).hexdigest()
+    path = image_path(image_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # пишем во временный файл и переименовываем: недописанный файл никто не прочитает;
+        # имя у каждого вызова своё — одну картинку могут сохранять сразу два потока
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if not os.path.exists(path):
+                raise
+            # ту же картинку уже положил другой вызов
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    now = time.time()
+    con = connect(IMAGE_STORE_DB)
+    cur = con.cursor()
+    try:
+        cur.execute(
+            "INSERT INTO image_blobs (image_hash, size, prompt, created_at, last_used_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (image_hash) DO UPDATE SET last_used_at = excluded.last_used_at",
+            (image_hash, len(data), prompt, now, now)
+        )
+        con.commit()
+        _evict(con)
+    except sqlite3.Error as e:
+        print(f"Image store error: {e}")
+    finally:
+        con.close()
+    return image_hash
+
+
+def _evict(con):
+    cur = con.cursor()
+    cur.execute("SELECT COALESCE(SUM(size), 0) FROM image_blobs")
+    excess = cur.fetchone()[0] - IMAGE_STORE_MAX_MB * 2 ** 20
+    if excess <= 0:
+        return
+
+    # самые давно использованные, кроме сохранённых в посты
+    cur.execute(
+        "SELECT image_hash, size FROM image_blobs "
+        "WHERE image_hash NOT IN (SELECT image_hash FROM posts WHERE image_hash IS NOT NULL) "
+        "ORDER BY last_used_at"
+    )
+    evicted = []
+    for image_hash, size in cur.fetchall():
+        if excess <= 0:
+            break
+        evicted.append(image_hash)
+        excess -= size
+
+    cur.executemany("DELETE FROM image_blobs WHERE image_hash = ?", [(h,) for h in evicted])
+    con.commit()
+    for image_hash in evicted:
+        try:
+            os.remove(image_path(image_hash))
+        except FileNotFoundError:
+            pass
+
+
+def _filename(image_hash: str, data: bytes):
+    # Kandinsky отдаёт PNG, версии для площадок — JPEG или WebP
+    if data[:2] == b'\xff\xd8':
+        ext = 'jpg'
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        ext = 'webp'
+    else:
+        ext = 'png'
+    return f"{image_hash[:16]}.{ext}"
+
+
+def load_image(image_hash: str):
+    try:
+        with open(image_path(image_hash), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def get_file_id(image_hash: str):
+    con = connect(IMAGE_STORE_DB)
+    cur = con.cursor()
+    try:
+        cur.execute("SELECT file_id FROM image_blobs WHERE image_hash = ?", (image_hash,))
+        row = cur.fetchone()
+        if row is not None:
+            cur.execute("UPDATE image_blobs SET last_used_at = ? WHERE image_hash = ?", (time.time(), image_hash))
+            con.commit()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"Image store error: {e}")
+        return None
+    finally:
+        con.close()
+
+
+def set_file_id(image_hash: str, file_id: str = None):
+    con = connect(IMAGE_STORE_DB)
+    try:
+        con.execute("UPDATE image_blobs SET file_id = ? WHERE image_hash = ?", (file_id, image_hash))
+        con.commit()
+    except sqlite3.Error as e:
+        print(f"Image store error: {e}")
+    finally:
+        con.close()
+
+
+def get_rendition(image_hash: str, platform: str, spec: str):
+    """Хэш готовой версии картинки для площадки; None — её нет, она с другими параметрами или уже вытеснена."""
+    con = connect(IMAGE_STORE_DB)
+    try:
+        row = con.execute(
+            "SELECT r.rendition_hash FROM image_renditions r "
+            "JOIN image_blobs b ON b.image_hash = r.rendition_hash "
+            "WHERE r.image_hash = ? AND r.platform = ? AND r.spec = ?",
+            (image_hash, platform, spec)
+        ).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"Image store error: {e}")
+        return None
+    finally:
+        con.close()
+
+
+def set_rendition(image_hash: str, platform: str, spec: str, rendition_hash: str):
+    con = connect(IMAGE_STORE_DB)
+    try:
+        con.execute(
+            "INSERT INTO image_renditions (image_hash, platform, spec, rendition_hash) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (image_hash, platform) DO UPDATE SET spec = excluded.spec, rendition_hash = excluded.rendition_hash",
+            (image_hash, platform, spec, rendition_hash)
+        )
+        con.commit()
+    except sqlite3.Error as e:
+        print(f"Image store error: {e}")
+    finally:
+        con.close()
+
+
+def store_size():
+    con = connect(IMAGE_STORE_DB)
+    try:
+        return con.execute("SELECT COALESCE(SUM(size), 0) FROM image_blobs").fetchone()[0]
+    except sqlite3.Error:
+        return 0
+    finally:
+        con.close()
+
+
+async def send_stored_photo(bot, chat_id: int, image_hash: str, data: bytes = None, **kwargs):
+    """
+    Отправляет картинку из хранилища: по file_id, если она уже была в Telegram,
+    иначе загружает (data или файл из хранилища) и запоминает file_id.
+    None — картинки нет ни в Telegram, ни на диске.
+    """
+    file_id = await asyncio.to_thread(get_file_id, image_hash)
+    if file_id:
+        try:
+            message = await bot.send_photo(chat_id, photo=file_id, **kwargs)
+            stats["file_id_sends"] += 1
+            return message
+        except TelegramBadRequest as e:
+            # file_id от другого бота или устарел — загружаем заново
+            print(f"file_id не подошёл ({e}), загружаю картинку заново")
+            await asyncio.to_thread(set_file_id, image_hash, None)
+
+    if data is None:
+        data = await asyncio.to_thread(load_image, image_hash)
+        if data is None:  # уже вытеснена и в Telegram не загружалась
+            return None
+    message = await bot.send_photo(chat_id, photo=MemoryInputFile(data, filename=_filename(image_hash, data)), **kwargs)
+    stats["uploads"] += 1
+
+    photo = getattr(message, "photo", None)
+    if photo:
+        # последний размер — исходный, его file_id и переиспользуем
+        await asyncio.to_thread(set_file_id, image_hash, photo[-1].file_id)
+    return message
+
+
+async def send_stored_album(bot, chat_id: int, images, caption: str = None):
+    """
+    Отправляет несколько картинок из хранилища одним альбомом (media group).
+    images — список (image_hash, data); data может быть None, тогда файл берётся с диска.
+    Уже бывшие в Telegram картинки уходят по file_id, новые загружаются, и их file_id запоминается.
+    """
+    media, hashes = [], []
+    for image_hash, data in images:
+        file_id = await asyncio.to_thread(get_file_id, image_hash)
+        if file_id:
+            photo = file_id
+            stats["file_id_sends"] += 1
+        else:
+            if data is None:
+                data = await asyncio.to_thread(load_image, image_hash)
+                if data is None:
+                    continue
+            photo = MemoryInputFile(data, filename=_filename(image_hash, data))
+            stats["uploads"] += 1
+        media.append(InputMediaPhoto(media=photo, caption=caption if not media else None))
+        hashes.append(image_hash)
+
+    if not media:
+        return []
+    if len(media) == 1:
+        # альбом из одной картинки Telegram не принимает
+        message = await send_stored_photo(bot, chat_id, hashes[0], caption=caption)
+        return [message] if message else []
+
+    messages = await bot.send_media_group(chat_id, media=media)
+    for image_hash, message in zip(hashes, messages):
+        photo = getattr(message, "photo", None)
+        if photo:
+            await asyncio.to_thread(set_file_id, image_hash, photo[-1].file_id)
+    return messages
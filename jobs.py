@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import time
+
+from createbd import connect
+from metrics import Gauge
+from tracing import current_trace_id, start_trace, span
+
+
+JOBS_DB = 'nko.db'
+# отдельные пулы воркеров: долгие картинки не занимают места текстовых заданий;
+# картинка ждёт Kandinsky через asyncio.sleep и не держит поток, поэтому воркеров может быть больше
+JOB_WORKERS = {
+    "text": int(os.getenv("JOB_TEXT_WORKERS", "8")),
+    "image": int(os.getenv("JOB_IMAGE_WORKERS", "16")),
+}
+# задание, которое столько раз начиналось и не завершилось (падение бота посреди работы), больше не запускаем
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+_handlers = {}
+_queues = {}
+_workers = []
+
+Gauge("nko_job_queue_depth", "Задания, ждущие свободного воркера", ("kind",),
+      func=lambda: {(kind,): queue.qsize() for kind, queue in _queues.items()})
+
+
+class Job:
+    def __init__(self, job_id, kind, chat_id, user_id, payload, attempts):
+        self.job_id = job_id
+        self.kind = kind
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.payload = payload
+        self.attempts = attempts
+
+    @property
+    def resumed(self):
+        """Задание уже запускалось раньше — значит, бот перезапустился посреди работы."""
+        return self.attempts > 1
+
+
+def job_handler(kind: str):
+    """Регистрирует обработчик заданий вида kind: async def handler(bot, job)."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def _insert_job(kind: str, chat_id: int, user_id: int, payload: dict):
+    con = connect(JOBS_DB)
+    cur = con.cursor()
+    try:
+        cur.execute(
+            "INSERT INTO jobs (kind, chat_id, user_id, payload) VALUES (?, ?, ?, ?)",
+            (kind, chat_id, user_id, json.dumps(payload, ensure_ascii=False))
+        )
+        con.commit()
+        return cur.lastrowid
+    finally:
+        con.close()
+
+
+async def enqueue(kind: str, chat_id: int, user_id: int, payload: dict):
+    # по trace_id трасса задания связывается с трассой апдейта, который его поставил
+    payload = {**payload, "trace_id": current_trace_id(), "enqueued_at": time.time()}
+    # запись в базу — в потоке, чтобы не держать цикл событий; очередь — только из цикла
+    job_id = await asyncio.to_thread(_insert_job, kind, chat_id, user_id, payload)
+
+    # до запуска воркеров задание просто лежит в базе и будет подхвачено при старте
+    if kind in _queues:
+        _queues[kind].put_nowait(job_id)
+    return job_id
+
+
+def _set_status(job_id: int, status: str, error: str = None):
+    con = connect(JOBS_DB)
+    try:
+        con.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE job_id = ?",
+            (status, error, job_id)
+        )
+        con.commit()
+    finally:
+        con.close()
+
+
+def _claim(job_id: int):
+    con = connect(JOBS_DB)
+    cur = con.cursor()
+    try:
+        cur.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP "
+            "WHERE job_id = ? AND status = 'pending'",
+            (job_id,)
+        )
+        con.commit()
+        if cur.rowcount == 0:
+            return None
+
+        cur.execute(
+            "SELECT job_id, kind, chat_id, user_id, payload, attempts FROM jobs WHERE job_id = ?",
+            (job_id,)
+        )
+        job_id, kind, chat_id, user_id, payload, attempts = cur.fetchone()
+        return Job(job_id, kind, chat_id, user_id, json.loads(payload), attempts)
+    finally:
+        con.close()
+
+
+def _pending_job_ids():
+    con = connect(JOBS_DB)
+    cur = con.cursor()
+    try:
+        # 'running' после перезапуска — это задания, прерванные падением бота
+        cur.execute(
+            "UPDATE jobs SET status = 'failed', error = 'too many attempts' "
+            "WHERE status IN ('pending', 'running') AND attempts >= ?",
+            (JOB_MAX_ATTEMPTS,)
+        )
+        cur.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+        con.commit()
+        cur.execute("SELECT job_id, kind FROM jobs WHERE status = 'pending' ORDER BY job_id")
+        return cur.fetchall()
+    finally:
+        con.close()
+
+
+async def _worker(bot, queue: asyncio.Queue):
+    while True:
+        job_id = await queue.get()
+        try:
+            job = await asyncio.to_thread(_claim, job_id)
+            if job is None:
+                continue
+
+            handler = _handlers.get(job.kind)
+            if handler is None:
+                await asyncio.to_thread(_set_status, job.job_id, 'failed', f"no handler for {job.kind}")
+                continue
+
+            try:
+                queue_wait = time.time() - job.payload.get("enqueued_at", time.time())
+                with start_trace(f"job:{job.kind}", job.payload.get("trace_id"), handler=f"job:{job.kind}",
+                                 job_id=job.job_id, chat_id=job.chat_id, queue_wait=queue_wait):
+                    with span(f"handler:{handler.__name__}"):
+                        await handler(bot, job)
+            except asyncio.CancelledError:
+                # останавливают сам воркер (stop_workers) — задание остаётся 'running'
+                # и продолжится после перезапуска; иначе отменилось что-то внутри задания
+                if asyncio.current_task().cancelling():
+                    raise
+                print(f"Job {job.job_id} ({job.kind}) cancelled")
+                await asyncio.to_thread(_set_status, job.job_id, 'failed', 'cancelled')
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except BaseException as e:
+                # и GeneratorExit, и прочие BaseException из задания не должны убивать воркер
+                print(f"Job {job.job_id} ({job.kind}) error: {e!r}")
+                await asyncio.to_thread(_set_status, job.job_id, 'failed', str(e) or type(e).__name__)
+            else:
+                await asyncio.to_thread(_set_status, job.job_id, 'done')
+        finally:
+            queue.task_done()
+
+
+async def start_workers(bot, workers: dict = None):
+    """Запускает воркеры и возвращает в очередь всё, что не успело выполниться до остановки бота."""
+    workers = workers or JOB_WORKERS
+    for kind, count in workers.items():
+        _queues[kind] = asyncio.Queue()
+        for _ in range(count):
+            _workers.append(asyncio.create_task(_worker(bot, _queues[kind])))
+
+    for job_id, kind in await asyncio.to_thread(_pending_job_ids):
+        if kind in _queues:
+            _queues[kind].put_nowait(job_id)
+
+
+async def stop_workers():
+    # прерванные задания остаются в статусе 'running' и будут продолжены при следующем запуске
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queues.clear()
+
+
+def queue_depth(kind: str):
+    queue = _queues.get(kind)
+    return queue.qsize() if queue is not None else 0
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+from createbd import connect
+from metrics import Counter, Gauge
+
+
+CACHE_DB = 'nko.db'
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# как часто вытеснять просроченное и лишнее, секунд
+CACHE_TRIM_INTERVAL = float(os.getenv("LLM_CACHE_TRIM_INTERVAL", "600"))
+
+stats = {"hits": 0, "misses": 0}
+
+Counter("nko_llm_cache_lookups_total", "Обращения к кэшу ответов модели", ("result",),
+        func=lambda: {("hit",): stats["hits"], ("miss",): stats["misses"]})
+Gauge("nko_llm_cache_hit_ratio", "Доля попаданий в кэш ответов модели с запуска",
+      func=lambda: cache_stats()["hit_ratio"])
+
+
+# --- одинаковые брифы дают одинаковый ключ, даже если отличаются пробелами и пустыми строками ---
+def normalize_prompt(text: str):
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def make_key(text: str, model: str):
+    payload = f"{model}\0{normalize_prompt(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def get_cached(text: str, model: str):
+    cache_key = make_key(text, model)
+    now = time.time()
+
+    con = connect(CACHE_DB)
+    cur = con.cursor()
+    try:
+        cur.execute(
+            "SELECT completion, created_at FROM completion_cache WHERE cache_key = ?",
+            (cache_key,)
+        )
+        row = cur.fetchone()
+
+        if row is None or now - row[1] > CACHE_TTL:
+            if row is not None:
+                cur.execute("DELETE FROM completion_cache WHERE cache_key = ?", (cache_key,))
+                con.commit()
+            stats["misses"] += 1
+            return None
+
+        cur.execute(
+            "UPDATE completion_cache SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?",
+            (now, cache_key)
+        )
+        con.commit()
+        stats["hits"] += 1
+        return row[0]
+
+    except sqlite3.Error as e:
+        print(f"Cache error: {e}")
+        stats["misses"] += 1
+        return None
+    finally:
+        con.close()
+
+
+def put_cached(text: str, model: str, completion: str):
+    if not completion:
+        return
+
+    now = time.time()
+    con = connect(CACHE_DB)
+    cur = con.cursor()
+    try:
+        cur.execute(
+            "INSERT OR REPLACE INTO completion_cache (cache_key, model, completion, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (make_key(text, model), model, completion, now, now)
+        )
+        con.commit()
+    except sqlite3.Error as e:
+        print(f"Cache error: {e}")
+    finally:
+        con.close()
+
+
+def trim_cache():
+    """Вытеснение: сначала всё просроченное, потом самые давно использованные сверх лимита."""
+    con = connect(CACHE_DB)
+    cur = con.cursor()
+    try:
+        cur.execute("DELETE FROM completion_cache WHERE created_at < ?", (time.time() - CACHE_TTL,))
+        cur.execute(
+            "DELETE FROM completion_cache WHERE cache_key IN ("
+            "SELECT cache_key FROM completion_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (CACHE_MAX_ENTRIES,)
+        )
+        con.commit()
+    except sqlite3.Error as e:
+        print(f"Cache error: {e}")
+    finally:
+        con.close()
+
+
+async def trim_cache_periodically():
+    # не на каждой записи: между проходами кэш может ненадолго превысить лимит
+    while True:
+        await asyncio.to_thread(trim_cache)
+        await asyncio.sleep(CACHE_TRIM_INTERVAL)
+
+
+def cache_stats():
+    total = stats["hits"] + stats["misses"]
+    return {
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+        "hit_ratio": stats["hits"] / total if total else 0.0,
+    }
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import nullcontext
+
+import openai
+
+from metrics import LLM_ROUTE_ATTEMPTS
+from tracing import span
+
+
+# модели в порядке предпочтения: "модель" или "модель@base_url" для другого провайдера
+LLM_MODELS = [
+    m.strip() for m in os.getenv(
+        "LLM_MODELS",
+        "openai/gpt-oss-20b:free,meta-llama/llama-3.3-70b-instruct:free"
+    ).split(",") if m.strip()
+]
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# SLO: полный ответ без стриминга и первый токен при стриминге
+LLM_LATENCY_SLO = float(os.getenv("LLM_LATENCY_SLO", "90"))
+LLM_FIRST_TOKEN_SLO = float(os.getenv("LLM_FIRST_TOKEN_SLO", "30"))
+
+EWMA_ALPHA = 0.3
+# задержка "по умолчанию" для модели без замеров: так новые маршруты тоже получают пробный трафик
+LATENCY_PRIOR = 10.0
+UNHEALTHY_ERROR_RATE = 0.5
+
+# пауза для модели, которой у провайдера больше нет (404): сама она не вернётся через секунды
+MISSING_MODEL_COOLDOWN = 300.0
+
+# ошибки маршрута, после которых пробуем следующую модель: 429, 5xx, обрывы соединения,
+# превышение SLO и 404 — модель сняли или переименовали
+RETRIABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    openai.NotFoundError,
+    asyncio.TimeoutError,
+)
+
+
+class Route:
+    def __init__(self, model: str, base_url: str = None):
+        self.model = model
+        self.base_url = base_url
+
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    @classmethod
+    def parse(cls, spec: str):
+        model, _, base_url = spec.partition("@")
+        return cls(model, base_url or None)
+
+    def healthy(self):
+        return self.error_ewma < UNHEALTHY_ERROR_RATE and time.monotonic() >= self.cooldown_until
+
+    def score(self):
+        latency = self.latency_ewma if self.latency_ewma is not None else LATENCY_PRIOR
+        return latency * (1 + 4 * self.error_ewma)
+
+    def record_success(self, latency: float):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+        self.error_ewma *= 1 - EWMA_ALPHA
+        self.consecutive_errors = 0
+
+    def record_error(self, retry_after: float = None):
+        self.error_ewma = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_ewma
+        self.consecutive_errors += 1
+        pause = retry_after if retry_after is not None else min(LLM_BACKOFF_MAX, 2 ** self.consecutive_errors)
+        self.cooldown_until = time.monotonic() + pause
+
+    def stats(self):
+        return {
+            "model": self.model,
+            "base_url": self.base_url,
+            "latency_ewma": self.latency_ewma,
+            "error_ewma": self.error_ewma,
+            "healthy": self.healthy(),
+        }
+
+
+def _retry_after(error):
+    if isinstance(error, openai.NotFoundError):
+        return MISSING_MODEL_COOLDOWN
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int):
+    # экспоненциальная задержка с полным джиттером
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+class Router:
+    """
+    Выбирает модель для запроса: самую быструю из здоровых по EWMA задержки и ошибок.
+    При временной ошибке или превышении SLO повторяет запрос на следующей модели.
+    """
+
+    def __init__(self, routes, max_attempts: int = LLM_MAX_ATTEMPTS):
+        self.routes = routes
+        self.max_attempts = max_attempts
+
+    def ordered(self, exclude=()):
+        candidates = [r for r in self.routes if r not in exclude] or list(self.routes)
+        healthy = [r for r in candidates if r.healthy()]
+        # когда здоровых нет, всё равно пробуем — по порядку предпочтения
+        if not healthy:
+            return candidates
+        return sorted(healthy, key=lambda r: (r.score(), self.routes.index(r)))
+
+    async def call(self, request, slot=None):
+        """
+        request(route) -> coroutine с ответом модели.
+        slot() -> асинхронный контекст (место в очереди планировщика); время в очереди в SLO не входит.
+        """
+        slot = slot or nullcontext
+        tried = set()
+        for attempt in range(self.max_attempts):
+            route = self.ordered(exclude=tried)[0]
+            try:
+                async with slot():
+                    started = time.monotonic()
+                    with span("llm:request", model=route.model):
+                        result = await asyncio.wait_for(request(route), LLM_LATENCY_SLO)
+            except RETRIABLE_ERRORS as e:
+                route.record_error(_retry_after(e))
+                tried.add(route)
+                LLM_ROUTE_ATTEMPTS.inc(model=route.model, outcome=type(e).__name__)
+                print(f"LLM route {route.model} failed: {e!r}")
+                if attempt == self.max_attempts - 1:
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+                continue
+
+            route.record_success(time.monotonic() - started)
+            LLM_ROUTE_ATTEMPTS.inc(model=route.model, outcome="ok")
+            return result
+
+    async def stream(self, open_stream, slot=None):
+        """
+        open_stream(route) -> coroutine, возвращающая асинхронный итератор кусков текста.
+        Переключиться на другую модель можно только до первого токена.
+        """
+        slot = slot or nullcontext
+        tried = set()
+        for attempt in range(self.max_attempts):
+            route = self.ordered(exclude=tried)[0]
+            async with slot():
+                started = time.monotonic()
+                chunks = None
+                try:
+                    try:
+                        with span("llm:first_token", model=route.model):
+                            chunks = (await asyncio.wait_for(open_stream(route), LLM_FIRST_TOKEN_SLO)).__aiter__()
+                            first = await asyncio.wait_for(chunks.__anext__(), LLM_FIRST_TOKEN_SLO)
+                    except StopAsyncIteration:
+                        route.record_success(time.monotonic() - started)
+                        LLM_ROUTE_ATTEMPTS.inc(model=route.model, outcome="ok")
+                        return
+                    except RETRIABLE_ERRORS as e:
+                        route.record_error(_retry_after(e))
+                        tried.add(route)
+                        LLM_ROUTE_ATTEMPTS.inc(model=route.model, outcome=type(e).__name__)
+                        print(f"LLM route {route.model} failed: {e!r}")
+                        if attempt == self.max_attempts - 1:
+                            raise
+                    else:
+                        yield first
+                        try:
+                            async for chunk in chunks:
+                                yield chunk
+                        except RETRIABLE_ERRORS as e:
+                            route.record_error()
+                            LLM_ROUTE_ATTEMPTS.inc(model=route.model, outcome=type(e).__name__)
+                            raise
+                        route.record_success(time.monotonic() - started)
+                        LLM_ROUTE_ATTEMPTS.inc(model=route.model, outcome="ok")
+                        return
+                finally:
+                    # после таймаута, ошибки или брошенного чтения поток закрываем сразу,
+                    # иначе соединение из общего пула занято до сборки мусора
+                    if chunks is not None and hasattr(chunks, "aclose"):
+                        await chunks.aclose()
+
+            await asyncio.sleep(_backoff(attempt))
+
+    def stats(self):
+        return [r.stats() for r in self.routes]
+
+
+router = Router([Route.parse(spec) for spec in LLM_MODELS])
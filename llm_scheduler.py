@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from metrics import Gauge, Histogram, SLOW_BUCKETS
+from tracing import span
+
+
+# сколько запросов к модели одновременно и с какой частотой (бесплатный тариф OpenRouter ~20 в минуту)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_RATE_PER_MIN = float(os.getenv("LLM_RATE_PER_MIN", "20"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "5"))
+# фоновые запросы (предгенерация) никогда не занимают последние места и последние токены
+LLM_BACKGROUND_RESERVE = int(os.getenv("LLM_BACKGROUND_RESERVE", "1"))
+# сколько секунд фоновый запрос ждёт места, прежде чем от него отказаться
+LLM_BACKGROUND_MAX_WAIT = float(os.getenv("LLM_BACKGROUND_MAX_WAIT", "120"))
+
+
+class QueueTimeout(Exception):
+    """Фоновый запрос не дождался места в очереди (не ошибка модели — маршрутизатор его не повторяет)."""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: int):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, need: float = 1):
+        """Через сколько секунд накопится need токенов (0 — уже есть)."""
+        self._refill()
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class FairScheduler:
+    """
+    Очередь запросов к модели: не больше max_concurrency одновременно, не чаще,
+    чем позволяет TokenBucket, и по очереди между чатами (round-robin),
+    чтобы десять "Создать заново" одного пользователя не задерживали всех остальных.
+
+    Фоновые запросы (low_priority) получают место, только когда никто из
+    пользователей не ждёт и свободно больше, чем reserve мест и токенов;
+    одновременно выполняется не больше одного фонового запроса, а ждёт он
+    не дольше background_max_wait.
+    """
+
+    def __init__(self, max_concurrency: int, bucket: TokenBucket, reserve: int = LLM_BACKGROUND_RESERVE,
+                 background_max_wait: float = LLM_BACKGROUND_MAX_WAIT):
+        self.max_concurrency = max(1, max_concurrency)
+        self.bucket = bucket
+        # резерв, который не оставляет фону ни места, ни токенов, навсегда выключил бы фоновую очередь
+        self.reserve = max(0, min(reserve, self.max_concurrency - 1, int(bucket.capacity) - 1))
+        if self.reserve != reserve:
+            print(f"LLM scheduler: резерв для фона {reserve} больше лимитов "
+                  f"(мест {self.max_concurrency}, токенов {bucket.capacity}), использую {self.reserve}")
+        self.background_max_wait = background_max_wait
+
+        self._queues = OrderedDict()  # chat_id -> deque[(future, enqueued_at)]
+        self._background = deque()
+        self._active = 0
+        self._background_active = 0
+        self._timer = None
+
+        self.granted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.last_wait = 0.0
+
+    def queue_depth(self, chat_id=...):
+        if chat_id is ...:
+            return sum(len(q) for q in self._queues.values())
+        return len(self._queues.get(chat_id, ()))
+
+    @property
+    def active(self):
+        return self._active
+
+    def _next_waiter(self):
+        if self._queues:
+            if self._active >= self.max_concurrency:
+                return None
+            chat_id, queue = next(iter(self._queues.items()))
+            need = 1
+        elif self._background:
+            if self._background_active or self._active >= self.max_concurrency - self.reserve:
+                return None
+            chat_id, queue = None, self._background
+            need = 1 + self.reserve
+        else:
+            return None
+
+        delay = self.bucket.delay(need)
+        if delay > 0:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+            return None
+
+        waiter = queue.popleft()
+        if queue is not self._background:
+            if queue:
+                self._queues.move_to_end(chat_id)
+            else:
+                del self._queues[chat_id]
+        return waiter
+
+    def _dispatch(self):
+        self._timer = None
+
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+
+            future, enqueued_at, background = waiter
+            if future.done():  # ожидающий уже отменён
+                continue
+
+            self.bucket.take()
+            self._active += 1
+            self._background_active += background
+            future.set_result(time.monotonic() - enqueued_at)
+
+    def _schedule(self):
+        # новый ожидающий мог появиться с другими условиями (например, пользователь вместо фона)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    def _release(self, background: bool = False):
+        self._active -= 1
+        self._background_active -= background
+        self._schedule()
+
+    @asynccontextmanager
+    async def slot(self, chat_id=None, low_priority: bool = False):
+        future = asyncio.get_running_loop().create_future()
+        if low_priority:
+            self._background.append((future, time.monotonic(), True))
+        else:
+            self._queues.setdefault(chat_id, deque()).append((future, time.monotonic(), False))
+        self._schedule()
+
+        try:
+            with span("llm:queue", lane="background" if low_priority else "foreground"):
+                async with asyncio.timeout(self.background_max_wait if low_priority else None):
+                    waited = await future
+        except (asyncio.CancelledError, TimeoutError) as e:
+            # место уже выдали, но забрать его не успели — возвращаем
+            if future.done() and not future.cancelled():
+                self._release(low_priority)
+            if isinstance(e, TimeoutError):
+                raise QueueTimeout(f"фоновый запрос ждал места дольше {self.background_max_wait} с") from e
+            raise
+
+        LLM_QUEUE_WAIT.observe(waited, lane="background" if low_priority else "foreground")
+        self.granted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.last_wait = waited
+
+        try:
+            yield waited
+        finally:
+            self._release(low_priority)
+
+    def stats(self):
+        return {
+            "active": self._active,
+            "queue_depth": self.queue_depth(),
+            "queued_chats": len(self._queues),
+            "background_depth": len(self._background),
+            "granted": self.granted,
+            "wait_avg": self.wait_total / self.granted if self.granted else 0.0,
+            "wait_max": self.wait_max,
+            "wait_last": self.last_wait,
+        }
+
+
+LLM_QUEUE_WAIT = Histogram(
+    "nko_llm_queue_wait_seconds", "Ожидание места в очереди к модели", ("lane",), SLOW_BUCKETS,
+)
+
+scheduler = FairScheduler(LLM_MAX_CONCURRENCY, TokenBucket(LLM_RATE_PER_MIN / 60, LLM_RATE_BURST))
+
+Gauge("nko_llm_active_requests", "Запросы к модели, выполняющиеся сейчас", func=lambda: scheduler.active)
+Gauge("nko_llm_queue_depth", "Запросы, ждущие места в очереди к модели", ("lane",),
+      func=lambda: {("foreground",): scheduler.queue_depth(), ("background",): scheduler.stats()["background_depth"]})
@@ -4,7 +4,8 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from config import token
-from result_gen import api_get_result, split_message
+from result_gen import api_get_result, open_llm_client, close_llm_client
+from chunker import split_message
 from aiogram.types import CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
 from createbd import create_tables
 import sqlite3
@@ -693,7 +694,7 @@ async def generate_content(message: types.Message, state: FSMContext):
     await message.answer("✨ Создаю контент ✨")
 
     try:
-        result = api_get_result(prompt)
+        result = await api_get_result(prompt)
     except ConnectionError:
         await message.answer("Ошибка соединения с сервером ИИ. Проверьте интернет-соединение и попробуйте еще раз.")
         return
@@ -805,10 +806,10 @@ async def regenerate_text(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.answer("✨ Создаю новый вариант...")
 
     try:
-        result = api_get_result(prompt)
+        result = await api_get_result(prompt, use_cache=False)
         await state.update_data(generated_text=result)
 
-        parts = split_message(result)
+        parts = split_message(result, parse_mode=ParseMode.MARKDOWN)
         for part in parts:
             await callback.message.answer(part, parse_mode=ParseMode.MARKDOWN)
 
@@ -969,7 +970,7 @@ async def ai_refine_text(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.answer(" Дорабатываю текст...")
 
     try:
-        refined_text = api_get_result(prompt)
+        refined_text = await api_get_result(prompt)
         await state.update_data(generated_text=refined_text)
 
         parts = split_message(refined_text)
@@ -1036,6 +1037,16 @@ async def process_edited_text(message: types.Message, state: FSMContext):
         reply_markup=keyboard
     )
 
+
+async def main():
+    # общий клиент модели открываем до начала опроса и закрываем при остановке бота
+    await open_llm_client()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await close_llm_client()
+
+
 if __name__ == "__main__":
     import asyncio
-    asyncio.run(dp.start_polling(bot))
+    asyncio.run(main())
@@ -3,19 +3,34 @@ from aiogram.filters import Command, BaseFilter
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
 from config import token, KANDINSKY_API_KEY, KANDINSKY_SECRET_KEY
-from result_gen import api_get_result, split_message
-from aiogram.types import CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
+from result_gen import api_get_result, api_stream_result, open_llm_client, close_llm_client, LLM_STREAMING
+from chunker import split_message
+from streaming import stream_to_chat
+from jobs import enqueue, job_handler, start_workers, stop_workers
+from prompts import render_post_prompt, render_refine_prompt
+from retrieval import top_examples, STYLE_POST_TYPES, EXAMPLES_WITH_PROFILE_TOP_K, EXAMPLES_WITH_PROFILE_TOKEN_BUDGET
+from style_profile import refresh_style_profile, get_style_digest, split_examples
+from speculation import speculate, take_variant, speculation_enabled, toggle_speculation
+from aiogram.types import BotCommand, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
 from createbd import create_tables
+import asyncio
 import sqlite3
 from aiogram.enums import ParseMode
 import re
-import os
-from root import generate_and_save_image
+from root import generate_image_shared, generate_variants_shared, prefetch_pipelines, close_image_client, IMAGE_VARIANTS
+from image_store import store_image, send_stored_photo, send_stored_album
+from image_render import render_for, start_render_pool, close_render_pool
+from metrics import Gauge, TimedConnection, instrument_dispatcher, start_metrics_server
+from tracing import TracedStorage, trace_bot, trace_dispatcher, span
+from send_scheduler import throttle_bot, send_parts
 
 
-bot = Bot(token=token)
-dp = Dispatcher(storage=MemoryStorage())
+bot = throttle_bot(trace_bot(Bot(token=token)))
+dp = Dispatcher(storage=TracedStorage(MemoryStorage()))
+trace_dispatcher(dp)
+instrument_dispatcher(dp)
 
 
 class PrefixFilter(BaseFilter):
@@ -23,7 +38,8 @@ class PrefixFilter(BaseFilter):
         self.prefix = prefix
 
     async def __call__(self, callback: CallbackQuery) -> bool:
-        return callback.data.startswith(self.prefix)
+        with span("filter:PrefixFilter", prefix=self.prefix):
+            return callback.data.startswith(self.prefix)
 
 
 class ContentGen(StatesGroup):
@@ -51,6 +67,18 @@ class ContentGen(StatesGroup):
     image_prompt_edit = State()
 
 
+def fsm_state_counts():
+    # сколько пользователей сейчас на каждом шаге ContentGen
+    counts = {(state.state,): 0 for state in ContentGen.__all_states__}
+    for record in getattr(dp.storage, 'storage', {}).values():
+        if (record.state,) in counts:
+            counts[(record.state,)] += 1
+    return counts
+
+
+Gauge("nko_fsm_states", "Пользователи на каждом шаге ContentGen", ("state",), func=fsm_state_counts)
+
+
 # --- для создания инлайн клавиатуры ---
 def make_inline_keyboard(options: list, prefix: str):
     return types.InlineKeyboardMarkup(
@@ -101,7 +129,7 @@ async def start(message: types.Message, state: FSMContext):
     await state.clear()
     await hello(message)
 
-    con = sqlite3.connect('nko.db')
+    con = sqlite3.connect('nko.db', factory=TimedConnection)
     cur = con.cursor()
     try:
         create_tables(cur)
@@ -127,9 +155,48 @@ async def start_flow(callback: types.CallbackQuery, state: FSMContext):
     await show_main_menu(callback.message)
 
 
+# --- быстрое "Создать заново": следующий вариант поста готовится заранее ---
+def make_fast_regenerate_keyboard(enabled: bool):
+    text = "⚡ Быстрое «Создать заново»: " + ("вкл — выключить" if enabled else "выкл — включить")
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[[types.InlineKeyboardButton(text=text, callback_data="fast_regen")]]
+    )
+
+
+async def toggle_fast_regenerate_for(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    nko_id = data.get('selected_nko_id')
+
+    if not nko_id:
+        await message.answer("❌ Сначала выберите НКО — быстрое «Создать заново» включается для каждого НКО отдельно.")
+        return
+
+    try:
+        enabled = await asyncio.to_thread(toggle_speculation, nko_id)
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Произошла ошибка при работе с базой данных: {e}")
+        return
+
+    if enabled:
+        await message.answer("⚡ Быстрое «Создать заново» включено: пока вы читаете пост, я заранее готовлю ещё один вариант.")
+    else:
+        await message.answer("Быстрое «Создать заново» выключено.")
+
+
+@dp.message(Command("fast_regen"))
+async def toggle_fast_regenerate(message: types.Message, state: FSMContext):
+    await toggle_fast_regenerate_for(message, state)
+
+
+@dp.callback_query(PrefixFilter("fast_regen"))
+async def toggle_fast_regenerate_button(callback: types.CallbackQuery, state: FSMContext):
+    await toggle_fast_regenerate_for(callback.message, state)
+    await callback.answer()
+
+
 # --- Функция для показа списка НКО ---
 async def show_nko_list(message: types.Message, state: FSMContext):
-    with sqlite3.connect('nko.db') as con:
+    with sqlite3.connect('nko.db', factory=TimedConnection) as con:
         cur = con.cursor()
         try:
             create_tables(cur)
@@ -138,7 +205,7 @@ async def show_nko_list(message: types.Message, state: FSMContext):
             await message.answer(f"❌ Ошибка при создании таблиц: {e}")
             return
 
-    with sqlite3.connect('nko.db') as con:
+    with sqlite3.connect('nko.db', factory=TimedConnection) as con:
         cur = con.cursor()
         try:
             cur.execute("SELECT COUNT(*) FROM nko_info")
@@ -197,7 +264,7 @@ async def handle_nko_list_action(callback: types.CallbackQuery, state: FSMContex
 
 # --- для выбора НКО из базы ---
 async def select_nko_from_list(message: types.Message, state: FSMContext):
-    con = sqlite3.connect('nko.db')
+    con = sqlite3.connect('nko.db', factory=TimedConnection)
     cur = con.cursor()
 
     try:
@@ -231,7 +298,7 @@ async def select_nko_from_list(message: types.Message, state: FSMContext):
 async def handle_nko_selection(callback: types.CallbackQuery, state: FSMContext):
     nko_id = callback.data.split(":", 1)[1]
 
-    con = sqlite3.connect('nko.db')
+    con = sqlite3.connect('nko.db', factory=TimedConnection)
     cur = con.cursor()
 
     try:
@@ -245,9 +312,11 @@ async def handle_nko_selection(callback: types.CallbackQuery, state: FSMContext)
                 from_task_selection=True
             )
 
+            # настройка НКО — здесь же, под выбором: /fast_regen иначе никто не найдёт
             await callback.message.answer(
                 f"Вы выбрали НКО: {nko_name}\n"
-                f"Теперь переходим к созданию контента!"
+                f"Теперь переходим к созданию контента!",
+                reply_markup=make_fast_regenerate_keyboard(await asyncio.to_thread(speculation_enabled, nko_id))
             )
 
             await ask_task_type(callback.message, state)
@@ -304,7 +373,7 @@ async def set_description(message: types.Message, state: FSMContext):
 
     await message.answer(
         "📝 Теперь вы можете добавить примеры постов вашей НКО (это поможет мне лучше понять стиль вашего контента).\n\n"
-        "Пришлите примеры постов одним сообщением (можно несколько постов в одном сообщении) или нажмите кнопку чтобы пропустить:",
+        "Пришлите примеры постов одним сообщением (несколько постов разделите строкой ---) или нажмите кнопку чтобы пропустить:",
         reply_markup=keyboard
     )
     await state.set_state(ContentGen.examples)
@@ -334,7 +403,7 @@ async def save_new_nko(msg_obj, state: FSMContext):
     description = data.get('description')
     examples = data.get('examples')
 
-    con = sqlite3.connect('nko.db')
+    con = sqlite3.connect('nko.db', factory=TimedConnection)
     cur = con.cursor()
     try:
         cur.execute(
@@ -343,18 +412,22 @@ async def save_new_nko(msg_obj, state: FSMContext):
         )
         nko_id = cur.lastrowid
 
-        if examples:
-            cur.execute(
+        # каждый пример — отдельный пост: по ним считаются типичная длина, эмодзи и хештеги на пост
+        example_posts = split_examples(examples) if examples else []
+        if example_posts:
+            cur.executemany(
                 "INSERT INTO posts (post_type, nko_id, content) VALUES (?, ?, ?)",
-                ('example', nko_id, examples)  # Сохраняем весь текст как один пост
+                [('example', nko_id, post) for post in example_posts]
             )
+            # профиль стиля считаем один раз сейчас, а не разбираем примеры при каждой генерации
+            refresh_style_profile(cur, nko_id)
 
         con.commit()
         await state.update_data(selected_nko_id=nko_id)
 
         success_message = f"✅ НКО '{name}' успешно создано и сохранено в базе!"
-        if examples:
-            success_message += f"\n\nПример поста сохранен!"
+        if example_posts:
+            success_message += f"\n\nСохранено примеров постов: {len(example_posts)}"
 
         if isinstance(msg_obj, types.Message):
             await msg_obj.answer(success_message)
@@ -710,60 +783,8 @@ async def start_image_generation(callback: types.CallbackQuery, state: FSMContex
 
     await callback.message.answer("Подождите, идет генерация картинки... Это может занять 1-2 минуты")
 
-    try:
-        image_filename = generate_and_save_image(
-            KANDINSKY_API_KEY,
-            KANDINSKY_SECRET_KEY,
-            image_prompt
-        )
-
-        if image_filename and os.path.exists(image_filename):
-            with open(image_filename, 'rb') as photo:
-                await callback.message.answer_photo(
-                    photo=types.BufferedInputFile(photo.read(), filename="generated_image.png"),
-                    caption="Ваша созданная картинка!"
-                )
-
-            try:
-                os.remove(image_filename)
-            except:
-                pass
-
-            keyboard = types.InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [types.InlineKeyboardButton(text="✨Создать еще", callback_data="generate_another_image")],
-                    [types.InlineKeyboardButton(text="✏️ Изменить запрос", callback_data="edit_image_prompt")],
-                    [types.InlineKeyboardButton(text="Сохранить (если выбирали нко)", callback_data="save_image")]
-                ]
-            )
-
-            await callback.message.answer(
-                "Что вы хотите сделать с этой картинкой?",
-                reply_markup=keyboard
-            )
-
-        else:
-            await callback.message.answer(
-                f"❌ Не удалось создать картинку. Попробуйте изменить запрос.\n\n"
-                f"**Текущий запрос:**\n`{image_prompt}`",
-                parse_mode=ParseMode.MARKDOWN
-            )
-
-            keyboard = types.InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [types.InlineKeyboardButton(text="✏️ Отредактировать запрос", callback_data="edit_image_prompt")],
-                    [types.InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="generate_image")]
-                ]
-            )
-
-            await callback.message.answer("Выберите действие:", reply_markup=keyboard)
-
-    except Exception as e:
-        await callback.message.answer(
-            f"❌ Ошибка при генерации картинки: {str(e)}\n\n"
-            f"Попробуйте изменить запрос или повторить позже."
-        )
-        print(f"Image generation error: {e}")
+    await enqueue('image', callback.message.chat.id, callback.from_user.id,
+            {"prompt": image_prompt, "data": data})
 
     await callback.answer()
 
@@ -773,13 +794,14 @@ async def save_image(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
 
     if data.get('selected_nko_id'):
-        con = sqlite3.connect('nko.db')
+        con = sqlite3.connect('nko.db', factory=TimedConnection)
         cur = con.cursor()
         try:
             cur.execute(
-                "INSERT INTO posts (post_type, nko_id, content, image_prompt, goal, audience) VALUES (?, ?, ?, ?, ?, ?)",
+                "INSERT INTO posts (post_type, nko_id, content, image_prompt, image_hash, goal, audience) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
                 ('image', data.get('selected_nko_id'), 'Созданная картинка',
-                 data.get('image_prompt'), data.get('goal', ''), data.get('audience', ''))
+                 data.get('image_prompt'), data.get('image_hash'), data.get('goal', ''), data.get('audience', ''))
             )
             con.commit()
             await callback.message.answer("Картинка и её описание сохранены в базу данных!")
@@ -799,7 +821,30 @@ async def save_image(callback: types.CallbackQuery, state: FSMContext):
 # --- генерация еще одной картинки ---
 @dp.callback_query(PrefixFilter("generate_another_image"))
 async def generate_another_image(callback: types.CallbackQuery, state: FSMContext):
-    await start_image_generation(callback, state)
+    # сразу несколько вариантов одним альбомом — пользователь выбирает лучший
+    data = await state.get_data()
+    image_prompt = data.get('image_prompt', '')
+
+    await callback.message.answer(f"Подождите, создаю варианты картинки ({IMAGE_VARIANTS} шт.)... Это может занять 1-2 минуты")
+
+    await enqueue('image', callback.message.chat.id, callback.from_user.id,
+            {"prompt": image_prompt, "data": data, "variants": IMAGE_VARIANTS})
+
+    await callback.answer()
+
+
+@dp.callback_query(PrefixFilter("pick_image:"))
+async def pick_image(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    variants = data.get('image_variants') or []
+    index = int(callback.data.split(":", 1)[1])
+
+    if index >= len(variants):
+        await callback.answer("Этот вариант уже недоступен", show_alert=True)
+        return
+
+    await state.update_data(image_hash=variants[index])
+    await save_image(callback, state)
 
 
 # --- цель контента ---
@@ -959,18 +1004,15 @@ async def set_cta(message: types.Message, state: FSMContext):
     await state.set_state(ContentGen.nuances)
 
 
-# --- очень важная функция генерации контента и промптов ---
-@dp.message(ContentGen.nuances)
-async def generate_content(message: types.Message, state: FSMContext):
-    await state.update_data(nuances=message.text)
-    data = await state.get_data()
-
+# --- контекст НКО для промпта: миссия и примеры постов из базы ---
+def load_nko_context(data: dict):
     nko_name = data.get('name')
     nko_description = ""
     examples_text = ""
+    style_digest = ""
 
     if data.get('selected_nko_id'):
-        con = sqlite3.connect('nko.db')
+        con = sqlite3.connect('nko.db', factory=TimedConnection)
         cur = con.cursor()
         try:
             cur.execute("SELECT name, description FROM nko_info WHERE nko_id = ?", (data.get('selected_nko_id'),))
@@ -978,11 +1020,24 @@ async def generate_content(message: types.Message, state: FSMContext):
             if result:
                 nko_name, nko_description = result
 
-            cur.execute("SELECT content FROM posts WHERE nko_id = ? AND post_type = 'example'",
-                        (data.get('selected_nko_id'),))
-            examples = cur.fetchall()
+            style_digest = get_style_digest(cur, data.get('selected_nko_id'))
+            if not style_digest:
+                # НКО заведено до появления профилей — считаем его один раз
+                style_digest = refresh_style_profile(cur, data.get('selected_nko_id'))["digest"]
+                con.commit()
+
+            # в промпт идут только самые близкие к брифу посты и в пределах бюджета токенов;
+            # если есть профиль стиля, целые примеры почти не нужны
+            if style_digest:
+                examples = top_examples(cur, data.get('selected_nko_id'),
+                                        f"{data.get('goal', '')} {data.get('details', '')}",
+                                        k=EXAMPLES_WITH_PROFILE_TOP_K,
+                                        token_budget=EXAMPLES_WITH_PROFILE_TOKEN_BUDGET)
+            else:
+                examples = top_examples(cur, data.get('selected_nko_id'),
+                                        f"{data.get('goal', '')} {data.get('details', '')}")
             if examples:
-                examples_text = "\n".join([example[0] for example in examples])
+                examples_text = "\n\n".join(examples)
 
         except sqlite3.Error:
             pass
@@ -992,205 +1047,46 @@ async def generate_content(message: types.Message, state: FSMContext):
     if not nko_name:
         nko_name = "Без указания названия"
 
-    organization_context = ""
     if nko_description:
         organization_context = f"Миссия и деятельность: {nko_description}"
     else:
         organization_context = f"Название организации: {nko_name}"
 
-    event_info = ""
-    if data.get('event_date'):
-        goal = data.get('goal', '')
-        if goal == "Анонс события":
-            event_info = f"Дата и место события: {data['event_date']}"
-        elif goal == "Рассказать о прошедшем событии":
-            event_info = f"Дата прошедшего события: {data['event_date']}"
-
-    if data.get('task_type') == "Создание текста":
-        prompt = f"""
-Ты — опытный копирайтер и редактор благотворительной организации: {organization_context}
-
-Напиши текст поста для социальных сетей на основе следующих данных:
-Цель поста: {data.get('goal', '')}
-{event_info}
-Целевая аудитория поста: {data.get('audience', '')}
-Основная информация поста: {data.get('details', '')}
-Призыв к действию: {data.get('cta', '')}
-Дополнительные пожелания: {data.get('nuances', '')}
-
-{"Стилистический референс, пиши в аналогичном стиле с этими постами:" + examples_text if examples_text else ""}
-
-Требования к тексту:
-Соответствует цели поста.
-{"Учитывает дату и место события." if event_info else ""}
-Написан в стиле, близком к референсу и глобальному контексту (стиль, интонация, уровень языка). Текст не должен выглядеть сгенерированным нейросетью, пиши так, как писал бы человек.
-{"Побуждает к действию (прийти, помочь, поделиться)." if data.get('goal') == "Анонс события" else ""}
-{"Содержит результаты в удобочитаемом виде, избегает большого количества цифр." if data.get('goal') in ["Подвести итоги и статистику", "Отчитаться о проделанной работе"] else ""}
-{"Вызывает доверие, конкретизирует цель (зачем нужны деньги, кому помогут)." if data.get('goal') == "Сбор средств" else ""}
-{"Уважительно, без рекламного тона, с акцентом на вклад и ценность поддержки." if data.get('goal') == "Рассказать о спонсоре" else ""}
-
-Учитывай специфику социальной сети: {"Короткий и понятный текст с яркими заголовками. Эмоциональная подача, стимулирующая обсуждение и активное комментирование." if data.get('social_network') == "ВК" else "Качественный и структурированный материал с четкими выводами. Лаконичный стиль, минимум графического оформления, максимальная информативность." if data.get('social_network') == "Телеграм" else ""}
-
-Стиль:
-Естественный, живой, внимание к деталям. Избегай клише, канцеляризмов и морализаторства.
-
-Формат вывода:
-Готовый текст поста. Без пояснений, заголовков вроде «[Текст поста]» или комментариев.
-Добавь 4-5 хештегов в конце по тематике поста для социальных сетей.
-"""
-    elif data.get('task_type') == "":
-        pass
-    else:
-        pass
+    return organization_context, examples_text, style_digest
 
-    await message.answer("✨ Создаю контент ✨")
 
-    try:
-        result = api_get_result(prompt)
-    except ConnectionError:
-        await message.answer("Ошибка соединения с сервером ИИ. Проверьте интернет-соединение и попробуйте еще раз.")
-        return
-    except TimeoutError:
-        await message.answer("Превышено время ожидания ответа от ИИ. Попробуйте еще раз.")
-        return
-    except Exception as e:
-        await message.answer("Произошла непредвиденная ошибка при создании контента. Попробуйте еще раз.")
-        print(f"API error: {e}")
-        return
-
-    await state.update_data(generated_text=result)
-
-    parts = split_message(result)
+# --- очень важная функция генерации контента и промптов ---
+@dp.message(ContentGen.nuances)
+async def generate_content(message: types.Message, state: FSMContext):
+    await state.update_data(nuances=message.text)
+    data = await state.get_data()
 
-    for part in parts:
-        await message.answer(part)
+    organization_context, examples_text, style_digest = load_nko_context(data)
+    prompt, prompt_tokens = render_post_prompt(data, organization_context, examples_text, style_digest)
 
-    keyboard = types.InlineKeyboardMarkup(
-        inline_keyboard=[
-            [types.InlineKeyboardButton(text="✏️ Отредактировать текст", callback_data="edit_text")],
-            [types.InlineKeyboardButton(text="✅ Сохранить как есть", callback_data="save_text")],
-            [types.InlineKeyboardButton(text="🔄 Создать заново", callback_data="regenerate_text")]
-        ]
-    )
+    await message.answer("✨ Создаю контент ✨")
 
-    await message.answer(
-        "Что вы хотите сделать с этим текстом?",
-        reply_markup=keyboard
-    )
+    # генерация идёт в фоне: обработчик сразу освобождается, а задание переживёт перезапуск бота
+    await enqueue('text', message.chat.id, message.from_user.id,
+            {"mode": "generate", "prompt": prompt, "prompt_tokens": prompt_tokens, "data": data})
 
 
 @dp.callback_query(PrefixFilter("regenerate_text"))
 async def regenerate_text(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
 
-    nko_name = data.get('name')
-    nko_description = ""
-    examples_text = ""
+    # тот же шаблон, что и в generate_content, поэтому и ключ кэша/предгенерации совпадает
+    organization_context, examples_text, style_digest = load_nko_context(data)
+    prompt, prompt_tokens = render_post_prompt(data, organization_context, examples_text, style_digest)
 
-    if data.get('selected_nko_id'):
-        con = sqlite3.connect('nko.db')
-        cur = con.cursor()
-        try:
-            cur.execute("SELECT name, description FROM nko_info WHERE nko_id = ?", (data.get('selected_nko_id'),))
-            result = cur.fetchone()
-            if result:
-                nko_name, nko_description = result
-
-            cur.execute("SELECT content FROM posts WHERE nko_id = ? AND post_type = 'example'",
-                        (data.get('selected_nko_id'),))
-            examples = cur.fetchall()
-            if examples:
-                examples_text = "\n".join([example[0] for example in examples])
-
-        except sqlite3.Error:
-            pass
-        finally:
-            con.close()
-
-    if not nko_name:
-        nko_name = "Без указания названия"
-
-    organization_context = ""
-    if nko_description:
-        organization_context = f"Миссия и деятельность: {nko_description}"
+    variant = take_variant(callback.message.chat.id, prompt)
+    if variant is not None:
+        # вариант приготовлен заранее — отвечаем сразу, без очереди заданий
+        await deliver_regenerated_text(callback.bot, callback.message.chat.id, state, prompt, variant)
     else:
-        organization_context = f"Название организации: {nko_name}"
-
-    event_info = ""
-    if data.get('event_date'):
-        goal = data.get('goal', '')
-        if goal == "Анонс события":
-            event_info = f"Дата и место события: {data['event_date']}"
-        elif goal == "Рассказать о прошедшем событии":
-            event_info = f"Дата прошедшего события: {data['event_date']}"
-
-    prompt = f"""
-Ты — опытный копирайтер и редактор благотворительной организации: {organization_context}
-
-Напиши текст поста для социальных сетей на основе следующих данных:
-Цель поста: {data.get('goal', '')}
-{event_info}
-Целевая аудитория поста: {data.get('audience', '')}
-Основная информация поста: {data.get('details', '')}
-Призыв к действию: {data.get('cta', '')}
-Дополнительные пожелания: {data.get('nuances', '')}
-
-{"Стилистический референс, пиши в аналогичном стиле с этими постами:" + examples_text if examples_text else ""}
-
-Требования к тексту:
-Соответствует цели поста.
-{"Учитывает дату и место события." if event_info else ""}
-Написан в стиле, близком к референсу и глобальному контексту (стиль, интонация, уровень языка). Текст не должен выглядеть сгенерированным нейросетью, пиши так, как писал бы человек.
-{"Побуждает к действию (прийти, помочь, поделиться)." if data.get('goal') == "Анонс события" else ""}
-{"Содержит результаты в удобочитаемом виде, избегает большого количества цифр." if data.get('goal') in ["Подвести итоги и статистику", "Отчитаться о проделанной работе"] else ""}
-{"Вызывает доверие, конкретизирует цель (зачем нужны деньги, кому помогут)." if data.get('goal') == "Сбор средств" else ""}
-
-Учитывай специфику социальной сети: {"Короткий и понятный текст с яркими заголовками. Эмоциональная подача, стимулирующая обсуждение и активное комментирование." if data.get('social_network') == "ВК" else "Качественный и структурированный материал с четкими выводами. Лаконичный стиль, минимум графического оформления, максимальная информативность." if data.get('social_network') == "Телеграм" else ""}
-
-Стиль:
-Естественный, живой, внимание к деталям. Избегай клише, канцеляризмов и морализаторства.
-
-Формат вывода:
-Готовый текст поста. Без пояснений, заголовков вроде «[Текст поста]» или комментариев.
-Добавь 4-5 хештегов в конце по тематике поста для социальных сетей.
-"""
-
-    await callback.message.answer("✨ Создаю новый вариант...")
-
-    try:
-        result = api_get_result(prompt)
-        await state.update_data(generated_text=result)
-
-        parts = split_message(result)
-        for part in parts:
-            await callback.message.answer(part, parse_mode=ParseMode.MARKDOWN)
-
-        success = False
-        if data.get('selected_nko_id'):
-            success = await save_post_to_db(callback.message, state, result, 'regenerated')
-
-        keyboard = types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [types.InlineKeyboardButton(text="✏️ Отредактировать текст", callback_data="edit_text")],
-                [types.InlineKeyboardButton(text="✅ Сохранить как есть", callback_data="save_text")],
-                [types.InlineKeyboardButton(text="🔄 Создать заново", callback_data="regenerate_text")]
-            ]
-        )
-
-        if success:
-            await callback.message.answer(
-                "Новый вариант создан и сохранен в базу! Что вы хотите сделать?",
-                reply_markup=keyboard
-            )
-        else:
-            await callback.message.answer(
-                "Новый вариант создан!" + (" (не сохранен в базу - НКО не выбрано)" if not data.get('selected_nko_id') else ""),
-                reply_markup=keyboard
-            )
-
-    except Exception as e:
-        await callback.message.answer("❌ Ошибка при повторного создания. Попробуйте еще раз.")
-        print(f"Regeneration error: {e}")
+        await callback.message.answer("✨ Создаю новый вариант...")
+        await enqueue('text', callback.message.chat.id, callback.from_user.id,
+                {"mode": "regenerate", "prompt": prompt, "prompt_tokens": prompt_tokens, "data": data})
 
     await callback.answer()
 
@@ -1203,7 +1099,7 @@ async def save_post_to_db(msg_obj, state: FSMContext, post_content: str, post_ty
     if not nko_id:
         return False
 
-    con = sqlite3.connect('nko.db')
+    con = sqlite3.connect('nko.db', factory=TimedConnection)
     cur = con.cursor()
     try:
         cur.execute(
@@ -1211,6 +1107,9 @@ async def save_post_to_db(msg_obj, state: FSMContext, post_content: str, post_ty
             (post_type, nko_id, post_content, data.get('goal'), data.get('audience'),
              data.get('tone'), data.get('details'), data.get('cta'), data.get('nuances'))
         )
+        if post_type in STYLE_POST_TYPES:
+            # дописываем в профиль стиля только этот новый пост
+            refresh_style_profile(cur, nko_id)
         con.commit()
         return True
     except sqlite3.Error as e:
@@ -1302,60 +1201,12 @@ async def ai_refine_text(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     edited_text = data.get('edited_text', '')
 
-    original_data = data
-
-    prompt = f"""
-        Пользователь отредактировал текст и просит его доработать.
-
-        Оригинальный контекст:
-        - НКО: {original_data.get('name', 'Без названия')}
-        - Цель: {original_data.get('goal', '')}
-        - Аудитория: {original_data.get('audience', '')}
-        - Тон: {original_data.get('tone', '')}
-
-        Отредактированный текст пользователя:
-        {edited_text}
-
-        Задача: улучшить текст, сохранив смысл правок пользователя, сделать его более профессиональным и соответствующим исходным требованиям.
-        """
+    prompt, prompt_tokens = render_refine_prompt(data, edited_text)
 
     await callback.message.answer(" Дорабатываю текст...")
 
-    try:
-        refined_text = api_get_result(prompt)
-        await state.update_data(generated_text=refined_text)
-
-        parts = split_message(refined_text)
-        for part in parts:
-            await callback.message.answer(part)
-
-        # сохраняем текст в базу только если есть НКО
-        success = False
-        if data.get('selected_nko_id'):
-            success = await save_post_to_db(callback.message, state, refined_text, 'ai_refined')
-
-        keyboard = types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [types.InlineKeyboardButton(text="✏️ Отредактировать текст", callback_data="edit_text")],
-                [types.InlineKeyboardButton(text="✅ Сохранить как есть", callback_data="save_text")],
-                [types.InlineKeyboardButton(text="🔄 Создать заново", callback_data="regenerate_text")]
-            ]
-        )
-
-        if success:
-            await callback.message.answer(
-                "Текст доработан и сохранен в базу! Что вы хотите сделать?",
-                reply_markup=keyboard
-            )
-        else:
-            await callback.message.answer(
-                "Текст доработан!" + (" (не сохранен в базу - НКО не выбрано)" if not data.get('selected_nko_id') else ""),
-                reply_markup=keyboard
-            )
-
-    except Exception as e:
-        await callback.message.answer("❌ Ошибка при доработке текста. Попробуйте еще раз.")
-        print(f"AI refine error: {e}")
+    await enqueue('text', callback.message.chat.id, callback.from_user.id,
+            {"mode": "refine", "prompt": prompt, "prompt_tokens": prompt_tokens, "data": data})
 
     await callback.answer()
 
@@ -1389,6 +1240,284 @@ async def process_edited_text(message: types.Message, state: FSMContext):
         reply_markup=keyboard
     )
 
+
+# --- фоновые задания генерации ---
+def job_state(bot: Bot, job):
+    return FSMContext(
+        storage=dp.storage,
+        key=StorageKey(bot_id=bot.id, chat_id=job.chat_id, user_id=job.user_id)
+    )
+
+
+async def restore_job_state(bot: Bot, job):
+    state = job_state(bot, job)
+    # после перезапуска MemoryStorage пуст — восстанавливаем бриф пользователя из задания
+    if not await state.get_data():
+        await state.update_data(**job.payload['data'])
+    if job.resumed:
+        await bot.send_message(job.chat_id, "🔄 Бот перезапускался, продолжаю работу над вашим запросом...")
+    return state
+
+
+def make_text_actions_keyboard():
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[
+            [types.InlineKeyboardButton(text="✏️ Отредактировать текст", callback_data="edit_text")],
+            [types.InlineKeyboardButton(text="✅ Сохранить как есть", callback_data="save_text")],
+            [types.InlineKeyboardButton(text="🔄 Создать заново", callback_data="regenerate_text")]
+        ]
+    )
+
+
+@job_handler('text')
+async def run_text_job(bot: Bot, job):
+    state = await restore_job_state(bot, job)
+    mode = job.payload['mode']
+
+    if mode == 'generate':
+        await deliver_generated_text(bot, job, state)
+    elif mode == 'regenerate':
+        await deliver_regenerated_text(bot, job.chat_id, state, job.payload['prompt'])
+    elif mode == 'refine':
+        await deliver_refined_text(bot, job, state)
+
+
+async def deliver_generated_text(bot: Bot, job, state: FSMContext):
+    prompt = job.payload['prompt']
+    data = await state.get_data()
+
+    # вопрос с кнопками уходит вместе с последним куском текста, а не отдельным сообщением
+    footer = "Что вы хотите сделать с этим текстом?"
+
+    try:
+        if LLM_STREAMING:
+            result = await stream_to_chat(bot, job.chat_id, api_stream_result(prompt, chat_id=job.chat_id),
+                                          footer=footer, reply_markup=make_text_actions_keyboard())
+        else:
+            result = await api_get_result(prompt, chat_id=job.chat_id)
+    except ConnectionError:
+        await bot.send_message(job.chat_id, "Ошибка соединения с сервером ИИ. Проверьте интернет-соединение и попробуйте еще раз.")
+        raise
+    except TimeoutError:
+        await bot.send_message(job.chat_id, "Превышено время ожидания ответа от ИИ. Попробуйте еще раз.")
+        raise
+    except Exception:
+        await bot.send_message(job.chat_id, "Произошла непредвиденная ошибка при создании контента. Попробуйте еще раз.")
+        raise
+
+    await state.update_data(generated_text=result)
+
+    # при потоковой выдаче текст уже в чате
+    if not LLM_STREAMING:
+        await send_parts(bot, job.chat_id, split_message(result), footer, make_text_actions_keyboard())
+
+    if await asyncio.to_thread(speculation_enabled, data.get('selected_nko_id')):
+        speculate(job.chat_id, prompt)
+
+
+async def deliver_regenerated_text(bot: Bot, chat_id: int, state: FSMContext, prompt: str, result: str = None):
+    # result — вариант, приготовленный заранее; без него идём в модель
+    data = await state.get_data()
+
+    try:
+        if result is None:
+            result = await api_get_result(prompt, use_cache=False, chat_id=chat_id)
+        await state.update_data(generated_text=result)
+
+        success = False
+        if data.get('selected_nko_id'):
+            success = await save_post_to_db(None, state, result, 'regenerated')
+
+        if success:
+            footer = "Новый вариант создан и сохранен в базу! Что вы хотите сделать?"
+        else:
+            footer = "Новый вариант создан!" + (" (не сохранен в базу - НКО не выбрано)" if not data.get('selected_nko_id') else "")
+
+        await send_parts(
+            bot, chat_id, split_message(result, parse_mode=ParseMode.MARKDOWN), footer,
+            reply_markup=make_text_actions_keyboard(), parse_mode=ParseMode.MARKDOWN
+        )
+
+    except Exception:
+        await bot.send_message(chat_id, "❌ Ошибка при повторного создания. Попробуйте еще раз.")
+        raise
+
+    # и сразу готовим следующий вариант — на случай ещё одного нажатия
+    if await asyncio.to_thread(speculation_enabled, data.get('selected_nko_id')):
+        speculate(chat_id, prompt)
+
+
+async def deliver_refined_text(bot: Bot, job, state: FSMContext):
+    data = await state.get_data()
+
+    try:
+        refined_text = await api_get_result(job.payload['prompt'], chat_id=job.chat_id)
+        await state.update_data(generated_text=refined_text)
+
+        # сохраняем текст в базу только если есть НКО
+        success = False
+        if data.get('selected_nko_id'):
+            success = await save_post_to_db(None, state, refined_text, 'ai_refined')
+
+        if success:
+            footer = "Текст доработан и сохранен в базу! Что вы хотите сделать?"
+        else:
+            footer = "Текст доработан!" + (" (не сохранен в базу - НКО не выбрано)" if not data.get('selected_nko_id') else "")
+
+        await send_parts(bot, job.chat_id, split_message(refined_text), footer, make_text_actions_keyboard())
+
+    except Exception:
+        await bot.send_message(job.chat_id, "❌ Ошибка при доработке текста. Попробуйте еще раз.")
+        raise
+
+
+@job_handler('image')
+async def run_image_job(bot: Bot, job):
+    state = await restore_job_state(bot, job)
+    image_prompt = job.payload['prompt']
+
+    if job.payload.get('variants', 1) > 1:
+        await deliver_image_variants(bot, job, state)
+        return
+
+    try:
+        # картинка приходит байтами: одну генерацию могут получить сразу несколько нажатий
+        image_data = await generate_image_shared(
+            KANDINSKY_API_KEY,
+            KANDINSKY_SECRET_KEY,
+            image_prompt
+        )
+
+        if image_data:
+            keyboard = types.InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [types.InlineKeyboardButton(text="✨Создать еще", callback_data="generate_another_image")],
+                    [types.InlineKeyboardButton(text="✏️ Изменить запрос", callback_data="edit_image_prompt")],
+                    [types.InlineKeyboardButton(text="Сохранить (если выбирали нко)", callback_data="save_image")]
+                ]
+            )
+
+            # картинка остаётся в хранилище: её можно сохранить в пост и отправить снова без загрузки
+            image_hash = await asyncio.to_thread(store_image, image_data, image_prompt)
+            await state.update_data(image_hash=image_hash)
+
+            # в чат уходит версия под выбранную соцсеть: нужный кадр и сжатый JPEG вместо PNG
+            data = await state.get_data()
+            photo_hash, photo_data = await render_for(image_hash, image_data, data.get('social_network'))
+
+            # кнопки — прямо под картинкой, без отдельного сообщения
+            await send_stored_photo(
+                bot,
+                job.chat_id,
+                photo_hash,
+                photo_data,
+                caption="Ваша созданная картинка!\n\nЧто вы хотите сделать с этой картинкой?",
+                reply_markup=keyboard
+            )
+
+        else:
+            await bot.send_message(
+                job.chat_id,
+                f"❌ Не удалось создать картинку. Попробуйте изменить запрос.\n\n"
+                f"**Текущий запрос:**\n`{image_prompt}`",
+                parse_mode=ParseMode.MARKDOWN
+            )
+
+            keyboard = types.InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [types.InlineKeyboardButton(text="✏️ Отредактировать запрос", callback_data="edit_image_prompt")],
+                    [types.InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="generate_image")]
+                ]
+            )
+
+            await bot.send_message(job.chat_id, "Выберите действие:", reply_markup=keyboard)
+
+    except Exception as e:
+        await bot.send_message(
+            job.chat_id,
+            f"❌ Ошибка при генерации картинки: {str(e)}\n\n"
+            f"Попробуйте изменить запрос или повторить позже."
+        )
+        raise
+
+
+async def deliver_image_variants(bot: Bot, job, state: FSMContext):
+    image_prompt = job.payload['prompt']
+
+    try:
+        images = await generate_variants_shared(
+            KANDINSKY_API_KEY,
+            KANDINSKY_SECRET_KEY,
+            image_prompt,
+            job.payload['variants']
+        )
+
+        if not images:
+            await bot.send_message(job.chat_id, "❌ Не удалось создать картинки. Попробуйте изменить запрос.")
+            keyboard = types.InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [types.InlineKeyboardButton(text="✏️ Отредактировать запрос", callback_data="edit_image_prompt")],
+                    [types.InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="generate_another_image")]
+                ]
+            )
+            await bot.send_message(job.chat_id, "Выберите действие:", reply_markup=keyboard)
+            return
+
+        image_hashes = [await asyncio.to_thread(store_image, image_data, image_prompt) for image_data in images]
+        await state.update_data(image_variants=image_hashes, image_hash=image_hashes[0])
+
+        data = await state.get_data()
+        renditions = await asyncio.gather(*(
+            render_for(image_hash, image_data, data.get('social_network'))
+            for image_hash, image_data in zip(image_hashes, images)
+        ))
+        await send_stored_album(bot, job.chat_id, renditions, caption="Ваши варианты картинки!")
+
+        # к альбому кнопки не прикрепить — выбор отдельным сообщением, по кнопке на вариант
+        keyboard = types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [types.InlineKeyboardButton(text=f"Сохранить №{i + 1}", callback_data=f"pick_image:{i}")
+                 for i in range(len(image_hashes))],
+                [types.InlineKeyboardButton(text="✨Создать еще", callback_data="generate_another_image")],
+                [types.InlineKeyboardButton(text="✏️ Изменить запрос", callback_data="edit_image_prompt")]
+            ]
+        )
+        await bot.send_message(job.chat_id, "Какой вариант сохранить? (сохраняется, если выбирали нко)",
+                               reply_markup=keyboard)
+
+    except Exception as e:
+        await bot.send_message(
+            job.chat_id,
+            f"❌ Ошибка при генерации картинки: {str(e)}\n\n"
+            f"Попробуйте изменить запрос или повторить позже."
+        )
+        raise
+
+
+async def main():
+    # первым делом: процессы пула форкаются, пока у бота ещё нет других потоков
+    start_render_pool()
+    metrics_server = await start_metrics_server()
+    # общий клиент модели открываем до начала опроса и закрываем при остановке бота
+    await open_llm_client()
+    await prefetch_pipelines(KANDINSKY_API_KEY, KANDINSKY_SECRET_KEY)
+    await bot.set_my_commands([
+        BotCommand(command="start", description="Начать заново"),
+        BotCommand(command="fast_regen", description="Быстрое «Создать заново» для выбранного НКО: вкл/выкл"),
+    ])
+    # воркеры подхватывают задания, не выполненные до перезапуска
+    await start_workers(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await stop_workers()
+        await close_llm_client()
+        await close_image_client()
+        close_render_pool()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+
+
 if __name__ == "__main__":
     import asyncio
-    asyncio.run(dp.start_polling(bot))
+    asyncio.run(main())
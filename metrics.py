@@ -0,0 +1,249 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+from tracing import span
+
+
+# /metrics в формате Prometheus; 0 — не поднимать сервер
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# границы корзин гистограмм, с
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0, 120.0, 180.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # метрики обновляются и из потоков (asyncio.to_thread)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    Значения меняются через inc() или считаются в момент запроса /metrics из уже
+    существующей статистики модуля: func() возвращает число (без меток)
+    или словарь {кортеж значений меток: число}.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self.func = func
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        if self.func is not None:
+            values = self.func()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [("", key if isinstance(key, tuple) else (key,), (), value) for key, value in values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=FAST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # метки -> [счётчики по корзинам, сумма, количество]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    out.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+                out.append(("_sum", key, (), total))
+                out.append(("_count", key, (), count))
+        return out
+
+
+def render():
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# --- метрики, общие для всех модулей ---
+LLM_LATENCY = Histogram(
+    "nko_llm_request_seconds", "Время api_get_result / api_stream_result",
+    ("call", "source", "outcome"), SLOW_BUCKETS,
+)
+LLM_FIRST_TOKEN = Histogram(
+    "nko_llm_first_token_seconds", "Время до первого куска потокового ответа", (), SLOW_BUCKETS,
+)
+LLM_ROUTE_ATTEMPTS = Counter(
+    "nko_llm_route_attempts_total", "Попытки запросов к моделям по маршрутам", ("model", "outcome"),
+)
+IMAGE_PHASE = Histogram(
+    "nko_image_phase_seconds", "Фазы generate_image: pipelines, run, status (каждый опрос), total",
+    ("phase",), SLOW_BUCKETS,
+)
+IMAGE_RESULTS = Counter(
+    "nko_image_results_total", "Чем закончилась generate_image: done, fail, timeout, error", ("outcome",),
+)
+DB_QUERY = Histogram(
+    "nko_db_query_seconds", "Время SQL-запросов к SQLite", ("operation", "table"), FAST_BUCKETS,
+)
+HANDLER_LATENCY = Histogram(
+    "nko_handler_seconds", "Время обработчиков aiogram", ("event", "handler", "outcome"), FAST_BUCKETS,
+)
+
+
+# --- SQLite: каждый запрос проходит через TimedCursor ---
+_SQL_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE(?!\s+OF\b)|TABLE(?:\s+IF\s+NOT\s+EXISTS)?|ON)\s+(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _sql_labels(sql: str):
+    words = sql.split(None, 1)
+    match = _SQL_TABLE_RE.search(sql)
+    return (words[0].upper() if words else ""), (match.group(1) if match else "")
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        operation, table = _sql_labels(sql)
+        with DB_QUERY.time(operation=operation, table=table), span(f"db:{operation} {table}".rstrip()):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        operation, table = _sql_labels(sql)
+        with DB_QUERY.time(operation=operation, table=table), span(f"db:{operation} {table}".rstrip()):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3.connect(path, factory=TimedConnection) — то же соединение, но с замером запросов."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# --- aiogram: время каждого обработчика ---
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, event=self.event, handler=name, outcome=outcome)
+
+
+def instrument_dispatcher(dp):
+    dp.message.middleware(HandlerMetricsMiddleware("message"))
+    dp.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+
+
+# --- HTTP-сервер /metrics ---
+async def _metrics_view(request):
+    return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Поднимает /metrics в текущем цикле событий; вернёт runner для cleanup() или None, если выключено."""
+    if not port:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
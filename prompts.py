@@ -0,0 +1,211 @@
+import os
+from string import Formatter
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from metrics import Histogram
+
+
+TASK_TYPES = ["Создание текста"]
+GOALS = [
+    "Анонс события",
+    "Рассказать о прошедшем событии",
+    "Создать темы поста",
+    "Подвести итоги и статистику",
+    "Сбор средств",
+    "Повысить осведомлённость",
+    "Отчитаться о проделанной работе",
+    "Рассказать о спонсоре",
+]
+SOCIAL_NETWORKS = ["ВК", "Телеграм", None]
+
+SOCIAL_SPECIFICS = {
+    "ВК": "Короткий и понятный текст с яркими заголовками. Эмоциональная подача, стимулирующая обсуждение и активное комментирование.",
+    "Телеграм": "Качественный и структурированный материал с четкими выводами. Лаконичный стиль, минимум графического оформления, максимальная информативность.",
+}
+
+GOAL_REQUIREMENTS = {
+    "Анонс события": "Побуждает к действию (прийти, помочь, поделиться).",
+    "Подвести итоги и статистику": "Содержит результаты в удобочитаемом виде, избегает большого количества цифр.",
+    "Отчитаться о проделанной работе": "Содержит результаты в удобочитаемом виде, избегает большого количества цифр.",
+    "Сбор средств": "Вызывает доверие, конкретизирует цель (зачем нужны деньги, кому помогут).",
+    "Рассказать о спонсоре": "Уважительно, без рекламного тона, с акцентом на вклад и ценность поддержки.",
+}
+
+EVENT_LINES = {
+    "Анонс события": "Дата и место события: {event_date}",
+    "Рассказать о прошедшем событии": "Дата прошедшего события: {event_date}",
+}
+
+# кодировка для подсчёта токенов (если установлен tiktoken), иначе грубая оценка
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "o200k_base")
+
+# размер промптов по шаблонам — смотреть в /metrics, что дало сокращение шаблона или примеров
+PROMPT_TOKENS = Histogram(
+    "nko_prompt_tokens", "Токенов в отрендеренном промпте", ("template",),
+    (250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000),
+)
+
+
+class CompiledTemplate:
+    """Шаблон, разобранный один раз: при рендере только склеиваются готовые куски и значения полей."""
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.parts = [(literal, field) for literal, field, _, _ in Formatter().parse(text)]
+        self.fields = [field for _, field in self.parts if field]
+
+    def render(self, **values):
+        out = []
+        for literal, field in self.parts:
+            out.append(literal)
+            if field:
+                out.append(str(values.get(field) or ""))
+        return "".join(out)
+
+
+def _lines(*lines):
+    # статические условия уже вычислены: пустые строки от них в промпт не попадают
+    return "\n".join(line for line in lines if line is not None)
+
+
+def _escape(text: str):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _compile_post_template(task_type, goal, social_network, has_event):
+    event_line = EVENT_LINES.get(goal) if has_event else None
+    requirement = GOAL_REQUIREMENTS.get(goal)
+    specifics = SOCIAL_SPECIFICS.get(social_network, "")
+
+    text = _lines(
+        "Ты — опытный копирайтер и редактор благотворительной организации: {organization_context}",
+        "",
+        "Напиши текст поста для социальных сетей на основе следующих данных:",
+        f"Цель поста: {_escape(goal or '')}",
+        event_line,
+        "Целевая аудитория поста: {audience}",
+        "Основная информация поста: {details}",
+        "Призыв к действию: {cta}",
+        "Дополнительные пожелания: {nuances}",
+        "",
+        "{style_block}",
+        "{examples_block}",
+        "",
+        "Требования к тексту:",
+        "Соответствует цели поста.",
+        "Учитывает дату и место события." if event_line else None,
+        "Написан в стиле, близком к референсу и глобальному контексту (стиль, интонация, уровень языка). "
+        "Текст не должен выглядеть сгенерированным нейросетью, пиши так, как писал бы человек.",
+        requirement,
+        "",
+        f"Учитывай специфику социальной сети: {specifics}",
+        "",
+        "Стиль:",
+        "Естественный, живой, внимание к деталям. Избегай клише, канцеляризмов и морализаторства.",
+        "",
+        "Формат вывода:",
+        "Готовый текст поста. Без пояснений, заголовков вроде «[Текст поста]» или комментариев.",
+        "Добавь 4-5 хештегов в конце по тематике поста для социальных сетей.",
+    )
+    return CompiledTemplate(f"post:{goal}:{social_network}:{int(has_event)}", text)
+
+
+REFINE_TEMPLATE = CompiledTemplate("refine", _lines(
+    "Пользователь отредактировал текст и просит его доработать.",
+    "",
+    "Оригинальный контекст:",
+    "- НКО: {name}",
+    "- Цель: {goal}",
+    "- Аудитория: {audience}",
+    "- Тон: {tone}",
+    "",
+    "Отредактированный текст пользователя:",
+    "{edited_text}",
+    "",
+    "Задача: улучшить текст, сохранив смысл правок пользователя, сделать его более профессиональным "
+    "и соответствующим исходным требованиям.",
+))
+
+
+# --- все известные сочетания собираются один раз при импорте ---
+_post_templates = {
+    (task_type, goal, social_network, has_event): _compile_post_template(task_type, goal, social_network, has_event)
+    for task_type in TASK_TYPES
+    for goal in GOALS
+    for social_network in SOCIAL_NETWORKS
+    for has_event in (False, True)
+}
+
+
+def get_post_template(task_type, goal, social_network, has_event):
+    key = (task_type, goal, social_network if social_network in SOCIAL_SPECIFICS else None, bool(has_event))
+    template = _post_templates.get(key)
+    if template is None:
+        # незнакомое сочетание (например, старое значение из брифа) — собираем и запоминаем
+        template = _post_templates[key] = _compile_post_template(*key)
+    return template
+
+
+def count_tokens(text: str):
+    if tiktoken is not None:
+        return len(_encoding().encode(text))
+    # без tiktoken: примерно 4 байта UTF-8 на токен
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+_tiktoken_encoding = None
+
+
+def _encoding():
+    global _tiktoken_encoding
+    if _tiktoken_encoding is None:
+        _tiktoken_encoding = tiktoken.get_encoding(PROMPT_ENCODING)
+    return _tiktoken_encoding
+
+
+def _record(template: CompiledTemplate, prompt: str):
+    tokens = count_tokens(prompt)
+    PROMPT_TOKENS.observe(tokens, template=template.name)
+    return tokens
+
+
+def render_post_prompt(data: dict, organization_context: str, examples_text: str = "", style_digest: str = ""):
+    """Возвращает (промпт, число токенов) для создания поста по брифу из FSM."""
+    event_date = data.get('event_date')
+    goal = data.get('goal', '')
+    template = get_post_template(
+        data.get('task_type') or TASK_TYPES[0],
+        goal,
+        data.get('social_network'),
+        bool(event_date) and goal in EVENT_LINES,
+    )
+
+    prompt = template.render(
+        organization_context=organization_context,
+        event_date=event_date,
+        audience=data.get('audience', ''),
+        details=data.get('details', ''),
+        cta=data.get('cta', ''),
+        nuances=data.get('nuances', ''),
+        style_block="Стиль организации по её прошлым постам:\n" + style_digest if style_digest else "",
+        examples_block=(
+            "Стилистический референс, пиши в аналогичном стиле с этими постами:" + examples_text
+            if examples_text else ""
+        ),
+    )
+    return prompt, _record(template, prompt)
+
+
+def render_refine_prompt(data: dict, edited_text: str):
+    prompt = REFINE_TEMPLATE.render(
+        name=data.get('name', 'Без названия'),
+        goal=data.get('goal', ''),
+        audience=data.get('audience', ''),
+        tone=data.get('tone', ''),
+        edited_text=edited_text,
+    )
+    return prompt, _record(REFINE_TEMPLATE, prompt)
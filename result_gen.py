@@ -1,33 +1,196 @@
-from openai import OpenAI
+import asyncio
+import os
+import time
+
+import httpx
+from openai import AsyncOpenAI
 from config import key
+from llm_cache import get_cached, put_cached, make_key, trim_cache_periodically
+from singleflight import SingleFlight, LeaderGone
+from llm_scheduler import scheduler
+from llm_router import router
+from metrics import LLM_LATENCY, LLM_FIRST_TOKEN
+from tracing import span
 
 
-def api_get_result(text):
-    client = OpenAI(
-      base_url="https://openrouter.ai/api/v1",
-      api_key=key,
-    )
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+# основная модель; под её именем ответы лежат в кэше, даже если ответила резервная
+LLM_MODEL = router.routes[0].model
+
+# размер пула keep-alive соединений и таймауты общего клиента
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "300"))
+
+# показывать пост в чате по мере генерации, а не после полного ответа
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+
+_clients = {}
+_http_client = None
+_trim_task = None
+
+# одинаковые запросы, пришедшие одновременно (двойное нажатие кнопки), идут в модель один раз
+_flights = SingleFlight()
+
+
+# --- один пул соединений на весь процесс: соединения и TLS-сессии переиспользуются между запросами ---
+def get_client(base_url=None):
+    global _http_client
+    base_url = base_url or LLM_BASE_URL
+
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_POOL_SIZE,
+                max_keepalive_connections=LLM_POOL_SIZE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+
+    if base_url not in _clients:
+        # повторы делает router, поэтому свои повторы клиента выключены
+        _clients[base_url] = AsyncOpenAI(
+            base_url=base_url,
+            api_key=key,
+            http_client=_http_client,
+            max_retries=0,
+        )
+    return _clients[base_url]
+
+
+async def open_llm_client():
+    """Создаёт общий клиент и заранее открывает соединения, чтобы первый пользователь не ждал TLS."""
+    global _trim_task
+    if _trim_task is None:
+        _trim_task = asyncio.create_task(trim_cache_periodically())
+    for base_url in {route.base_url or LLM_BASE_URL for route in router.routes}:
+        get_client(base_url)
+        try:
+            await _http_client.head(base_url)
+        except httpx.HTTPError as e:
+            print(f"LLM warm-up error: {e}")
+
+
+async def close_llm_client():
+    global _http_client, _trim_task
+    if _trim_task is not None:
+        _trim_task.cancel()
+        _trim_task = None
+    _clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
-    completion = client.chat.completions.create(
-      model="openai/gpt-oss-20b:free",
-      messages=[
+def _messages(text):
+    return [
         {
           "role": "user",
           "content": f"{text}"
         }
-      ]
+    ]
+
+
+async def _complete(text, use_cache, chat_id, low_priority):
+    # асинхронный клиент: пока ждём ответ модели, бот продолжает обслуживать другие чаты
+    async def request(route):
+        completion = await get_client(route.base_url).chat.completions.create(
+          model=route.model,
+          messages=_messages(text)
+        )
+        return completion.choices[0].message.content
+
+    result = await router.call(request, slot=lambda: scheduler.slot(chat_id, low_priority))
+    if use_cache:
+        await asyncio.to_thread(put_cached, text, LLM_MODEL, result)
+    return result
+
+
+async def api_get_result(text, use_cache=True, chat_id=None, low_priority=False):
+    # use_cache=False — всегда новый ответ модели (например, для "Создать заново")
+    # chat_id — чей это запрос, по нему планировщик делит очередь между чатами
+    # low_priority — фоновый запрос, уступает место запросам пользователей
+    started = time.perf_counter()
+    source, outcome = "model", "ok"
+    try:
+        if use_cache:
+            cached = await asyncio.to_thread(get_cached, text, LLM_MODEL)
+            if cached is not None:
+                source = "cache"
+                return cached
+
+        # фоновый запрос не склеиваем с пользовательским: иначе пользователь ждал бы в фоновой очереди
+        flight_key = (make_key(text, LLM_MODEL), use_cache, low_priority)
+        if _flights.pending(flight_key) is not None:
+            source = "shared"
+        with span("llm:get_result", shared=source == "shared"):
+            return await _flights.do(flight_key, _complete, text, use_cache, chat_id, low_priority)
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        LLM_LATENCY.observe(time.perf_counter() - started, call="get_result", source=source, outcome=outcome)
+
+
+async def _open_stream(route, text):
+    stream = await get_client(route.base_url).chat.completions.create(
+      model=route.model,
+      messages=_messages(text),
+      stream=True
     )
 
-    return completion.choices[0].message.content
+    # закрываем ответ и при досрочном aclose() генератора — соединение сразу возвращается в пул
+    async with stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+async def api_stream_result(text, use_cache=True, chat_id=None):
+    """То же, что api_get_result, но отдаёт текст кусками по мере генерации."""
+    started = time.perf_counter()
+    source, outcome = "model", "ok"
+    try:
+        if use_cache:
+            cached = await asyncio.to_thread(get_cached, text, LLM_MODEL)
+            if cached is not None:
+                source = "cache"
+                yield cached
+                return
+
+        flight_key = (make_key(text, LLM_MODEL), use_cache, False)
+        while (future := _flights.pending(flight_key)) is not None:
+            try:
+                result = await _flights.wait(future)
+            except LeaderGone:
+                # ведущий поток оборвался (например, его чат перестал читать) — идём в модель сами
+                continue
+            source = "shared"
+            yield result
+            return
+
+        async def open_stream(route):
+            return _open_stream(route, text)
+
+        with _flights.lead(flight_key) as future:
+            parts = []
+            async for chunk in router.stream(open_stream, slot=lambda: scheduler.slot(chat_id)):
+                if not parts:
+                    LLM_FIRST_TOKEN.observe(time.perf_counter() - started)
+                parts.append(chunk)
+                yield chunk
+
+            result = "".join(parts)
+            future.set_result(result)
 
+        # в кэш попадает только полностью полученный ответ
+        if use_cache:
+            await asyncio.to_thread(put_cached, text, LLM_MODEL, result)
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        LLM_LATENCY.observe(time.perf_counter() - started, call="stream", source=source, outcome=outcome)
 
-def split_message(text: str, limit: int = 4000):
-    parts = []
-    while len(text) > limit:
-        split_pos = text.rfind("\n", 0, limit)
-        if split_pos == -1:
-            split_pos = limit
-        parts.append(text[:split_pos])
-        text = text[split_pos:]
-    parts.append(text)
-    return parts
\ No newline at end of file
@@ -0,0 +1,112 @@
+import math
+import os
+import re
+import sqlite3
+from collections import Counter
+
+from prompts import count_tokens
+
+
+# сколько примеров и сколько токенов на них максимум уходит в промпт
+EXAMPLES_TOP_K = int(os.getenv("EXAMPLES_TOP_K", "3"))
+EXAMPLES_TOKEN_BUDGET = int(os.getenv("EXAMPLES_TOKEN_BUDGET", "800"))
+# когда у НКО есть профиль стиля, хватает одного короткого примера
+EXAMPLES_WITH_PROFILE_TOP_K = int(os.getenv("EXAMPLES_WITH_PROFILE_TOP_K", "1"))
+EXAMPLES_WITH_PROFILE_TOKEN_BUDGET = int(os.getenv("EXAMPLES_WITH_PROFILE_TOKEN_BUDGET", "250"))
+
+# посты, по которым учимся стилю: примеры от НКО и тексты, которые пользователь поправил сам
+STYLE_POST_TYPES = ('example', 'edited')
+
+# грубый стемминг для русского: сравниваем слова по первым STEM_LENGTH буквам
+STEM_LENGTH = 5
+MAX_QUERY_TERMS = 32
+
+
+def _stems(text: str):
+    words = re.findall(r"\w{3,}", (text or "").lower())
+    return [word[:STEM_LENGTH] for word in words]
+
+
+def _fts_query(text: str):
+    terms = list(dict.fromkeys(_stems(text)))[:MAX_QUERY_TERMS]
+    return " OR ".join(f'"{term}"*' for term in terms)
+
+
+def _search_fts(cur, nko_id, query_text, k):
+    query = _fts_query(query_text)
+    if not query:
+        return []
+
+    placeholders = ", ".join("?" for _ in STYLE_POST_TYPES)
+    cur.execute(
+        f"SELECT p.content FROM posts_fts JOIN posts p ON p.post_id = posts_fts.rowid "
+        f"WHERE posts_fts MATCH ? AND p.nko_id = ? AND p.post_type IN ({placeholders}) "
+        f"ORDER BY bm25(posts_fts) LIMIT ?",
+        (query, nko_id, *STYLE_POST_TYPES, k)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _all_posts(cur, nko_id):
+    placeholders = ", ".join("?" for _ in STYLE_POST_TYPES)
+    cur.execute(
+        f"SELECT content FROM posts WHERE nko_id = ? AND post_type IN ({placeholders}) ORDER BY post_id DESC",
+        (nko_id, *STYLE_POST_TYPES)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def bm25_rank(docs, query_text, k1: float = 1.5, b: float = 0.75):
+    """BM25 в памяти — если SQLite собран без FTS5."""
+    query = set(_stems(query_text))
+    if not docs or not query:
+        return []
+
+    tokenized = [_stems(doc) for doc in docs]
+    avg_len = sum(len(t) for t in tokenized) / len(tokenized) or 1
+    df = Counter(term for t in tokenized for term in set(t) if term in query)
+
+    scored = []
+    for doc, terms in zip(docs, tokenized):
+        tf = Counter(terms)
+        score = 0.0
+        for term in query:
+            if not tf[term]:
+                continue
+            idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(terms) / avg_len))
+        if score > 0:
+            scored.append((score, doc))
+
+    scored.sort(key=lambda pair: -pair[0])
+    return [doc for _, doc in scored]
+
+
+def _fit_budget(examples, token_budget):
+    selected = []
+    used = 0
+    for example in examples:
+        tokens = count_tokens(example)
+        if used + tokens <= token_budget:
+            selected.append(example)
+            used += tokens
+        elif not selected:
+            # даже самый подходящий пример не влезает — берём его начало
+            ratio = token_budget / tokens
+            selected.append(example[:int(len(example) * ratio)])
+            break
+    return selected
+
+
+def top_examples(cur, nko_id, query_text: str, k: int = EXAMPLES_TOP_K, token_budget: int = EXAMPLES_TOKEN_BUDGET):
+    """Самые близкие к запросу посты НКО, не больше k штук и token_budget токенов."""
+    try:
+        examples = _search_fts(cur, nko_id, query_text, k)
+    except sqlite3.OperationalError:
+        examples = bm25_rank(_all_posts(cur, nko_id), query_text)[:k]
+
+    # ничего похожего — хотя бы последние посты, чтобы модель видела стиль
+    if not examples:
+        examples = _all_posts(cur, nko_id)[:k]
+
+    return _fit_budget(examples, token_budget)
@@ -1,84 +1,320 @@
-import json
-import time
-import requests
-import base64
-from datetime import datetime
-from io import BytesIO
-
-
-def generate_image(api_key, secret_key, prompt, return_type='file'):
-    """
-    Улучшенная функция для генерации изображения
-
-    Args:
-        api_key (str): Ваш API ключ
-        secret_key (str): Ваш секретный ключ
-        prompt (str): Описание изображения
-        return_type (str): 'file' - путь к файлу, 'bytes' - бинарные данные
-    """
-
-    URL = 'https://api-key.fusionbrain.ai/'
-    headers = {
-        'X-Key': f'Key {api_key}',
-        'X-Secret': f'Secret {secret_key}',
-    }
-
-    try:
-        # 1. Получаем доступную модель
-        response = requests.get(URL + 'key/api/v1/pipelines', headers=headers)
-        pipelines = response.json()
-        pipeline_id = pipelines[0]['id']
-        print(f"Используется модель: {pipelines[0]['name']}")
-
-        # 2. Отправляем запрос на генерацию
-        params = {
-            "type": "GENERATE",
-            "numImages": 1,
-            "width": 1024,
-            "height": 1024,
-            "generateParams": {"query": prompt}
-        }
-
-        data = {
-            'pipeline_id': (None, pipeline_id),
-            'params': (None, json.dumps(params), 'application/json')
-        }
-
-        response = requests.post(URL + 'key/api/v1/pipeline/run', headers=headers, files=data)
-        request_data = response.json()
-        uuid = request_data['uuid']
-        print(f"Задание создано: {uuid}")
-
-        # 3. Ожидаем завершения генерации
-        for i in range(20):
-            time.sleep(10)
-            response = requests.get(URL + 'key/api/v1/pipeline/status/' + uuid, headers=headers)
-            status_data = response.json()
-
-            if status_data['status'] == 'DONE':
-                # 4. Получаем изображение
-                image_base64 = status_data['result']['files'][0]
-                image_data = base64.b64decode(image_base64)
-
-                if return_type == 'bytes':
-                    return image_data
-                else:
-                    filename = f"kandinsky_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-                    with open(filename, 'wb') as f:
-                        f.write(image_data)
-                    return filename
-
-            elif status_data['status'] == 'FAIL':
-                print(f"❌ Ошибка генерации: {status_data.get('errorDescription', 'Неизвестная ошибка')}")
-                return None
-
-        print("❌ Превышено время ожидания")
-        return None
-
-    except Exception as e:
-        print(f"❌ Ошибка: {e}")
-        return None
-
-
-def generate_and_save_image(api_key, secret_key, prompt):
-    return generate_image(api_key, secret_key, prompt, return_type='file')
\ No newline at end of file
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import httpx
+
+from singleflight import SingleFlight
+from image_poller import completion_model, load_history, save_duration, retry_after, IMAGE_STATUS_POLLS
+from image_io import parse_status
+from metrics import Counter, IMAGE_PHASE, IMAGE_RESULTS
+from tracing import span
+
+
+# одинаковые запросы картинки, пришедшие одновременно, выполняются один раз
+_image_flights = SingleFlight()
+
+# адрес API; когда спрашивать статус, решает image_poller (KANDINSKY_POLL_MIN/MAX).
+# Для нагрузочных тестов — локальная заглушка (benchmarks/fake_servers.py)
+KANDINSKY_URL = os.getenv("KANDINSKY_URL", "https://api-key.fusionbrain.ai/")
+# таймауты одного HTTP-запроса и всей генерации целиком (от запуска задания до картинки), с
+KANDINSKY_CONNECT_TIMEOUT = float(os.getenv("KANDINSKY_CONNECT_TIMEOUT", "10"))
+KANDINSKY_READ_TIMEOUT = float(os.getenv("KANDINSKY_READ_TIMEOUT", "30"))
+KANDINSKY_TIMEOUT = float(os.getenv("KANDINSKY_TIMEOUT", "230"))
+KANDINSKY_POOL_SIZE = int(os.getenv("KANDINSKY_POOL_SIZE", "10"))
+# сколько секунд считать список моделей свежим; после этого он обновляется в фоне
+KANDINSKY_PIPELINES_TTL = float(os.getenv("KANDINSKY_PIPELINES_TTL", "3600"))
+# сколько картинок просить в одном задании (numImages; публичный API сейчас отдаёт по одной)
+# и сколько заданий держать в Kandinsky одновременно на весь бот
+KANDINSKY_IMAGES_PER_RUN = int(os.getenv("KANDINSKY_IMAGES_PER_RUN", "1"))
+KANDINSKY_MAX_RUNS = int(os.getenv("KANDINSKY_MAX_RUNS", "16"))
+# сколько вариантов показывать по кнопке «Создать еще»
+IMAGE_VARIANTS = int(os.getenv("IMAGE_VARIANTS", "3"))
+
+_run_slots = asyncio.Semaphore(KANDINSKY_MAX_RUNS)
+
+_http_client = None
+
+
+# --- один пул соединений с Kandinsky на весь процесс, как у клиента модели ---
+def get_image_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            base_url=KANDINSKY_URL,
+            limits=httpx.Limits(max_connections=KANDINSKY_POOL_SIZE, max_keepalive_connections=KANDINSKY_POOL_SIZE),
+            timeout=httpx.Timeout(KANDINSKY_READ_TIMEOUT, connect=KANDINSKY_CONNECT_TIMEOUT),
+        )
+    return _http_client
+
+
+async def close_image_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class PipelineCache:
+    """
+    Модель Kandinsky (pipelines[0]) в памяти процесса, чтобы не запрашивать список
+    перед каждой картинкой. Первый запрос (или запрос после invalidate) ждёт ответа,
+    а устаревшее значение отдаётся сразу и обновляется в фоне.
+    """
+
+    def __init__(self, ttl: float = KANDINSKY_PIPELINES_TTL):
+        self.ttl = ttl
+        self._pipeline = None
+        self._fetched_at = 0.0
+        self._refresh = None
+
+    async def _fetch(self, headers):
+        with IMAGE_PHASE.time(phase='pipelines'), span('image:pipelines'):
+            response = await get_image_client().get('key/api/v1/pipelines', headers=headers)
+        response.raise_for_status()
+        pipeline = response.json()[0]
+        print(f"Используется модель: {pipeline['name']}")
+
+        self._pipeline = pipeline
+        self._fetched_at = time.monotonic()
+        return pipeline
+
+    def _start_refresh(self, headers):
+        # одновременные промахи ждут один и тот же запрос
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._fetch(headers))
+            self._refresh.add_done_callback(_log_refresh_error)
+        return self._refresh
+
+    async def get(self, headers):
+        if self._pipeline is None:
+            PIPELINE_LOOKUPS.inc(result='miss')
+            return await asyncio.shield(self._start_refresh(headers))
+
+        if time.monotonic() - self._fetched_at > self.ttl:
+            PIPELINE_LOOKUPS.inc(result='stale')
+            self._start_refresh(headers)
+        else:
+            PIPELINE_LOOKUPS.inc(result='hit')
+        return self._pipeline
+
+    def invalidate(self):
+        self._pipeline = None
+
+
+def _log_refresh_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Не удалось получить список моделей Kandinsky: {task.exception()}")
+
+
+PIPELINE_LOOKUPS = Counter(
+    "nko_kandinsky_pipeline_lookups_total", "Обращения к кэшу модели Kandinsky: hit, stale, miss", ("result",),
+)
+
+pipelines = PipelineCache()
+
+
+async def prefetch_pipelines(api_key, secret_key):
+    """
+    Запрашивает модель при старте бота, чтобы первая картинка не ждала лишний запрос,
+    и загружает историю времени генерации, чтобы опрос статуса не начинался с нуля.
+    """
+    await asyncio.to_thread(load_history, completion_model)
+    try:
+        await pipelines.get({'X-Key': f'Key {api_key}', 'X-Secret': f'Secret {secret_key}'})
+    except Exception as e:
+        print(f"Kandinsky warm-up error: {e}")
+
+
+def _unknown_pipeline(response):
+    # модель сняли или заменили: API отвечает ошибкой с упоминанием pipeline
+    return response.status_code in (400, 404, 422) and 'pipeline' in response.text.lower()
+
+
+async def _run(client, headers, pipeline_id, params):
+    data = {
+        'pipeline_id': (None, pipeline_id),
+        'params': (None, json.dumps(params), 'application/json')
+    }
+    with IMAGE_PHASE.time(phase='run'), span('image:run'):
+        return await client.post('key/api/v1/pipeline/run', headers=headers, files=data)
+
+
+async def _poll_status(client, headers, uuid, submitted):
+    """
+    Опрашивает статус задания, не занимая цикл событий, пока оно не закончится
+    (ограничение по времени — asyncio.timeout снаружи). Интервалы подсказывает
+    completion_model, Retry-After сервера соблюдается. Вернёт (ответ, картинки в bytes).
+    """
+    delay = 0.0
+    hint = 0.0
+    pending_at = None  # когда задание в последний раз было ещё не готово
+    polls = 0
+    while True:
+        delay = max(completion_model.next_delay(time.monotonic() - submitted, delay), hint)
+        with span('image:poll_wait', delay=round(delay, 2)):
+            await asyncio.sleep(delay)
+
+        polls += 1
+        try:
+            with IMAGE_PHASE.time(phase='status'), span('image:status'):
+                response = await client.get('key/api/v1/pipeline/status/' + uuid, headers=headers)
+        except httpx.HTTPError as e:
+            # разовая ошибка опроса не отменяет задание — спросим ещё раз
+            print(f"Ошибка опроса статуса {uuid}: {e}")
+            continue
+
+        hint = retry_after(response)
+        if response.status_code == 429 or response.status_code >= 500:
+            print(f"Ошибка опроса статуса {uuid}: HTTP {response.status_code}")
+            continue
+        response.raise_for_status()
+
+        # картинки декодируются прямо из тела ответа, без json-строки на мегабайты
+        status_data, images = parse_status(response.content)
+        if status_data['status'] in ('DONE', 'FAIL'):
+            IMAGE_STATUS_POLLS.observe(polls)
+            if status_data['status'] == 'DONE':
+                finished = time.monotonic() - submitted
+                if pending_at is not None:
+                    # готово где-то между двумя последними опросами
+                    duration = completion_model.record((pending_at + finished) / 2)
+                else:
+                    duration = completion_model.record_before(finished)
+                await asyncio.to_thread(save_duration, duration)
+            return status_data, images
+        pending_at = time.monotonic() - submitted
+
+
+async def generate_images(api_key, secret_key, prompt, num_images=1):
+    """
+    Одно задание Kandinsky на num_images картинок.
+    Возвращает список картинок в bytes; пустой — если не получилось.
+    """
+
+    client = get_image_client()
+    headers = {
+        'X-Key': f'Key {api_key}',
+        'X-Secret': f'Secret {secret_key}',
+    }
+
+    started = time.perf_counter()
+    try:
+        async with _run_slots, asyncio.timeout(KANDINSKY_TIMEOUT):
+            # 1. Берём модель из кэша
+            pipeline = await pipelines.get(headers)
+
+            # 2. Отправляем запрос на генерацию
+            params = {
+                "type": "GENERATE",
+                "numImages": num_images,
+                "width": 1024,
+                "height": 1024,
+                "generateParams": {"query": prompt}
+            }
+
+            submitted = time.monotonic()
+            response = await _run(client, headers, pipeline['id'], params)
+            if _unknown_pipeline(response):
+                # закэшированная модель больше не существует — берём список заново и повторяем
+                pipelines.invalidate()
+                pipeline = await pipelines.get(headers)
+                response = await _run(client, headers, pipeline['id'], params)
+            response.raise_for_status()
+            request_data = response.json()
+            uuid = request_data['uuid']
+            print(f"Задание создано: {uuid}")
+
+            # 3. Ожидаем завершения генерации
+            status_data, images = await _poll_status(client, headers, uuid, submitted)
+
+        if status_data['status'] == 'FAIL':
+            print(f"❌ Ошибка генерации: {status_data.get('errorDescription', 'Неизвестная ошибка')}")
+            IMAGE_RESULTS.inc(outcome='fail')
+            return []
+
+        # 4. Получаем изображения
+        IMAGE_PHASE.observe(time.perf_counter() - started, phase='total')
+        IMAGE_RESULTS.inc(outcome='done')
+        return images
+
+    except TimeoutError:
+        print("❌ Превышено время ожидания")
+        IMAGE_RESULTS.inc(outcome='timeout')
+        return []
+
+    except Exception as e:
+        # CancelledError сюда не попадает: отменённая генерация просто прерывается
+        print(f"❌ Ошибка: {e}")
+        IMAGE_RESULTS.inc(outcome='error')
+        return []
+
+
+async def generate_image(api_key, secret_key, prompt, return_type='bytes'):
+    """
+    Улучшенная функция для генерации изображения
+
+    Args:
+        api_key (str): Ваш API ключ
+        secret_key (str): Ваш секретный ключ
+        prompt (str): Описание изображения
+        return_type (str): 'file' - путь к файлу, 'bytes' - бинарные данные
+    """
+    images = await generate_images(api_key, secret_key, prompt)
+    if not images:
+        return None
+
+    image_data = images[0]
+    if return_type == 'bytes':
+        return image_data
+
+    # микросекунды в имени: два пользователя в одну секунду не перезапишут файлы друг друга
+    filename = f"kandinsky_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.png"
+    await asyncio.to_thread(_write_file, filename, image_data)
+    return filename
+
+
+async def generate_variants(api_key, secret_key, prompt, count):
+    """
+    count разных картинок по одному запросу: задания по KANDINSKY_IMAGES_PER_RUN картинок
+    идут параллельно (не больше KANDINSKY_MAX_RUNS на весь бот), одинаковые результаты
+    отбрасываются. Может вернуть меньше count, если часть заданий не удалась.
+    """
+    per_run = max(1, min(count, KANDINSKY_IMAGES_PER_RUN))
+    sizes = [min(per_run, count - i) for i in range(0, count, per_run)]
+    with span('image:variants', count=count, runs=len(sizes)):
+        batches = await asyncio.gather(*(generate_images(api_key, secret_key, prompt, n) for n in sizes))
+
+    unique = {}
+    for image_data in (image for batch in batches for image in batch):
+        unique.setdefault(hashlib.sha256(image_data).digest(), image_data)
+    return list(unique.values())[:count]
+
+
+def _write_file(filename, data):
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+
+async def generate_and_save_image(api_key, secret_key, prompt):
+    return await generate_image(api_key, secret_key, prompt, return_type='file')
+
+
+async def generate_image_shared(api_key, secret_key, prompt):
+    """
+    Одновременные запросы с тем же промптом получают одну и ту же картинку (bytes).
+    """
+    with span('image:generate'):
+        return await _image_flights.do(prompt, generate_image, api_key, secret_key, prompt, 'bytes')
+
+
+async def generate_variants_shared(api_key, secret_key, prompt, count=IMAGE_VARIANTS):
+    """
+    Как generate_image_shared, но для набора вариантов: одинаковые одновременные
+    запросы (тот же промпт и число картинок) получают один и тот же набор.
+    """
+    with span('image:generate'):
+        return await _image_flights.do((prompt, count), generate_variants, api_key, secret_key, prompt, count)
@@ -0,0 +1,161 @@
+"""
+Все исходящие сообщения бота проходят через одну очередь с лимитами Telegram:
+не больше TG_GLOBAL_RATE сообщений в секунду на бота, TG_CHAT_RATE в личный чат
+и TG_GROUP_RATE_PER_MIN в минуту в группу. Сообщения одного чата уходят строго
+по очереди, а 429 Too Many Requests не роняет обработчик: ждём retry_after
+и повторяем.
+
+Подключается к сессии бота, как трассировка: throttle_bot(Bot(...)).
+"""
+import asyncio
+import os
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from chunker import TELEGRAM_MESSAGE_LIMIT, utf16_len
+from llm_scheduler import TokenBucket
+from metrics import Counter, Gauge, Histogram, FAST_BUCKETS, SLOW_BUCKETS
+from tracing import span
+
+
+# лимиты из Bot API FAQ: ~30 сообщений в секунду всего, ~1 в секунду в чат, 20 в минуту в группу
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_RATE_PER_MIN = float(os.getenv("TG_GROUP_RATE_PER_MIN", "20"))
+# сколько раз повторять вызов после 429, прежде чем отдать ошибку обработчику
+TG_RETRY_ATTEMPTS = int(os.getenv("TG_RETRY_ATTEMPTS", "3"))
+
+# методы, на которые действуют лимиты отправки (answerCallbackQuery, getFile и т.п. — нет)
+_LIMITED_METHODS = ("Send", "Edit", "Copy", "Forward")
+# сколько чатов держать, прежде чем выбросить тех, кто давно ничего не получал
+_MAX_IDLE_CHATS = 1000
+
+
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 chat_burst: int = TG_CHAT_BURST, group_rate_per_min: float = TG_GROUP_RATE_PER_MIN,
+                 retry_attempts: int = TG_RETRY_ATTEMPTS):
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_min / 60
+        self.retry_attempts = retry_attempts
+
+        self._global_lock = asyncio.Lock()
+        self._chats = {}  # chat_id -> (TokenBucket, asyncio.Lock)
+
+        self.waiting = 0
+        self.sent = 0
+        self.retried = 0
+
+    def _chat(self, chat_id):
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            if len(self._chats) >= _MAX_IDLE_CHATS:
+                self._prune()
+            # в группах и каналах id отрицательный
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            entry = self._chats[chat_id] = (bucket, asyncio.Lock())
+        return entry
+
+    def _prune(self):
+        # чат с полным ведром и без очереди ничем не отличается от нового
+        for chat_id, (bucket, lock) in list(self._chats.items()):
+            if not lock.locked() and bucket.delay(bucket.capacity) == 0:
+                del self._chats[chat_id]
+
+    async def _wait_global(self):
+        async with self._global_lock:
+            while (delay := self.global_bucket.delay()) > 0:
+                await asyncio.sleep(delay)
+            self.global_bucket.take()
+
+    async def _throttle(self, bucket: TokenBucket):
+        with span("telegram:throttle"):
+            while (delay := bucket.delay()) > 0:
+                await asyncio.sleep(delay)
+            bucket.take()
+            await self._wait_global()
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(_LIMITED_METHODS):
+            return await make_request(bot, method)
+
+        bucket, lock = self._chat(chat_id)
+        self.waiting += 1
+        queued = True
+        started = time.perf_counter()
+        try:
+            # замок чата держим до ответа Telegram: так сообщения не обгоняют друг друга
+            async with lock:
+                await self._throttle(bucket)
+                self.waiting -= 1
+                queued = False
+                TG_SEND_WAIT.observe(time.perf_counter() - started)
+
+                for attempt in range(self.retry_attempts + 1):
+                    try:
+                        result = await make_request(bot, method)
+                        self.sent += 1
+                        return result
+                    except TelegramRetryAfter as e:
+                        TG_RETRY_AFTER.inc(method=type(method).__name__)
+                        if attempt == self.retry_attempts:
+                            raise
+                        self.retried += 1
+                        with span("telegram:retry_after", retry_after=e.retry_after):
+                            await asyncio.sleep(e.retry_after)
+        finally:
+            if queued:
+                self.waiting -= 1
+
+    def stats(self):
+        return {
+            "waiting": self.waiting,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "retried": self.retried,
+        }
+
+
+TG_SEND_WAIT = Histogram(
+    "nko_telegram_send_wait_seconds", "Ожидание очереди и лимитов Telegram перед отправкой", (),
+    sorted(set(FAST_BUCKETS + SLOW_BUCKETS)),
+)
+TG_RETRY_AFTER = Counter(
+    "nko_telegram_retry_after_total", "Ответы 429 Too Many Requests от Telegram", ("method",),
+)
+
+scheduler = SendScheduler()
+
+Gauge("nko_telegram_send_queue_depth", "Сообщения, ждущие своей очереди на отправку",
+      func=lambda: scheduler.waiting)
+
+
+def throttle_bot(bot):
+    bot.session.middleware(scheduler)
+    return bot
+
+
+async def send_parts(bot, chat_id: int, parts, footer: str, reply_markup=None, parse_mode=None):
+    """
+    Отправляет куски текста и следом вопрос с кнопками («Что вы хотите сделать…»).
+    Вопрос и кнопки по возможности дописываются к последнему куску —
+    на одно сообщение (и один вызов API) меньше.
+    """
+    parts = [part for part in parts if part.strip()]
+    if parts and utf16_len(parts[-1]) + 2 + utf16_len(footer) <= TELEGRAM_MESSAGE_LIMIT:
+        parts[-1] = f"{parts[-1]}\n\n{footer}"
+    else:
+        parts.append(footer)
+
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        await bot.send_message(chat_id, part, parse_mode=parse_mode, reply_markup=reply_markup if last else None)
@@ -0,0 +1,64 @@
+import asyncio
+from contextlib import contextmanager
+
+
+class LeaderGone(Exception):
+    """Ведущий вызов прервался (отменён или его генератор закрыли) и результата не будет."""
+
+
+class SingleFlight:
+    """
+    Склеивает одинаковые одновременные запросы в один.
+
+    Пока вызов с ключом key выполняется, все остальные вызовы с тем же ключом
+    не идут в API, а ждут его результат (или его ошибку). Если ведущий вызов
+    прервался, ожидающие получают LeaderGone и делают запрос сами.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0  # сколько вызовов получили чужой результат
+
+    def pending(self, key):
+        return self._calls.get(key)
+
+    async def wait(self, future):
+        self.shared += 1
+        # shield: отмена одного ожидающего не должна отменять общий вызов
+        return await asyncio.shield(future)
+
+    @contextmanager
+    def lead(self, key):
+        """Регистрирует текущий вызов как ведущий; результат нужно положить в future.set_result."""
+        future = asyncio.get_running_loop().create_future()
+        # если ждущих не было, ошибку никто не заберёт — не даём asyncio ругаться на это
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            yield future
+        except (asyncio.CancelledError, GeneratorExit):
+            # отменили или бросили ведущего, а не сам запрос: ожидающим это не ошибка,
+            # а повод сделать запрос самим. Исключение ведущего идёт дальше как есть
+            if not future.done():
+                future.set_exception(LeaderGone(key))
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            if not future.done():
+                future.set_exception(LeaderGone(key))
+            del self._calls[key]
+
+    async def do(self, key, func, *args, **kwargs):
+        while (future := self.pending(key)) is not None:
+            try:
+                return await self.wait(future)
+            except LeaderGone:
+                continue
+
+        with self.lead(key) as future:
+            result = await func(*args, **kwargs)
+            future.set_result(result)
+            return result
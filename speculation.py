@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+from createbd import connect
+from metrics import Counter
+from tracing import current_trace_id, detached_context, start_trace
+from llm_cache import make_key
+from result_gen import api_get_result, LLM_MODEL
+
+
+# сколько вариантов может готовиться в фоне одновременно на весь бот
+SPECULATIVE_MAX_INFLIGHT = int(os.getenv("SPECULATIVE_MAX_INFLIGHT", "2"))
+# сколько секунд готовый вариант ждёт нажатия "Создать заново"
+SPECULATIVE_TTL = float(os.getenv("SPECULATIVE_TTL", "1800"))
+
+_variants = {}  # (chat_id, ключ промпта) -> (текст, время готовности)
+_tasks = {}  # (chat_id, ключ промпта) -> asyncio.Task
+
+stats = {"started": 0, "used": 0, "skipped": 0}
+
+Counter("nko_speculative_variants_total", "Предгенерация: начато, использовано, пропущено", ("result",),
+        func=lambda: {(key,): value for key, value in stats.items()})
+
+
+def speculation_enabled(nko_id):
+    if not nko_id:
+        return False
+
+    con = connect()
+    cur = con.cursor()
+    try:
+        cur.execute("SELECT speculative FROM nko_info WHERE nko_id = ?", (nko_id,))
+        row = cur.fetchone()
+        return bool(row and row[0])
+    except sqlite3.Error as e:
+        print(f"DB error: {e}")
+        return False
+    finally:
+        con.close()
+
+
+def toggle_speculation(nko_id):
+    """Переключает предгенерацию для НКО и возвращает новое значение."""
+    con = connect()
+    cur = con.cursor()
+    try:
+        cur.execute(
+            "UPDATE nko_info SET speculative = 1 - COALESCE(speculative, 0) WHERE nko_id = ?",
+            (nko_id,)
+        )
+        con.commit()
+        cur.execute("SELECT speculative FROM nko_info WHERE nko_id = ?", (nko_id,))
+        row = cur.fetchone()
+        return bool(row and row[0])
+    finally:
+        con.close()
+
+
+async def _generate(slot_key, chat_id, prompt, parent_trace_id):
+    try:
+        # своя трасса, связанная с заданием, которое запустило предгенерацию
+        with start_trace("speculation", parent_trace_id, chat_id=chat_id):
+            # фоновый запрос: планировщик пускает его, только когда пользователи не ждут
+            text = await api_get_result(prompt, use_cache=False, chat_id=chat_id, low_priority=True)
+        _variants[slot_key] = (text, time.monotonic())
+        return text
+    finally:
+        if _tasks.get(slot_key) is asyncio.current_task():
+            del _tasks[slot_key]
+
+
+def speculate(chat_id, prompt):
+    """Начинает готовить в фоне следующий вариант поста для этого чата."""
+    now = time.monotonic()
+    for stale in [k for k, (_, ready_at) in _variants.items() if now - ready_at > SPECULATIVE_TTL]:
+        del _variants[stale]
+
+    slot_key = (chat_id, make_key(prompt, LLM_MODEL))
+    if slot_key in _tasks or slot_key in _variants:
+        return
+    if len(_tasks) >= SPECULATIVE_MAX_INFLIGHT:
+        stats["skipped"] += 1
+        return
+
+    stats["started"] += 1
+    task = asyncio.create_task(_generate(slot_key, chat_id, prompt, current_trace_id()), context=detached_context())
+    # ошибка фоновой генерации не важна: "Создать заново" просто пойдёт обычным путём
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    _tasks[slot_key] = task
+
+
+def take_variant(chat_id, prompt):
+    """
+    Забирает заранее созданный вариант, если он готов. Если он ещё готовится,
+    фоновую генерацию отменяем: пользователь уже ждёт, и запрос пойдёт обычным путём.
+    """
+    slot_key = (chat_id, make_key(prompt, LLM_MODEL))
+
+    task = _tasks.pop(slot_key, None)
+    if task is not None:
+        task.cancel()
+
+    variant = _variants.pop(slot_key, None)
+    if variant is None:
+        return None
+
+    text, ready_at = variant
+    if time.monotonic() - ready_at > SPECULATIVE_TTL:
+        return None
+
+    stats["used"] += 1
+    return text
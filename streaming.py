@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from chunker import Chunker, TELEGRAM_MESSAGE_LIMIT, utf16_len
+
+
+# не чаще одного редактирования живого сообщения за столько секунд (лимиты Telegram на edit)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+
+class LiveMessage:
+    """Сообщение в чате, которое дописывается по мере генерации текста."""
+
+    def __init__(self, bot: Bot, chat_id: int, limit: int = TELEGRAM_MESSAGE_LIMIT, interval: float = STREAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.limit = limit
+        self.interval = interval
+        self.chunker = Chunker(limit)
+
+        self.message_id = None
+        self.part = ""  # текст текущего сообщения
+        self.shown = ""  # что сейчас видит пользователь в текущем сообщении
+        self.next_edit_at = 0.0
+
+    async def _show(self, force: bool = False, reply_markup=None):
+        text = self.part
+        if not text.strip() or (text == self.shown and reply_markup is None):
+            return
+
+        now = time.monotonic()
+        if not force and now < self.next_edit_at:
+            return
+
+        try:
+            if self.message_id is None:
+                sent = await self.bot.send_message(self.chat_id, text, reply_markup=reply_markup)
+                self.message_id = sent.message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id,
+                                                 reply_markup=reply_markup)
+        except TelegramRetryAfter as e:
+            # при force текст обязан дойти, поэтому ждём; иначе просто пропускаем промежуточное обновление
+            if not force:
+                self.next_edit_at = now + e.retry_after
+                return
+            await asyncio.sleep(e.retry_after)
+            return await self._show(force=True, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+
+        self.shown = text
+        self.next_edit_at = time.monotonic() + self.interval
+
+    async def _complete(self, text: str):
+        # готовое сообщение дописываем целиком, следующий текст пойдёт в новое
+        self.part = text
+        await self._show(force=True)
+
+        self.message_id = None
+        self.part = ""
+        self.shown = ""
+
+    async def feed(self, chunk: str):
+        # перешли через лимит — Chunker отдаёт готовые сообщения, хвост остаётся в pending
+        for text in self.chunker.feed(chunk):
+            await self._complete(text)
+
+        self.part = self.chunker.pending
+        await self._show()
+
+    async def finish(self, footer: str = None, reply_markup=None):
+        """
+        Дописывает остаток текста. footer (вопрос «что дальше») с кнопками
+        по возможности попадает в последнее сообщение, а не отдельным.
+        """
+        texts = self.chunker.flush()
+        for text in texts[:-1]:
+            await self._complete(text)
+        last = texts[-1] if texts else ""
+
+        if footer is None:
+            self.part = last
+        elif last and utf16_len(last) + 2 + utf16_len(footer) <= self.limit:
+            self.part = f"{last}\n\n{footer}"
+        else:
+            if last:
+                await self._complete(last)
+            self.part = footer
+        await self._show(force=True, reply_markup=reply_markup)
+
+
+async def stream_to_chat(bot: Bot, chat_id: int, chunks, limit: int = TELEGRAM_MESSAGE_LIMIT,
+                         footer: str = None, reply_markup=None):
+    """
+    Показывает ответ модели в чате по мере генерации.
+
+    Первый кусок текста отправляется сразу, дальше сообщение редактируется
+    не чаще STREAM_EDIT_INTERVAL. footer и reply_markup добавляются к последнему
+    сообщению в конце. Возвращает полный текст ответа.
+    """
+    live = LiveMessage(bot, chat_id, limit=limit)
+    text = []
+
+    async for chunk in chunks:
+        text.append(chunk)
+        await live.feed(chunk)
+
+    await live.finish(footer, reply_markup)
+    return "".join(text)
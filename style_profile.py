@@ -0,0 +1,186 @@
+import json
+import re
+from collections import Counter
+
+from retrieval import STYLE_POST_TYPES
+
+
+EMOJI_RE = re.compile("[\U0001F300-\U0001FAFF☀-➿⭐❤]")
+HASHTAG_RE = re.compile(r"#\w+")
+WORD_RE = re.compile(r"[а-яёa-z]{4,}")
+SENTENCE_RE = re.compile(r"[^.!?…]+[.!?…]+|[^.!?…]+$")
+# строка-разделитель между постами: ---, ***, ===, ___ или ———
+SEPARATOR_RE = re.compile(r"^[ \t]*(?:-{3,}|\*{3,}|={3,}|_{3,}|—{3,})[ \t]*$", re.MULTILINE)
+BLANK_LINES_RE = re.compile(r"\n\s*\n")
+
+FORMAL_YOU = {"вы", "вас", "вам", "вами", "ваш", "ваша", "ваше", "ваши", "вашей", "вашего", "вашим"}
+INFORMAL_YOU = {"ты", "тебя", "тебе", "тобой", "твой", "твоя", "твоё", "твое", "твои", "твоей", "твоего"}
+
+STOP_WORDS = {
+    "этот", "этого", "этой", "этом", "чтобы", "которые", "который", "которая", "когда", "также",
+    "будет", "будут", "может", "можно", "очень", "всего", "всех", "если", "только", "было", "были",
+    "есть", "свой", "свои", "своих", "наши", "наша", "наше", "наших", "нашей", "нашего", "того",
+    "тоже", "даже", "ещё", "еще", "после", "через", "более", "просто", "здесь", "сейчас", "вместе",
+}
+
+# сколько самых частых слов/эмодзи/хештегов храним — этого хватает для дайджеста
+KEEP_TOP = 50
+
+
+def split_examples(text: str):
+    """
+    Делит присланные одним сообщением примеры на отдельные посты: по строкам-разделителям,
+    а если их нет — по пустым строкам. Иначе профиль считал бы всё сообщение одним постом.
+    """
+    parts = SEPARATOR_RE.split(text) if SEPARATOR_RE.search(text) else BLANK_LINES_RE.split(text)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def analyze_post(text: str):
+    words = WORD_RE.findall(text.lower())
+    all_words = re.findall(r"\w+", text.lower())
+    return {
+        "chars": len(text),
+        "sentences": len([s for s in SENTENCE_RE.findall(text) if s.strip()]),
+        "emoji": EMOJI_RE.findall(text),
+        "hashtags": [h.lower() for h in HASHTAG_RE.findall(text)],
+        "exclamations": text.count("!"),
+        "formal": sum(1 for w in all_words if w in FORMAL_YOU),
+        "informal": sum(1 for w in all_words if w in INFORMAL_YOU),
+        "words": [w for w in words if w not in STOP_WORDS],
+    }
+
+
+def _top(counter: Counter, n: int = KEEP_TOP):
+    return dict(counter.most_common(n))
+
+
+def make_digest(profile: dict):
+    """Короткое описание стиля НКО для промпта — вместо того, чтобы вставлять все примеры целиком."""
+    count = profile["post_count"]
+    if not count:
+        return ""
+
+    avg_chars = profile["total_chars"] // count
+    avg_sentence = profile["total_chars"] // max(1, profile["total_sentences"])
+    emoji_per_post = profile["total_emoji"] / count
+    hashtags_per_post = profile["total_hashtags"] / count
+
+    lines = [f"Типичная длина поста: около {avg_chars} символов, предложения в среднем по {avg_sentence} символов."]
+
+    if emoji_per_post >= 0.5:
+        top_emoji = " ".join(list(profile["top_emoji"])[:5])
+        lines.append(f"Эмодзи: примерно {max(1, round(emoji_per_post))} на пост, чаще всего {top_emoji}.")
+    else:
+        lines.append("Эмодзи почти не используются.")
+
+    if hashtags_per_post >= 0.5:
+        top_hashtags = " ".join(list(profile["top_hashtags"])[:5])
+        lines.append(f"Хештеги: около {max(1, round(hashtags_per_post))} на пост, например {top_hashtags}.")
+    else:
+        lines.append("Хештеги почти не используются.")
+
+    if profile["address_you_informal"] > profile["address_you_formal"]:
+        lines.append("К читателю обращаются на «ты».")
+    elif profile["address_you_formal"]:
+        lines.append("К читателю обращаются на «вы».")
+
+    if profile["total_exclamations"] / count >= 2:
+        lines.append("Эмоциональная подача, много восклицаний.")
+
+    if profile["top_words"]:
+        markers = ", ".join(list(profile["top_words"])[:10])
+        lines.append(f"Характерная лексика: {markers}.")
+
+    return "\n".join(lines)
+
+
+def _load(cur, nko_id):
+    cur.execute(
+        "SELECT post_count, total_chars, total_sentences, total_emoji, total_hashtags, total_exclamations, "
+        "address_you_formal, address_you_informal, top_emoji, top_hashtags, top_words, digest, last_post_id "
+        "FROM nko_style WHERE nko_id = ?",
+        (nko_id,)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return {
+            "post_count": 0, "total_chars": 0, "total_sentences": 0, "total_emoji": 0,
+            "total_hashtags": 0, "total_exclamations": 0, "address_you_formal": 0,
+            "address_you_informal": 0, "top_emoji": {}, "top_hashtags": {}, "top_words": {},
+            "digest": "", "last_post_id": 0,
+        }
+
+    (post_count, total_chars, total_sentences, total_emoji, total_hashtags, total_exclamations,
+     formal, informal, top_emoji, top_hashtags, top_words, digest, last_post_id) = row
+    return {
+        "post_count": post_count, "total_chars": total_chars, "total_sentences": total_sentences,
+        "total_emoji": total_emoji, "total_hashtags": total_hashtags,
+        "total_exclamations": total_exclamations, "address_you_formal": formal,
+        "address_you_informal": informal, "top_emoji": json.loads(top_emoji or "{}"),
+        "top_hashtags": json.loads(top_hashtags or "{}"), "top_words": json.loads(top_words or "{}"),
+        "digest": digest or "", "last_post_id": last_post_id,
+    }
+
+
+def refresh_style_profile(cur, nko_id):
+    """
+    Дополняет профиль стиля постами, добавленными после прошлого обновления.
+    Старые посты повторно не читаются: суммы и счётчики просто накапливаются.
+    """
+    profile = _load(cur, nko_id)
+
+    placeholders = ", ".join("?" for _ in STYLE_POST_TYPES)
+    cur.execute(
+        f"SELECT post_id, content FROM posts WHERE nko_id = ? AND post_id > ? AND post_type IN ({placeholders}) "
+        f"ORDER BY post_id",
+        (nko_id, profile["last_post_id"], *STYLE_POST_TYPES)
+    )
+    new_posts = cur.fetchall()
+    if not new_posts:
+        return profile
+
+    top_emoji = Counter(profile["top_emoji"])
+    top_hashtags = Counter(profile["top_hashtags"])
+    top_words = Counter(profile["top_words"])
+
+    for post_id, content in new_posts:
+        stats = analyze_post(content)
+        profile["post_count"] += 1
+        profile["total_chars"] += stats["chars"]
+        profile["total_sentences"] += stats["sentences"]
+        profile["total_emoji"] += len(stats["emoji"])
+        profile["total_hashtags"] += len(stats["hashtags"])
+        profile["total_exclamations"] += stats["exclamations"]
+        profile["address_you_formal"] += stats["formal"]
+        profile["address_you_informal"] += stats["informal"]
+        top_emoji.update(stats["emoji"])
+        top_hashtags.update(stats["hashtags"])
+        top_words.update(stats["words"])
+        profile["last_post_id"] = post_id
+
+    profile["top_emoji"] = _top(top_emoji)
+    profile["top_hashtags"] = _top(top_hashtags)
+    profile["top_words"] = _top(top_words)
+    profile["digest"] = make_digest(profile)
+
+    cur.execute(
+        "INSERT OR REPLACE INTO nko_style (nko_id, post_count, total_chars, total_sentences, total_emoji, "
+        "total_hashtags, total_exclamations, address_you_formal, address_you_informal, top_emoji, "
+        "top_hashtags, top_words, digest, last_post_id, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+        (nko_id, profile["post_count"], profile["total_chars"], profile["total_sentences"],
+         profile["total_emoji"], profile["total_hashtags"], profile["total_exclamations"],
+         profile["address_you_formal"], profile["address_you_informal"],
+         json.dumps(profile["top_emoji"], ensure_ascii=False),
+         json.dumps(profile["top_hashtags"], ensure_ascii=False),
+         json.dumps(profile["top_words"], ensure_ascii=False),
+         profile["digest"], profile["last_post_id"])
+    )
+    return profile
+
+
+def get_style_digest(cur, nko_id):
+    cur.execute("SELECT digest FROM nko_style WHERE nko_id = ?", (nko_id,))
+    row = cur.fetchone()
+    return row[0] if row and row[0] else ""
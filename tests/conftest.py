@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# модули бота лежат в корне репозитория, без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py с токенами у каждого свой и в репозиторий не попадает — тестам хватит заглушки
+_config = types.ModuleType("config")
+_config.token = "123456:TEST"
+_config.key = "test"
+_config.KANDINSKY_API_KEY = "test"
+_config.KANDINSKY_SECRET_KEY = "test"
+sys.modules["config"] = _config
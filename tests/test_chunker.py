@@ -0,0 +1,124 @@
+import random
+import re
+
+import pytest
+
+from chunker import Chunker, split_message, utf16_len
+
+
+def test_utf16_len_counts_emoji_as_two_units():
+    assert utf16_len("abc") == 3
+    assert utf16_len("😀") == 2
+
+
+def test_short_text_is_one_message():
+    assert split_message("привет", limit=100) == ["привет"]
+
+
+def test_limit_is_respected_and_text_preserved():
+    text = ("Первый абзац. " * 20 + "\n\n") * 5
+    parts = split_message(text, limit=200)
+    assert all(utf16_len(p) <= 200 for p in parts)
+    assert "".join(parts) == text
+
+
+def test_emoji_is_not_split_across_messages():
+    text = "😀" * 50
+    parts = split_message(text, limit=9)
+    assert all(utf16_len(p) <= 9 for p in parts)
+    assert "".join(parts) == text
+
+
+@pytest.mark.parametrize("limit", [2, 5, 16, 60, 64, 65])
+@pytest.mark.parametrize("parse_mode", [None, "Markdown", "HTML"])
+def test_small_limits_terminate(limit, parse_mode):
+    text = "*жирный* текст _курсив_ " * 30
+    parts = split_message(text, limit=limit, parse_mode=parse_mode)
+    assert parts
+    assert all(part.strip() for part in parts)
+
+
+def test_limit_below_two_is_rejected():
+    with pytest.raises(ValueError):
+        Chunker(limit=1)
+
+
+@pytest.mark.parametrize("words_before", [0, 2, 10])
+def test_markdown_link_is_never_cut(words_before):
+    link = "[text](https://example.com/path)"
+    text = "слово " * words_before + link + " и дальше " + "слово " * 30
+    parts = split_message(text, limit=100, parse_mode="Markdown")
+    assert any(link in part for part in parts)
+    for part in parts:
+        assert part.count("[") == part.count("]")
+        assert not re.search(r"\]\([^)]*$", part)
+
+
+def test_markdown_entities_are_reopened():
+    text = "*" + "жирный текст " * 30 + "*"
+    parts = split_message(text, limit=100, parse_mode="Markdown")
+    assert len(parts) > 1
+    for part in parts:
+        assert part.count("*") % 2 == 0
+
+
+def test_html_tags_are_closed_and_reopened():
+    text = "<b>" + "жирный текст " * 30 + "</b>"
+    parts = split_message(text, limit=100, parse_mode="HTML")
+    assert len(parts) > 1
+    for part in parts:
+        assert part.count("<b>") == part.count("</b>")
+
+
+def test_streaming_feed_matches_one_shot():
+    text = "Абзац номер один. " * 40 + "\n\n" + "Второй абзац, *с разметкой*. " * 40
+    chunker = Chunker(limit=300, parse_mode="Markdown")
+    streamed = []
+    for i in range(0, len(text), 7):
+        streamed.extend(chunker.feed(text[i:i + 7]))
+    streamed.extend(chunker.flush())
+    assert all(utf16_len(p) <= 300 for p in streamed)
+    assert "".join(streamed).replace("*", "") == text.replace("*", "")
+
+
+def _nested_html(rng, depth, tags):
+    words = ["слово", "текст", "😀", "пост", "помощь", "фонд"]
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        if depth and rng.random() < 0.5:
+            tag = rng.choice(tags)
+            parts.append(f"<{tag}>{_nested_html(rng, depth - 1, tags)}</{tag}>")
+        else:
+            parts.append(" ".join(rng.choice(words) for _ in range(rng.randint(1, 12))))
+    return " ".join(parts)
+
+
+def _nested_markdown(rng):
+    words = ["слово", "текст", "😀", "пост"]
+    parts = []
+    for _ in range(rng.randint(5, 30)):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        mark = rng.choice(["", "*", "_", "`"])
+        if mark in "*_" and mark and rng.random() < 0.5:
+            inner = "_" if mark == "*" else "*"
+            text = f"{text} {inner}{text}{inner}"
+        parts.append(f"{mark}{text}{mark}")
+    return " ".join(parts)
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("limit", [17, 40, 100, 4096])
+def test_closed_chunks_never_exceed_limit(seed, limit):
+    rng = random.Random(seed)
+    # вложенность, при которой открывающие и закрывающие теги вместе занимают не больше половины limit
+    if limit >= 4096:
+        depth, tags = 8, ["b", "i", "u", "s", "tg-spoiler"]
+    else:
+        depth, tags = (2 if limit >= 100 else 1), ["b", "i", "u", "s"]
+    text = _nested_html(rng, depth, tags) * (limit // 200 + 1)
+    for part in split_message(text, limit=limit, parse_mode="HTML"):
+        assert utf16_len(part) <= limit
+
+    text = _nested_markdown(rng) * (limit // 200 + 1)
+    for part in split_message(text, limit=limit, parse_mode="Markdown"):
+        assert utf16_len(part) <= limit
@@ -0,0 +1,24 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import createbd
+
+
+def test_first_connections_from_threads_create_tables_once(tmp_path):
+    for round_ in range(10):
+        path = str(tmp_path / f"nko{round_}.db")
+        barrier = threading.Barrier(8)
+
+        def first_connect():
+            barrier.wait()
+            con = createbd.connect(path)
+            con.close()
+
+        with ThreadPoolExecutor(8) as pool:
+            for future in [pool.submit(first_connect) for _ in range(8)]:
+                future.result()
+
+        con = createbd.connect(path)
+        columns = [row[1] for row in con.execute("PRAGMA table_info(posts)")]
+        con.close()
+        assert columns.count("image_hash") == 1
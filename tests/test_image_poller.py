@@ -0,0 +1,65 @@
+import httpx
+import pytest
+
+import image_poller
+from image_poller import CompletionModel, retry_after
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({}, 0.0),
+    ({"Retry-After": "5"}, 5.0),
+    ({"Retry-After": "1.5"}, 1.5),
+    ({"Retry-After": "-3"}, 0.0),
+    ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+    ({"Retry-After": ""}, 0.0),
+])
+def test_retry_after(headers, expected):
+    assert retry_after(httpx.Response(429, headers=headers)) == expected
+
+
+def test_delay_stays_within_bounds():
+    model = CompletionModel(min_gap=1, max_gap=30, min_samples=5)
+    for duration in (10, 12, 14, 16, 18, 20):
+        model.record(duration)
+    for elapsed in (0, 5, 13, 19, 40, 400):
+        delay = model.next_delay(elapsed, 1)
+        assert 1 <= delay <= 30
+        if elapsed:
+            assert delay <= max(1, 0.2 * elapsed)
+
+
+def test_without_history_polling_backs_off_from_min_gap():
+    model = CompletionModel(min_gap=1, max_gap=30)
+    delays = [0.0]
+    for _ in range(5):
+        delays.append(model.next_delay(sum(delays), delays[-1]))
+    assert delays[1] == 1
+    assert delays[1:] == sorted(delays[1:])
+
+
+def test_record_before_imputes_from_history_not_midpoint():
+    model = CompletionModel(min_samples=1)
+    for duration in (4, 6, 8, 20, 30):
+        model.record(duration)
+    # готово на первом опросе в 10 с: из прошлых заданий в 10 с уложились 4, 6, 8
+    model.record_before(10)
+    assert model._sorted.count(6) == 2
+    assert 5.0 not in model._sorted
+
+
+def test_record_before_without_history_records_upper_bound():
+    model = CompletionModel()
+    model.record_before(12)
+    assert model._sorted == [12]
+
+
+def test_history_survives_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_poller, "POLL_HISTORY_DB", str(tmp_path / "nko.db"))
+    for duration in range(1, 8):
+        image_poller.save_duration(float(duration), history=5)
+
+    restarted = CompletionModel(history=5, min_samples=5)
+    image_poller.load_history(restarted)
+    assert restarted._sorted == [3.0, 4.0, 5.0, 6.0, 7.0]
+    # история уже есть — первый опрос не с KANDINSKY_POLL_MIN, а ближе к типичному времени
+    assert restarted.next_delay(0.0) > 1
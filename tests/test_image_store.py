@@ -0,0 +1,39 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import image_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, "IMAGE_STORE_DB", str(tmp_path / "store.db"))
+    monkeypatch.setattr(image_store, "IMAGE_STORE_DIR", str(tmp_path / "images"))
+    yield tmp_path
+
+
+def test_concurrent_store_of_same_image(store):
+    # склеенный двойной клик: обе задачи сохраняют одни и те же байты одновременно
+    for round_ in range(30):
+        data = f"картинка {round_}".encode() * 50_000
+        barrier = threading.Barrier(4)
+
+        def save():
+            barrier.wait()
+            return image_store.store_image(data)
+
+        with ThreadPoolExecutor(4) as pool:
+            hashes = [future.result() for future in [pool.submit(save) for _ in range(4)]]
+        assert len(set(hashes)) == 1
+        assert image_store.load_image(hashes[0]) == data
+
+    leftovers = [name for _, _, files in os.walk(store / "images") for name in files if name.endswith(".tmp")]
+    assert leftovers == []
+
+
+def test_store_is_idempotent(store):
+    first = image_store.store_image(b"png")
+    assert image_store.store_image(b"png") == first
+    assert image_store.store_size() == 3
@@ -0,0 +1,43 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def job_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DB", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(jobs, "_handlers", {})
+    yield tmp_path / "jobs.db"
+
+
+def _statuses(path):
+    with sqlite3.connect(path) as con:
+        return [row[0] for row in con.execute("SELECT status FROM jobs ORDER BY job_id")]
+
+
+def test_worker_survives_base_exception_from_job(job_db):
+    seen = []
+
+    @jobs.job_handler("text")
+    async def handler(bot, job):
+        seen.append(job.payload["n"])
+        if job.payload["n"] == 1:
+            raise GeneratorExit()
+        if job.payload["n"] == 2:
+            raise asyncio.CancelledError()
+
+    async def main():
+        await jobs.start_workers(bot=None, workers={"text": 1})
+        try:
+            for n in range(4):
+                await jobs.enqueue("text", 1, 1, {"n": n})
+            await asyncio.wait_for(jobs._queues["text"].join(), 5)
+        finally:
+            await jobs.stop_workers()
+
+    asyncio.run(main())
+    assert seen == [0, 1, 2, 3]
+    assert _statuses(job_db) == ["done", "failed", "failed", "done"]
@@ -0,0 +1,29 @@
+import pytest
+
+import llm_cache
+
+
+@pytest.fixture
+def cache_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_DB", str(tmp_path / "cache.db"))
+    yield tmp_path / "cache.db"
+
+
+def test_put_does_not_trim_until_trim_cache(cache_db, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_MAX_ENTRIES", 2)
+    for n in range(4):
+        llm_cache.put_cached(f"бриф {n}", "model", f"пост {n}")
+    assert all(llm_cache.get_cached(f"бриф {n}", "model") == f"пост {n}" for n in range(4))
+
+    llm_cache.get_cached("бриф 0", "model")  # самый свежий по использованию
+    llm_cache.trim_cache()
+    kept = [n for n in range(4) if llm_cache.get_cached(f"бриф {n}", "model") is not None]
+    assert kept == [0, 3]
+
+
+def test_expired_entries_are_trimmed(cache_db, monkeypatch):
+    llm_cache.put_cached("бриф", "model", "пост")
+    monkeypatch.setattr(llm_cache, "CACHE_TTL", -1)
+    llm_cache.trim_cache()
+    monkeypatch.setattr(llm_cache, "CACHE_TTL", 3600)
+    assert llm_cache.get_cached("бриф", "model") is None
@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import llm_router
+from llm_router import Route, Router
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(llm_router, "_backoff", lambda attempt: 0)
+    monkeypatch.setattr(llm_router, "LLM_FIRST_TOKEN_SLO", 0.05)
+
+
+def _not_found():
+    request = httpx.Request("POST", "http://llm.test/chat/completions")
+    return openai.NotFoundError("model not found", response=httpx.Response(404, request=request), body=None)
+
+
+def test_stream_is_closed_after_first_token_timeout():
+    closed = []
+
+    async def open_stream(route):
+        async def chunks():
+            try:
+                if route.model == "slow":
+                    await asyncio.sleep(10)
+                yield route.model
+            finally:
+                closed.append(route.model)
+        return chunks()
+
+    async def main():
+        router = Router([Route("slow"), Route("fast")])
+        return [chunk async for chunk in router.stream(open_stream)]
+
+    assert asyncio.run(main()) == ["fast"]
+    assert closed == ["slow", "fast"]
+
+
+def test_abandoned_stream_is_closed_at_once():
+    closed = []
+
+    async def open_stream(route):
+        async def chunks():
+            try:
+                for n in range(10):
+                    yield str(n)
+            finally:
+                closed.append(route.model)
+        return chunks()
+
+    async def main():
+        stream = Router([Route("model")]).stream(open_stream)
+        assert await stream.__anext__() == "0"
+        await stream.aclose()
+        return list(closed)
+
+    assert asyncio.run(main()) == ["model"]
+
+
+def test_missing_model_fails_over_and_cools_down():
+    async def request(route):
+        if route.model == "removed":
+            raise _not_found()
+        return route.model
+
+    removed = Route("removed")
+    router = Router([removed, Route("backup")])
+    assert asyncio.run(router.call(request)) == "backup"
+    assert not removed.healthy()
+    assert router.ordered()[0].model == "backup"
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import FairScheduler, QueueTimeout, TokenBucket
+
+
+def _scheduler(max_concurrency=4, rate=1000.0, burst=100, reserve=1, background_max_wait=1.0):
+    return FairScheduler(max_concurrency, TokenBucket(rate, burst), reserve, background_max_wait)
+
+
+def test_round_robin_between_chats():
+    async def main():
+        scheduler = _scheduler(max_concurrency=1)
+        order = []
+
+        async def request(chat_id, n):
+            async with scheduler.slot(chat_id):
+                order.append((chat_id, n))
+                await asyncio.sleep(0)
+
+        async with scheduler.slot(0):
+            # пока место занято, чат 1 ставит три запроса раньше, чем чат 2 — один
+            tasks = [asyncio.create_task(request(1, n)) for n in range(3)]
+            tasks.append(asyncio.create_task(request(2, 0)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == [(1, 0), (2, 0), (1, 1), (1, 2)]
+
+
+@pytest.mark.parametrize("max_concurrency, burst, reserve", [(1, 5, 1), (2, 2, 3), (4, 1, 1)])
+def test_background_lane_served_when_reserve_exceeds_limits(max_concurrency, burst, reserve):
+    async def main():
+        scheduler = _scheduler(max_concurrency=max_concurrency, burst=burst, reserve=reserve)
+        async with scheduler.slot(low_priority=True):
+            return scheduler.reserve
+
+    reserve_used = asyncio.run(asyncio.wait_for(main(), 2))
+    assert reserve_used < max_concurrency and reserve_used < burst
+
+
+def test_background_holds_at_most_one_slot():
+    async def main():
+        scheduler = _scheduler(max_concurrency=4, reserve=1)
+        peak = 0
+        release = asyncio.Event()
+
+        async def background():
+            nonlocal peak
+            async with scheduler.slot(low_priority=True):
+                peak = max(peak, scheduler.active)
+                await release.wait()
+
+        tasks = [asyncio.create_task(background()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        running = scheduler.active
+        release.set()
+        await asyncio.gather(*tasks)
+        return running, peak
+
+    assert asyncio.run(main()) == (1, 1)
+
+
+def test_background_wait_times_out_and_frees_queue():
+    async def main():
+        scheduler = _scheduler(max_concurrency=2, reserve=1, background_max_wait=0.05)
+        async with scheduler.slot(chat_id=1):
+            with pytest.raises(QueueTimeout):
+                async with scheduler.slot(low_priority=True):
+                    pass
+        # после таймаута место не утекло и фон снова обслуживается
+        async with scheduler.slot(low_priority=True):
+            return scheduler.active
+
+    assert asyncio.run(main()) == 1
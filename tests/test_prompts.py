@@ -0,0 +1,22 @@
+from prompts import PROMPT_TOKENS, render_post_prompt, render_refine_prompt
+
+
+def _exported(template):
+    # только своя метрика: metrics.render() опросил бы и чужие gauge с рабочей базой
+    return {suffix: value for suffix, key, _, value in PROMPT_TOKENS.samples()
+            if key == (template,) and suffix != "_bucket"}
+
+
+def test_prompt_tokens_are_exported_per_template():
+    before = _exported("refine").get("_count", 0)
+    _, tokens = render_refine_prompt({"social_network": "ВК"}, "Текст поста")
+    after = _exported("refine")
+    assert after["_count"] == before + 1
+    assert after["_sum"] >= tokens
+
+
+def test_post_prompt_reports_its_template():
+    data = {"goal": "Сбор средств", "social_network": "Телеграм", "details": "нужны лекарства"}
+    _, tokens = render_post_prompt(data, "Фонд помощи")
+    assert tokens > 0
+    assert _exported("post:Сбор средств:Телеграм:0")["_count"] >= 1
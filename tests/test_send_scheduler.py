@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+
+from send_scheduler import SendScheduler, send_parts
+
+
+def _scheduler(**kwargs):
+    params = dict(global_rate=1000, chat_rate=1000, chat_burst=100, group_rate_per_min=60000, retry_attempts=2)
+    params.update(kwargs)
+    return SendScheduler(**params)
+
+
+def test_messages_of_one_chat_keep_order():
+    async def main():
+        scheduler = _scheduler()
+        sent = []
+
+        async def make_request(bot, method):
+            # первый ответ Telegram самый медленный: без замка чата второе сообщение обогнало бы его
+            await asyncio.sleep(0.02 if method.text == "0" else 0)
+            sent.append(method.text)
+            return True
+
+        await asyncio.gather(*(scheduler(make_request, None, SendMessage(chat_id=1, text=str(i))) for i in range(5)))
+        return sent
+
+    assert asyncio.run(main()) == ["0", "1", "2", "3", "4"]
+
+
+def test_retry_after_is_waited_and_retried():
+    async def main():
+        scheduler = _scheduler()
+        calls = 0
+
+        async def make_request(bot, method):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise TelegramRetryAfter(method, "Too Many Requests", 0)
+            return "ok"
+
+        result = await scheduler(make_request, None, SendMessage(chat_id=1, text="x"))
+        return result, calls, scheduler.stats()
+
+    result, calls, stats = asyncio.run(main())
+    assert (result, calls) == ("ok", 2)
+    assert stats["retried"] == 1 and stats["waiting"] == 0
+
+
+def test_retry_after_gives_up_after_attempts():
+    async def main():
+        scheduler = _scheduler(retry_attempts=1)
+
+        async def make_request(bot, method):
+            raise TelegramRetryAfter(method, "Too Many Requests", 0)
+
+        await scheduler(make_request, None, SendMessage(chat_id=1, text="x"))
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(main())
+
+
+def test_per_chat_rate_is_enforced():
+    async def main():
+        scheduler = _scheduler(chat_rate=20, chat_burst=1)
+
+        async def make_request(bot, method):
+            return True
+
+        started = asyncio.get_running_loop().time()
+        for i in range(3):
+            await scheduler(make_request, None, SendMessage(chat_id=1, text=str(i)))
+        return asyncio.get_running_loop().time() - started
+
+    # одно сообщение сразу, ещё два — по 1/20 с
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_unlimited_methods_bypass_queue():
+    async def main():
+        scheduler = _scheduler(chat_rate=0.001, chat_burst=1)
+
+        async def make_request(bot, method):
+            return True
+
+        return await asyncio.wait_for(asyncio.gather(*(
+            scheduler(make_request, None, AnswerCallbackQuery(callback_query_id=str(i))) for i in range(5)
+        )), 1)
+
+    assert asyncio.run(main()) == [True] * 5
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        self.sent.append((text, reply_markup))
+
+
+def test_send_parts_appends_footer_to_last_part():
+    bot = _Bot()
+    asyncio.run(send_parts(bot, 1, ["первый", "второй"], "Что дальше?", reply_markup="kb"))
+    assert bot.sent == [("первый", None), ("второй\n\nЧто дальше?", "kb")]
+
+
+def test_send_parts_sends_footer_separately_when_it_does_not_fit():
+    bot = _Bot()
+    long_part = "x" * 4090
+    asyncio.run(send_parts(bot, 1, [long_part], "Что дальше?", reply_markup="kb"))
+    assert bot.sent == [(long_part, None), ("Что дальше?", "kb")]
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from singleflight import LeaderGone, SingleFlight
+
+
+def test_followers_share_leader_result():
+    async def main():
+        flights = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        results = await asyncio.gather(*(flights.do("k", fetch) for _ in range(5)))
+        return results, calls, flights.shared
+
+    results, calls, shared = asyncio.run(main())
+    assert results == ["ok"] * 5
+    assert calls == 1
+    assert shared == 4
+
+
+def test_followers_get_leader_error():
+    async def main():
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(*(flights.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_cancelled_leader_lets_follower_call_itself():
+    async def main():
+        flights = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+
+        leader = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, calls
+
+    result, calls = asyncio.run(main())
+    assert (result, calls) == (2, 2)
+
+
+def test_abandoned_streaming_leader_does_not_leak_generator_exit():
+    async def main():
+        flights = SingleFlight()
+
+        async def stream():
+            with flights.lead("k") as future:
+                yield "first"
+                await asyncio.sleep(1)
+                future.set_result("all")
+
+        async def follower():
+            try:
+                return await flights.wait(flights.pending("k"))
+            except LeaderGone:
+                return "fallback"
+
+        gen = stream()
+        assert await gen.__anext__() == "first"
+        waiting = asyncio.create_task(follower())
+        await asyncio.sleep(0)
+        # потребитель бросил поток на середине (например, Telegram вернул ошибку)
+        await gen.aclose()
+        return await waiting, flights.pending("k")
+
+    result, pending = asyncio.run(main())
+    assert result == "fallback"
+    assert pending is None
@@ -0,0 +1,29 @@
+import asyncio
+
+import speculation
+import tracing
+
+
+def test_speculation_gets_its_own_trace(monkeypatch):
+    release = asyncio.Event()
+
+    async def fake_get_result(prompt, **kwargs):
+        await release.wait()
+        with tracing.span("llm:get_result"):
+            return f"вариант: {prompt}"
+
+    monkeypatch.setattr(speculation, "api_get_result", fake_get_result)
+
+    async def main():
+        with tracing.start_trace("job:text") as job_trace:
+            speculation.speculate(1, "бриф")
+        # задание уже закончилось, предгенерация только начинает работать
+        release.set()
+        await asyncio.gather(*speculation._tasks.values())
+        return job_trace
+
+    job_trace = asyncio.run(main())
+    assert [s for s in job_trace.spans if s["name"] == "llm:get_result"] == []
+    own = [t for t in tracing.traces if t.name == "speculation" and t.parent_trace_id == job_trace.trace_id]
+    assert len(own) == 1 and [s["name"] for s in own[0].spans] == ["llm:get_result"]
+    assert speculation.take_variant(1, "бриф") == "вариант: бриф"
@@ -0,0 +1,38 @@
+import pytest
+
+from createbd import connect
+from style_profile import make_digest, refresh_style_profile, split_examples
+
+
+def test_split_on_separator_keeps_paragraphs():
+    text = "Первый пост.\n\nВторой абзац первого.\n---\nВторой пост 🙂\n***\nТретий #пост"
+    assert split_examples(text) == ["Первый пост.\n\nВторой абзац первого.", "Второй пост 🙂", "Третий #пост"]
+
+
+def test_split_on_blank_lines_without_separator():
+    assert split_examples("Раз.\n\n\nДва.\n  \nТри.") == ["Раз.", "Два.", "Три."]
+
+
+def test_profile_counts_each_example(tmp_path):
+    con = connect(str(tmp_path / "nko.db"))
+    cur = con.cursor()
+    cur.execute("INSERT INTO nko_info (name, description) VALUES ('НКО', 'описание')")
+    nko_id = cur.lastrowid
+    posts = split_examples("Сбор продолжается 🙂 #помощь\n---\nСпасибо всем!\n---\nЖдём волонтёров")
+    cur.executemany("INSERT INTO posts (post_type, nko_id, content) VALUES ('example', ?, ?)",
+                    [(nko_id, post) for post in posts])
+
+    profile = refresh_style_profile(cur, nko_id)
+    assert profile["post_count"] == 3
+    assert f"около {sum(map(len, posts)) // 3} символов" in profile["digest"]
+    con.close()
+
+
+@pytest.mark.parametrize("total, expected", [(1, "примерно 1 на пост"), (3, "примерно 2 на пост"), (5, "примерно 2 на пост")])
+def test_digest_rounds_rates_to_at_least_one(total, expected):
+    profile = {
+        "post_count": 2, "total_chars": 200, "total_sentences": 4, "total_emoji": total,
+        "total_hashtags": 0, "total_exclamations": 0, "address_you_formal": 0,
+        "address_you_informal": 0, "top_emoji": {"🙂": total}, "top_hashtags": {}, "top_words": {},
+    }
+    assert expected in make_digest(profile)
@@ -0,0 +1,245 @@
+"""
+Трассировка апдейтов: у каждого апдейта (и у задания, которое он поставил в очередь)
+свой trace_id, а внутри — отрезки (spans): фильтры, FSM, запросы к базе, модель,
+Kandinsky, отправка в Telegram. Готовые трассы лежат в кольцевом буфере в памяти
+и при TRACE_EXPORT_PATH дописываются в JSONL-файл.
+
+Сводка по файлу — где уходит время в каждом обработчике:
+    python -m tracing traces.jsonl
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.storage.base import BaseStorage
+
+
+# сколько последних трасс держать в памяти; 0 — трассировка выключена
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+# файл, в который дописываются все трассы (по одной JSON-строке)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+
+traces = deque(maxlen=TRACE_BUFFER_SIZE or 1)
+
+_trace = ContextVar("trace", default=None)
+_parent = ContextVar("trace_parent", default=None)
+_export_file = None
+
+
+class Trace:
+    def __init__(self, name: str, parent_trace_id: str = None, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.parent_trace_id = parent_trace_id
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.spans = []
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "parent_trace_id": self.parent_trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "error": self.error,
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+def current_trace_id():
+    trace = _trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def annotate(**attrs):
+    """Добавляет поля к текущей трассе (например, имя обработчика)."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Отрезок внутри текущей трассы; вне трассы ничего не делает."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+
+    record = {"name": name, "parent": _parent.get(), "start": time.perf_counter() - trace._started, **attrs}
+    trace.spans.append(record)
+    token = _parent.set(len(trace.spans) - 1)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration"] = time.perf_counter() - started
+        _parent.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, parent_trace_id: str = None, **attrs):
+    if not TRACE_BUFFER_SIZE:
+        yield None
+        return
+
+    trace = Trace(name, parent_trace_id, **attrs)
+    trace_token = _trace.set(trace)
+    parent_token = _parent.set(None)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        trace.duration = time.perf_counter() - trace._started
+        _parent.reset(parent_token)
+        _trace.reset(trace_token)
+        _finish(trace)
+
+
+def detached_context():
+    """
+    Копия текущего контекста без трассы: фоновая задача, созданная с ним, не пишет
+    отрезки в трассу апдейта или задания, которая к тому времени уже закончена.
+    """
+    context = copy_context()
+    context.run(_trace.set, None)
+    context.run(_parent.set, None)
+    return context
+
+
+def _finish(trace: Trace):
+    global _export_file
+    traces.append(trace)
+    if TRACE_EXPORT_PATH:
+        if _export_file is None:
+            _export_file = open(TRACE_EXPORT_PATH, "a", encoding="utf-8")
+        _export_file.write(json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + "\n")
+        _export_file.flush()
+
+
+# --- aiogram ---
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: одна трасса на апдейт."""
+
+    async def __call__(self, handler, event, data):
+        chat = data.get("event_chat")
+        with start_trace(f"update:{event.event_type}", update_id=event.update_id,
+                         chat_id=getattr(chat, "id", None)):
+            return await handler(event, data)
+
+
+class HandlerSpanMiddleware(BaseMiddleware):
+    """Внутренний middleware: отрезок самого обработчика, уже после фильтров."""
+
+    async def __call__(self, handler, event, data):
+        name = getattr(getattr(data.get("handler"), "callback", None), "__name__", "unknown")
+        annotate(handler=name)
+        with span(f"handler:{name}"):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Каждый вызов Telegram Bot API — отрезок telegram:<метод>."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram:{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+class TracedStorage(BaseStorage):
+    """Обёртка над хранилищем FSM: get_data/update_data и прочие вызовы попадают в трассу."""
+
+    def __init__(self, storage: BaseStorage):
+        self.inner = storage
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    async def set_state(self, key, state=None):
+        with span("fsm:set_state"):
+            return await self.inner.set_state(key, state)
+
+    async def get_state(self, key):
+        with span("fsm:get_state"):
+            return await self.inner.get_state(key)
+
+    async def set_data(self, key, data):
+        with span("fsm:set_data"):
+            return await self.inner.set_data(key, data)
+
+    async def get_data(self, key):
+        with span("fsm:get_data"):
+            return await self.inner.get_data(key)
+
+    async def update_data(self, key, data):
+        with span("fsm:update_data"):
+            return await self.inner.update_data(key, data)
+
+    async def close(self):
+        await self.inner.close()
+
+
+def trace_dispatcher(dp):
+    dp.update.outer_middleware(TracingMiddleware())
+    dp.message.middleware(HandlerSpanMiddleware())
+    dp.callback_query.middleware(HandlerSpanMiddleware())
+
+
+def trace_bot(bot):
+    bot.session.middleware(TracingRequestMiddleware())
+    return bot
+
+
+# --- сводка ---
+def summarize(items):
+    """
+    Для каждого обработчика/задания: сколько трасс, среднее время и на что оно ушло
+    (сумма отрезков верхнего уровня по имени, без вложенных — чтобы не считать дважды).
+    """
+    groups = defaultdict(lambda: {"count": 0, "total": 0.0, "spans": defaultdict(float)})
+    for trace in items:
+        trace = trace.to_dict() if isinstance(trace, Trace) else trace
+        group = groups[trace.get("handler") or trace["name"]]
+        group["count"] += 1
+        group["total"] += trace["duration"] or 0.0
+        if trace.get("queue_wait") is not None:
+            # задание ждало воркера до начала трассы — показываем отдельной строкой
+            group["spans"]["job:queue_wait (до начала)"] += trace["queue_wait"]
+
+        spans = trace["spans"]
+        handler_span = next((i for i, s in enumerate(spans) if s["name"].startswith("handler:")), None)
+        for s in spans:
+            # внутри обработчика считаем его прямые дочерние отрезки, снаружи — верхний уровень
+            if s["parent"] == handler_span or (s["parent"] is None and not s["name"].startswith("handler:")):
+                group["spans"][s["name"]] += s.get("duration") or 0.0
+    return groups
+
+
+def print_summary(items):
+    for name, group in sorted(summarize(items).items(), key=lambda kv: -kv[1]["total"]):
+        count = group["count"]
+        print(f"{name}: {count} шт., в среднем {group['total'] / count * 1000:.1f} мс")
+        for span_name, total in sorted(group["spans"].items(), key=lambda kv: -kv[1]):
+            print(f"    {span_name:<36}{total / count * 1000:>10.1f} мс")
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], encoding="utf-8") as f:
+        print_summary(json.loads(line) for line in f if line.strip())